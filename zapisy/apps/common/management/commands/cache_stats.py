@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from apps.common import tagged_cache
+
+
+class Command(BaseCommand):
+    help = ("Prints the hit ratios of the tagged caches and the numbers of invalidations of "
+            "every kind of tag. Counters are buffered in the processes for a while, so the "
+            "latest events may be missing.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="Reset the counters afterwards")
+
+    def handle(self, *args, **kwargs):
+        tagged_cache.flush_stats()
+        counters = tagged_cache.get_stats()
+        names = sorted({c.rsplit(':', 1)[0] for c in counters if c.endswith((':hits', ':misses'))})
+        for name in names:
+            hits, misses = counters.get(f'{name}:hits', 0), counters.get(f'{name}:misses', 0)
+            self.stdout.write(f"{name}: {hits} hits, {misses} misses, "
+                              f"hit ratio {hits / (hits + misses):.1%}")
+        for counter in sorted(c for c in counters if c.endswith(':invalidations')):
+            self.stdout.write(f"{counter.rsplit(':', 1)[0]}: {counters[counter]} invalidations")
+        if kwargs["reset"]:
+            tagged_cache.reset_stats()
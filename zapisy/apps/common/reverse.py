@@ -0,0 +1,18 @@
+from typing import Callable
+
+from django.urls import reverse
+
+# Substituted for the argument when reversing URL templates.
+URL_ARGUMENT_PLACEHOLDER = 987654321
+
+
+def url_template(viewname: str) -> Callable[[object], str]:
+    """Reverses the URL once and returns a function filling in its argument.
+
+    It is equivalent to `lambda arg: reverse(viewname, args=(arg,))` for
+    arguments that need no quoting (ids and slugs), but it does not resolve the
+    URL pattern every time.
+    """
+    prefix, suffix = reverse(viewname, args=(URL_ARGUMENT_PLACEHOLDER, )).rsplit(
+        str(URL_ARGUMENT_PLACEHOLDER), 1)
+    return lambda arg: f'{prefix}{arg}{suffix}'
@@ -0,0 +1,179 @@
+"""Cache of values invalidated by the data they depend on.
+
+A cached value is stored together with the tags of the data it depends on, for
+example `terms:semester:12` or `terms:room:3`. Every tag has a version kept in
+the cache and the value is stored under a key containing the versions of its
+tags (hashed, so that the key stays short however many tags there are).
+Invalidating a tag replaces its version, so all the values depending on
+it are missed from then on (and eventually expire), while the values depending
+on other tags stay. Nothing is ever deleted from the cache, so there is no need
+to know which keys depend on a tag.
+
+Tags are invalidated once the current transaction commits, so that the values
+are not rebuilt from data that is about to change.
+
+Hits and misses of every named cache, and invalidations of every kind of tag
+(the first two parts of a tag, e.g. `terms:room`), are counted. The counters
+are buffered in the process and added to a Redis hash every now and then. See
+the `cache_stats` command.
+"""
+import collections
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, List
+
+import django_rq
+import redis
+from django.core.cache import cache
+from django.db import connection, transaction
+
+LOGGER = logging.getLogger(__name__)
+
+TAG_KEY_PREFIX = 'tags:'
+
+STATS_KEY_PREFIX = 'cache:stats:'
+# The buffered counters are flushed to Redis after this many events or seconds.
+STATS_FLUSH_EVENTS = 500
+STATS_FLUSH_INTERVAL = 30
+
+_stats = collections.Counter()
+_stats_lock = threading.Lock()
+_stats_flushed_at = time.monotonic()
+
+
+def tag(*parts) -> str:
+    """Joins the parts of a tag, e.g. `terms`, `room` and 3 into `terms:room:3`."""
+    return ':'.join(str(part) for part in parts)
+
+
+def _new_version() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def get_versions(tags: Iterable[str]) -> List[str]:
+    """Returns the current versions of the tags, in order."""
+    tags = list(tags)
+    keys = [TAG_KEY_PREFIX + t for t in tags]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Some other process may be creating the version at the same time.
+            new_version = _new_version()
+            cache.add(key, new_version, None)
+            versions[key] = cache.get(key, new_version)
+    return [versions[key] for key in keys]
+
+
+def version(tags: Iterable[str]) -> str:
+    """Returns a string that changes whenever any of the tags is invalidated."""
+    return '-'.join(get_versions(tags))
+
+
+def _cache_key(name: str, key: str, versions: Iterable[str]) -> str:
+    digest = hashlib.sha1('-'.join(versions).encode()).hexdigest()
+    return f'{name}:{key}:{digest}'
+
+
+def get_or_build(name: str, key: str, tags: Iterable[str], build: Callable[[], Any],
+                 timeout: int) -> Any:
+    """Returns the value cached in the named cache, building it on a miss.
+
+    The value is built with `build()` and must not be None.
+    """
+    cache_key = _cache_key(name, key, get_versions(tags))
+    value = cache.get(cache_key)
+    if value is not None:
+        _count(f'{name}:hits')
+        return value
+    _count(f'{name}:misses')
+    value = build()
+    cache.set(cache_key, value, timeout)
+    return value
+
+
+def get_many_or_build(name: str, tags: Dict[str, List[str]],
+                      build: Callable[[List[str]], Dict[str, Any]], timeout: int) -> Dict[str, Any]:
+    """Returns many values cached in the named cache, building the missing ones at once.
+
+    Args:
+        tags: Maps the keys of the values to the tags they depend on.
+        build: Given the list of missing keys returns their values (not None).
+    """
+    all_tags = sorted({t for key_tags in tags.values() for t in key_tags})
+    versions = dict(zip(all_tags, get_versions(all_tags)))
+    cache_keys = {
+        key: _cache_key(name, key, (versions[t] for t in key_tags))
+        for key, key_tags in tags.items()
+    }
+    cached = cache.get_many(cache_keys.values())
+    values = {key: cached[cache_key] for key, cache_key in cache_keys.items() if cache_key in cached}
+    missing = [key for key in tags if key not in values]
+    _count(f'{name}:hits', len(values))
+    _count(f'{name}:misses', len(missing))
+    if missing:
+        built = build(missing)
+        cache.set_many({cache_keys[key]: built[key] for key in missing}, timeout)
+        values.update(built)
+    return values
+
+
+def _invalidate_now(tags: List[str]):
+    cache.set_many({TAG_KEY_PREFIX + t: _new_version() for t in tags}, None)
+    for t in tags:
+        _count(f'{":".join(t.split(":")[:2])}:invalidations')
+
+
+def invalidate(*tags: str):
+    """Invalidates the values depending on the tags, once the transaction commits."""
+    tags = sorted(set(tags))
+    if tags:
+        transaction.on_commit(lambda: _invalidate_now(tags))
+
+
+def _stats_key() -> str:
+    return f'{STATS_KEY_PREFIX}{connection.settings_dict["NAME"]}'
+
+
+def _count(counter: str, amount: int = 1):
+    if not amount:
+        return
+    with _stats_lock:
+        _stats[counter] += amount
+        due = (sum(_stats.values()) >= STATS_FLUSH_EVENTS or
+               time.monotonic() - _stats_flushed_at >= STATS_FLUSH_INTERVAL)
+    if due:
+        flush_stats()
+
+
+def flush_stats():
+    """Adds the counters buffered in this process to the ones in Redis."""
+    global _stats_flushed_at
+    with _stats_lock:
+        counters = dict(_stats)
+        _stats.clear()
+        _stats_flushed_at = time.monotonic()
+    if not counters:
+        return
+    try:
+        pipe = django_rq.get_connection().pipeline(transaction=False)
+        for counter, value in counters.items():
+            pipe.hincrby(_stats_key(), counter, value)
+        pipe.execute()
+    except redis.RedisError:
+        LOGGER.exception('Could not store the cache statistics.')
+
+
+def get_stats() -> Dict[str, int]:
+    """Returns the counters stored in Redis (`<name>:hits`, `<kind>:invalidations` etc)."""
+    stored = django_rq.get_connection().hgetall(_stats_key())
+    return {counter.decode(): int(value) for counter, value in stored.items()}
+
+
+def reset_stats():
+    """Drops the stored and the buffered counters."""
+    with _stats_lock:
+        _stats.clear()
+    django_rq.get_connection().delete(_stats_key())
@@ -1,3 +1,5 @@
+import time
+
 from django.contrib import admin, messages
 from django.contrib.admin import SimpleListFilter
 
@@ -60,10 +62,13 @@ class SemesterAdmin(admin.ModelAdmin):
             self.message_user(request, "Trzeba wybrać pojedynczy semestr!", level=messages.ERROR)
             return
         semester = queryset.get()
-        T0Times.populate_t0(semester)
-        GroupOpeningTimes.populate_opening_times(semester)
+        start = time.monotonic()
+        num_t0 = T0Times.populate_t0(semester)
+        num_opening_times = GroupOpeningTimes.populate_opening_times(semester)
         self.message_user(request,
-                          f"Obliczono czasy otwarcia zapisów dla semestru {semester}.",
+                          f"Obliczono czasy otwarcia zapisów dla semestru {semester} "
+                          f"({num_t0} T0, {num_opening_times} czasów otwarcia grup) "
+                          f"w {time.monotonic() - start:.1f} s.",
                           level=messages.SUCCESS)
 
     refresh_opening_times.short_description = "Oblicz czasy otwarcia zapisów"
@@ -171,6 +176,11 @@ class GroupAdmin(admin.ModelAdmin):
         return qs.select_related('teacher', 'teacher__user', 'course',
                                  'course__semester').prefetch_related('term', 'record_set')
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Records could have been modified in RecordInline.
+        Record.invalidate_groups_stats([form.instance.pk])
+
 
 @admin.register(CourseInstance)
 class CourseInstanceAdmin(admin.ModelAdmin):
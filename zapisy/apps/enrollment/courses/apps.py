@@ -0,0 +1,13 @@
+"""Django app config for enrollment.courses.
+
+(See https://docs.djangoproject.com/en/2.0/ref/applications/).
+"""
+
+from django.apps import AppConfig
+
+
+class CoursesAppConfig(AppConfig):
+    name = 'apps.enrollment.courses'
+
+    def ready(self):
+        import apps.enrollment.courses.catalogue  # noqa
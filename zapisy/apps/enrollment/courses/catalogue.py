@@ -0,0 +1,124 @@
+"""Cached course catalogue of a semester.
+
+The course list, course and group pages and the timetable prototype all show the
+list of courses in the semester together with the data for course filters. It
+is the same for every visitor, so it is built once and cached per semester.
+
+The cached catalogue depends on the tag of its semester, invalidated whenever a
+course or a group of the semester changes, and on a global tag, invalidated
+when any tag, effect or course type changes (these are shared by all the
+semesters). The versions of the tags also serve as the ETag of the course list,
+so browsers only download the list when it has changed.
+"""
+import json
+from typing import Dict, List, NamedTuple, Optional
+
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.urls import reverse
+
+from apps.common import tagged_cache
+from apps.enrollment.courses.models import CourseInstance, Group, Semester
+from apps.enrollment.courses.models.course_type import Type
+from apps.enrollment.courses.models.effects import Effects
+from apps.enrollment.courses.models.tag import Tag
+
+CATALOGUE_CACHE_TIMEOUT = 60 * 60
+GLOBAL_TAG = 'catalogue'
+
+
+class Catalogue(NamedTuple):
+    """Course catalogue of a semester.
+
+    `courses` is the list of serialized courses (see `CourseInstance.__json__`)
+    with URLs of their pages. `filters` is the data for course filters. Both
+    are also JSON-encoded, ready to be embedded in a page or served.
+    """
+    version: str
+    courses: List[Dict]
+    filters: Dict
+    courses_json: str
+    filters_json: str
+
+
+def _tags(semester_id: int) -> List[str]:
+    return [GLOBAL_TAG, tagged_cache.tag(GLOBAL_TAG, 'semester', semester_id)]
+
+
+def get_version(semester_id: int) -> str:
+    """Returns the current version of the semester catalogue."""
+    return tagged_cache.version(_tags(semester_id))
+
+
+def invalidate(semester_id: Optional[int] = None):
+    """Invalidates the semester catalogue once the transaction commits.
+
+    If no semester is given, the catalogues of all the semesters are invalidated.
+    """
+    if semester_id is None:
+        tagged_cache.invalidate(GLOBAL_TAG)
+    else:
+        tagged_cache.invalidate(tagged_cache.tag(GLOBAL_TAG, 'semester', semester_id))
+
+
+def _build(semester: Optional[Semester], version: str) -> Catalogue:
+    qs = CourseInstance.objects.filter(semester=semester).order_by('name')
+    courses = []
+    for course in qs.prefetch_related('effects', 'tags'):
+        course_dict = course.__json__()
+        course_dict.update({
+            'url': reverse('course-page', args=(course.slug,)),
+        })
+        courses.append(course_dict)
+    filters = CourseInstance.prepare_filter_data(qs)
+    return Catalogue(version=version, courses=courses, filters=filters,
+                     courses_json=json.dumps(courses), filters_json=json.dumps(filters))
+
+
+def get_catalogue(semester: Optional[Semester]) -> Catalogue:
+    """Returns the course catalogue of the semester, from cache if possible."""
+    if semester is None:
+        return _build(None, '')
+    tags = _tags(semester.pk)
+    return tagged_cache.get_or_build(
+        'catalogue', str(semester.pk), tags, lambda: _build(semester, tagged_cache.version(tags)),
+        CATALOGUE_CACHE_TIMEOUT)
+
+
+@receiver(post_save, sender=CourseInstance)
+@receiver(post_delete, sender=CourseInstance)
+def course_changed(sender, instance: CourseInstance, **kwargs):
+    invalidate(instance.semester_id)
+
+
+@receiver(m2m_changed, sender=CourseInstance.tags.through)
+@receiver(m2m_changed, sender=CourseInstance.effects.through)
+def course_labels_changed(sender, instance, action: str, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if kwargs['reverse']:
+        # A tag or an effect was (un)assigned to courses, perhaps in many
+        # semesters.
+        invalidate()
+    elif isinstance(instance, CourseInstance):
+        invalidate(instance.semester_id)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance: Group, **kwargs):
+    # The course may already be gone, if it is being deleted with its groups.
+    semester_id = CourseInstance.objects.filter(pk=instance.course_id).values_list(
+        'semester_id', flat=True).first()
+    if semester_id is not None:
+        invalidate(semester_id)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Effects)
+@receiver(post_delete, sender=Effects)
+@receiver(post_save, sender=Type)
+@receiver(post_delete, sender=Type)
+def label_changed(sender, **kwargs):
+    invalidate()
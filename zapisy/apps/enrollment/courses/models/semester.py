@@ -1,15 +1,20 @@
-from datetime import datetime, timedelta
-from typing import List, Optional, Tuple
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
 
 from django.conf import settings
 from django.core.exceptions import MultipleObjectsReturned
 from django.core.validators import ValidationError
 from django.db import models
+from django.db.models import CharField, Value
+from django.dispatch import receiver
 
-from apps.common import days_of_week
+from apps.common import days_of_week, tagged_cache
 
 from .term import Term
 
+CALENDAR_CACHE_TIMEOUT = 24 * 60 * 60
+CALENDAR_TAG = 'calendar'
+
 
 class Semester(models.Model):
     """Semester in academic year."""
@@ -121,41 +126,76 @@ class Semester(models.Model):
             return False
         return self.semester_beginning <= datetime.now().date() <= self.semester_ending
 
+    def get_calendar(self) -> Dict[date, Optional[str]]:
+        """Maps every day of the semester to the day of week it follows.
+
+        The calendar spans the semester and its lectures. Free days are mapped
+        to None and changed days to the day of week they are changed to. It is
+        computed with a single query and cached until a free day or a changed
+        day is modified.
+        """
+        first_day, last_day = self._calendar_range()
+
+        def build() -> Dict[date, Optional[str]]:
+            calendar = {}
+            day = first_day
+            while day <= last_day:
+                calendar[day] = Term.get_day_of_week(day)
+                day += timedelta(days=1)
+            # Free days are listed with no weekday.
+            exceptions = Freeday.objects.filter(day__gte=first_day, day__lte=last_day).values_list(
+                'day', Value(None, output_field=CharField())).union(
+                    ChangedDay.objects.filter(day__gte=first_day, day__lte=last_day).values_list(
+                        'day', 'weekday'), all=True)
+            free_days = set()
+            for day, weekday in exceptions:
+                if weekday is None:
+                    free_days.add(day)
+                calendar[day] = None if day in free_days else weekday
+            return calendar
+
+        return tagged_cache.get_or_build('calendar', f'{first_day}:{last_day}', [CALENDAR_TAG],
+                                         build, CALENDAR_CACHE_TIMEOUT)
+
+    def _calendar_range(self) -> Tuple[date, date]:
+        days = [_as_date(d) for d in (self.semester_beginning, self.semester_ending,
+                                      self.lectures_beginning, self.lectures_ending) if d]
+        return min(days), max(days)
+
+    def get_day_of_week(self, day: date) -> Optional[str]:
+        """Returns the day of week the day follows, or None if it is free.
+
+        Days outside the semester follow their natural day of week.
+        """
+        day = _as_date(day)
+        calendar = self.get_calendar()
+        if day in calendar:
+            return calendar[day]
+        return Term.get_day_of_week(day)
+
+    def get_lecture_days(self) -> Dict[date, str]:
+        """Maps the days with lectures to the day of week they follow."""
+        calendar = self.get_calendar()
+        beginning, ending = _as_date(self.lectures_beginning), _as_date(self.lectures_ending)
+        return {
+            day: weekday
+            for day, weekday in calendar.items()
+            if weekday is not None and beginning <= day <= ending
+        }
+
     def get_all_days_of_week(self, day_of_week, start_date=None):
         """Get all dates when the specifies day of week schedule is valid.
 
+        The dates are resolved with the semester calendar, see `get_calendar`.
+
         :param day_of_week: DAYS_OF_WEEK
         :param start_date: datetime.date
         """
-        date = self.lectures_beginning
-        if start_date:
-            date = start_date
-        python_weekday = Term.get_python_day_of_week(day_of_week)
-
-        # ensure first date in while loop is a candidate
-        if date.weekday() < python_weekday:
-            date += timedelta(days=python_weekday - date.weekday())
-        elif date.weekday() == python_weekday:
-            pass
-        else:
-            date += timedelta(days=7 - date.weekday() + python_weekday)
-
-        assert Term.get_day_of_week(date) == day_of_week
-
-        dates = []
-        while date <= self.lectures_ending:
-            # if its not a free day
-            if not Freeday.is_free(date):
-                # if it wasnt changed
-                if ChangedDay.get_day_of_week(date) == day_of_week:
-                    # add to list
-                    dates.append(date)
-            # move date to next week
-            date += timedelta(days=7)
-
-        dates.extend(self.get_all_added_days_of_week(day_of_week, start_date))
-
-        return dates
+        start_date = _as_date(start_date) if start_date else None
+        return [
+            day for day, weekday in self.get_lecture_days().items()
+            if weekday == day_of_week and (start_date is None or day >= start_date)
+        ]
 
     def get_all_added_days_of_week(self, day_of_week, start_date=None):
         """Finds all days with switched weekday.
@@ -166,14 +206,10 @@ class Semester(models.Model):
                 are returned. Otherwise the search is limited to the current
                 semester.
         """
-        from_date = self.lectures_beginning
-        if start_date:
-            from_date = start_date
-
-        added_days = ChangedDay.get_added_days_of_week(from_date,
-                                                       self.lectures_ending,
-                                                       day_of_week)
-        return [x.day for x in added_days]
+        return [
+            day for day in self.get_all_days_of_week(day_of_week, start_date)
+            if Term.get_day_of_week(day) != day_of_week
+        ]
 
     def get_all_weeks(self) -> List[Tuple[datetime, datetime]]:
         """Returns list of all weeks in semester.
@@ -319,7 +355,7 @@ class ChangedDay(models.Model):
         """
         changes = ChangedDay.objects.filter(day=date)
         if changes:
-            return changes[0].day
+            return changes[0].weekday
         else:
             return Term.get_day_of_week(date)
 
@@ -338,3 +374,17 @@ class ChangedDay(models.Model):
         verbose_name = 'dzień zmienony na inny'
         verbose_name_plural = 'dni zmienione na inne'
         app_label = 'courses'
+
+
+def _as_date(day) -> date:
+    if isinstance(day, datetime):
+        return day.date()
+    return day
+
+
+@receiver(models.signals.post_save, sender=Freeday)
+@receiver(models.signals.post_delete, sender=Freeday)
+@receiver(models.signals.post_save, sender=ChangedDay)
+@receiver(models.signals.post_delete, sender=ChangedDay)
+def calendar_changed(sender, **kwargs):
+    tagged_cache.invalidate(CALENDAR_TAG)
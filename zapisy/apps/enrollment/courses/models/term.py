@@ -1,11 +1,11 @@
 import logging
 from datetime import date, time
+from typing import Iterable
 
-from django.core.cache import cache as mcache
 from django.db import models
-from django.db.models import signals
+from django.db.models import QuerySet, signals
 
-from apps.common import days_of_week
+from apps.common import days_of_week, tagged_cache
 
 backup_logger = logging.getLogger('project.backup')
 
@@ -119,16 +119,15 @@ class Term(models.Model):
         :param semester: enrollment.courses.model.Semester
         :param day: DAYS_OF_WEEK or datetime.date
         """
-        from .semester import ChangedDay, Freeday
         query = cls.objects.filter(group__course__semester=semester)
 
         if day is None:
             pass
         else:
             if isinstance(day, date):
-                if Freeday.is_free(day):
+                day_of_week = semester.get_day_of_week(day)
+                if day_of_week is None:
                     return cls.objects.none()
-                day_of_week = ChangedDay.get_day_of_week(day)
             else:
                 day_of_week = day
             query = query.filter(dayOfWeek=day_of_week)
@@ -165,9 +164,64 @@ class Term(models.Model):
         )
 
 
-def recache(sender, **kwargs):
-    mcache.clear()
-
-
-signals.post_save.connect(recache, sender=Term)
-signals.post_delete.connect(recache, sender=Term)
+def cache_tag(kind: str, pk: int) -> str:
+    """Tag of cached values depending on the terms of a semester, group or room.
+
+    Args:
+        kind: 'semester', 'group' or 'room'.
+    """
+    return tagged_cache.tag('terms', kind, pk)
+
+
+def invalidate_cached_terms(terms: QuerySet, room_ids: Iterable[int] = ()):
+    """Invalidates the cached values depending on the terms.
+
+    These are the values tagged with the semesters and the groups of the terms
+    and with their rooms (including `room_ids`).
+    """
+    tags = {cache_tag('room', room_id) for room_id in room_ids}
+    for group_id, semester_id, room_id in terms.values_list(
+            'group_id', 'group__course__semester_id', 'classrooms'):
+        tags.add(cache_tag('group', group_id))
+        if semester_id is not None:
+            tags.add(cache_tag('semester', semester_id))
+        if room_id is not None:
+            tags.add(cache_tag('room', room_id))
+    tagged_cache.invalidate(*tags)
+
+
+def term_moving(sender, instance: Term, **kwargs):
+    """Remembers the group and the semester of the term before it is saved."""
+    if instance.pk:
+        instance._previous_group = Term.objects.filter(pk=instance.pk).values_list(
+            'group_id', 'group__course__semester_id').first()
+
+
+def term_changed(sender, instance: Term, **kwargs):
+    # Before a term is deleted, its classrooms are still there.
+    invalidate_cached_terms(Term.objects.filter(pk=instance.pk))
+    # The term may have been moved to another group (or semester).
+    previous = getattr(instance, '_previous_group', None)
+    if previous is not None:
+        group_id, semester_id = previous
+        tags = [cache_tag('group', group_id)]
+        if semester_id is not None:
+            tags.append(cache_tag('semester', semester_id))
+        tagged_cache.invalidate(*tags)
+
+
+def term_classrooms_changed(sender, instance, action: str, reverse: bool, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        invalidate_cached_terms(Term.objects.filter(pk=instance.pk), pk_set or ())
+    elif pk_set is not None:
+        invalidate_cached_terms(Term.objects.filter(pk__in=pk_set), [instance.pk])
+    else:
+        invalidate_cached_terms(Term.objects.filter(classrooms=instance), [instance.pk])
+
+
+signals.pre_save.connect(term_moving, sender=Term)
+signals.post_save.connect(term_changed, sender=Term)
+signals.pre_delete.connect(term_changed, sender=Term)
+signals.m2m_changed.connect(term_classrooms_changed, sender=Term.classrooms.through)
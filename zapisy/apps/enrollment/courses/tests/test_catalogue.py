@@ -0,0 +1,75 @@
+"""Tests for the cached course catalogue."""
+import json
+
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+
+from apps.enrollment.courses import catalogue
+from apps.enrollment.courses.models.tag import Tag
+from apps.enrollment.courses.tests.factories import CourseInstanceFactory, SemesterFactory
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalogue-tests',
+    }
+})
+class CatalogueTest(TransactionTestCase):
+    """The versions are replaced on commit, hence the TransactionTestCase."""
+
+    def setUp(self):
+        cache.clear()
+        self.semester = SemesterFactory()
+        self.course = CourseInstanceFactory(semester=self.semester, name="Szydełkowanie")
+        self.other_semester = SemesterFactory()
+        CourseInstanceFactory(semester=self.other_semester, name="Gotowanie")
+
+    def test_catalogue_is_cached(self):
+        first = catalogue.get_catalogue(self.semester)
+        self.assertListEqual([c['name'] for c in first.courses], ["Szydełkowanie"])
+        self.assertEqual(first.courses[0]['url'], reverse('course-page', args=(self.course.slug,)))
+        self.assertListEqual(json.loads(first.courses_json), first.courses)
+        with self.assertNumQueries(0):
+            self.assertEqual(catalogue.get_catalogue(self.semester), first)
+
+    def test_version_changes_with_courses_and_labels(self):
+        version = catalogue.get_version(self.semester.pk)
+        other_version = catalogue.get_version(self.other_semester.pk)
+
+        self.course.name = "Szydełkowanie zaawansowane"
+        self.course.save()
+        self.assertNotEqual(catalogue.get_version(self.semester.pk), version)
+        self.assertEqual(catalogue.get_version(self.other_semester.pk), other_version)
+        self.assertEqual(catalogue.get_catalogue(self.semester).courses[0]['name'],
+                         "Szydełkowanie zaawansowane")
+
+        version = catalogue.get_version(self.semester.pk)
+        tag = Tag.objects.create(short_name="SZ", full_name="Szydełko", description="")
+        self.assertNotEqual(catalogue.get_version(self.semester.pk), version)
+        self.assertNotEqual(catalogue.get_version(self.other_semester.pk), other_version)
+
+        version = catalogue.get_version(self.semester.pk)
+        self.course.tags.add(tag)
+        self.assertNotEqual(catalogue.get_version(self.semester.pk), version)
+        self.assertListEqual(catalogue.get_catalogue(self.semester).courses[0]['tags'], [tag.pk])
+
+    def test_course_list_is_revalidated(self):
+        url = reverse('semester-courses', args=(self.semester.pk,))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['name'], "Szydełkowanie")
+        self.assertIn('no-cache', response['Cache-Control'])
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.course.name = "Szydełkowanie zaawansowane"
+        self.course.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()[0]['name'], "Szydełkowanie zaawansowane")
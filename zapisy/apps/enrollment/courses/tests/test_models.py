@@ -1,7 +1,8 @@
 from datetime import date, datetime, timedelta
 
+from django.core.cache import cache
 from django.core.validators import ValidationError
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
 
 from apps.common import days_of_week
 from apps.enrollment.courses.models.semester import ChangedDay, Freeday, Semester
@@ -78,8 +79,12 @@ class ChangedDayTestCase(TestCase):
         self.assertRaises(ValidationError, changed_day.clean)
 
 
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
 class SemesterTestCase(TestCase):
+    """Calendars are cached and invalidated on commit only, hence a clean local cache."""
+
     def setUp(self):
+        cache.clear()
         semester1 = SemesterObjectMother.summer_semester_2015_16()
         semester1.save()
 
@@ -116,6 +121,48 @@ class SemesterTestCase(TestCase):
         sundays_added = winter_semester.get_all_added_days_of_week(days_of_week.SUNDAY)
         self.assertTrue(sundays_added)
 
+    def test_calendar_resolves_days(self):
+        winter_semester = Semester.get_semester(datetime(2015, 12, 1))
+        Freeday.objects.create(day=date(2015, 12, 7))
+        # Free days take precedence over changed days.
+        Freeday.objects.create(day=date(2015, 12, 8))
+        ChangedDay.objects.create(day=date(2015, 12, 8), weekday=days_of_week.MONDAY)
+        with self.assertNumQueries(1):
+            mondays = winter_semester.get_all_days_of_week(days_of_week.MONDAY)
+        fridays = winter_semester.get_all_days_of_week(days_of_week.FRIDAY)
+        self.assertNotIn(date(2015, 12, 7), mondays)
+        self.assertNotIn(date(2015, 12, 8), mondays)
+        self.assertIn(date(2015, 11, 30), mondays)
+        self.assertListEqual(mondays, sorted(mondays))
+        self.assertNotIn(date(2015, 10, 16), fridays)
+        self.assertIn(date(2015, 10, 23), fridays)
+        self.assertIsNone(winter_semester.get_day_of_week(date(2015, 12, 8)))
+        self.assertEqual(winter_semester.get_day_of_week(date(2015, 10, 16)), days_of_week.SUNDAY)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SemesterCalendarCacheTestCase(TransactionTestCase):
+    """The cache is invalidated once the transaction commits, hence the TransactionTestCase."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_calendar_is_cached_until_days_change(self):
+        semester = SemesterObjectMother.winter_semester_2015_16()
+        semester.save()
+        monday = date(2015, 12, 7)
+        self.assertIn(monday, semester.get_all_days_of_week(days_of_week.MONDAY))
+        with self.assertNumQueries(0):
+            self.assertIn(monday, semester.get_all_days_of_week(days_of_week.MONDAY))
+
+        Freeday.objects.create(day=monday)
+        self.assertNotIn(monday, semester.get_all_days_of_week(days_of_week.MONDAY))
+
+        changed_day = ChangedDay.objects.create(day=date(2015, 12, 9), weekday=days_of_week.MONDAY)
+        self.assertIn(changed_day.day, semester.get_all_days_of_week(days_of_week.MONDAY))
+        changed_day.delete()
+        self.assertNotIn(changed_day.day, semester.get_all_days_of_week(days_of_week.MONDAY))
+
 
 class CourseInstanceTestCase(TestCase):
     def test_create_course_from_proposal(self):
@@ -0,0 +1,116 @@
+"""Tests for the invalidation of cached values depending on course terms."""
+from datetime import time
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TransactionTestCase, override_settings
+
+from apps.common import tagged_cache
+from apps.enrollment.courses import catalogue
+from apps.enrollment.courses.models.term import Term, cache_tag
+from apps.enrollment.courses.tests.factories import (ClassroomFactory, GroupFactory,
+                                                     SemesterFactory)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'term-cache-tests',
+    }
+})
+class TermCacheTest(TransactionTestCase):
+    """Tags are invalidated on commit, hence the TransactionTestCase."""
+
+    def setUp(self):
+        cache.clear()
+        tagged_cache.reset_stats()
+        self.addCleanup(tagged_cache.reset_stats)
+        self.semester = SemesterFactory()
+        self.group = GroupFactory(course__semester=self.semester)
+        self.other_group = GroupFactory(course__semester=SemesterFactory())
+        self.room = ClassroomFactory()
+        self.other_room = ClassroomFactory()
+        self.term = Term.objects.create(group=self.group, dayOfWeek='1', start_time=time(10),
+                                        end_time=time(12))
+        self.term.classrooms.add(self.room)
+
+    def versions(self):
+        return {
+            'semester': tagged_cache.version([cache_tag('semester', self.semester.pk)]),
+            'group': tagged_cache.version([cache_tag('group', self.group.pk)]),
+            'room': tagged_cache.version([cache_tag('room', self.room.pk)]),
+            'other_room': tagged_cache.version([cache_tag('room', self.other_room.pk)]),
+        }
+
+    def test_only_dependent_tags_are_invalidated(self):
+        catalogue_version = catalogue.get_version(self.semester.pk)
+        before = self.versions()
+        other_term = Term.objects.create(group=self.other_group, dayOfWeek='2',
+                                         start_time=time(8), end_time=time(10))
+        other_term.classrooms.add(self.other_room)
+        after = self.versions()
+        self.assertEqual(after['semester'], before['semester'])
+        self.assertEqual(after['group'], before['group'])
+        self.assertEqual(after['room'], before['room'])
+        self.assertNotEqual(after['other_room'], before['other_room'])
+
+        before = self.versions()
+        self.term.start_time = time(9)
+        self.term.save()
+        after = self.versions()
+        self.assertNotEqual(after['semester'], before['semester'])
+        self.assertNotEqual(after['group'], before['group'])
+        self.assertNotEqual(after['room'], before['room'])
+        # The catalogue does not depend on terms.
+        self.assertEqual(catalogue.get_version(self.semester.pk), catalogue_version)
+
+    def test_moving_to_another_group(self):
+        other_tags = [cache_tag('group', self.other_group.pk),
+                      cache_tag('semester', self.other_group.course.semester_id)]
+        before = self.versions()
+        other_version = tagged_cache.version(other_tags)
+        self.term.group = self.other_group
+        self.term.save()
+        after = self.versions()
+        # The term is gone from the old group and semester, and is new in the others.
+        self.assertNotEqual(after['group'], before['group'])
+        self.assertNotEqual(after['semester'], before['semester'])
+        self.assertNotEqual(tagged_cache.version(other_tags), other_version)
+
+    def test_changes_of_classrooms_and_deletion(self):
+        room_tag = cache_tag('room', self.other_room.pk)
+        version = tagged_cache.version([room_tag])
+        self.term.classrooms.add(self.other_room)
+        self.assertNotEqual(tagged_cache.version([room_tag]), version)
+
+        version = tagged_cache.version([room_tag])
+        self.term.classrooms.clear()
+        self.assertNotEqual(tagged_cache.version([room_tag]), version)
+
+        self.term.classrooms.add(self.room)
+        version = tagged_cache.version([cache_tag('room', self.room.pk)])
+        self.term.delete()
+        self.assertNotEqual(tagged_cache.version([cache_tag('room', self.room.pk)]), version)
+
+    def test_cached_value_and_stats(self):
+        tags = [cache_tag('room', self.room.pk)]
+        builds = []
+
+        def build():
+            builds.append(1)
+            return len(builds)
+
+        self.assertEqual(tagged_cache.get_or_build('test', 'key', tags, build, 60), 1)
+        self.assertEqual(tagged_cache.get_or_build('test', 'key', tags, build, 60), 1)
+        self.term.classrooms.remove(self.room)
+        self.assertEqual(tagged_cache.get_or_build('test', 'key', tags, build, 60), 2)
+
+        tagged_cache.flush_stats()
+        stats = tagged_cache.get_stats()
+        self.assertEqual(stats['test:hits'], 1)
+        self.assertEqual(stats['test:misses'], 2)
+        self.assertGreaterEqual(stats['terms:room:invalidations'], 1)
+        out = StringIO()
+        call_command('cache_stats', stdout=out)
+        self.assertIn("test: 1 hits, 2 misses, hit ratio 33.3%", out.getvalue())
@@ -16,6 +16,7 @@ urlpatterns = [
     path('<slug:course_slug>/list', views.course_list_view, name='course-student-list'),
     path('<slug:course_slug>/<int:class_type>/list', views.course_list_view, name='class-type-student-list'),
     path('semester/<int:semester_id>', views.courses_list, name='courses-semester'),
+    path('semester/<int:semester_id>/courses.json', views.semester_courses, name='semester-courses'),
     path('group/<int:group_id>', views.group_view, name='group-view'),
     path('group/<int:group_id>/group/csv', views.group_enrolled_csv, name='group-csv'),
     path('group/<int:group_id>/queue/csv', views.group_queue_csv, name='queue-csv'),
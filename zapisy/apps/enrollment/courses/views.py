@@ -1,5 +1,4 @@
 import csv
-import json
 import locale
 from typing import Dict, Iterable, List, Optional, Tuple, TypedDict
 
@@ -9,7 +8,11 @@ from django.db.models import Min
 from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.http import condition
 
+from apps.enrollment.courses import catalogue
 from apps.enrollment.courses.models.course_instance import CourseInstance
 from apps.enrollment.courses.models.group import Group, GuaranteedSpots
 from apps.enrollment.courses.models.semester import Semester
@@ -29,25 +32,39 @@ class GroupData(TypedDict):
 
 
 def prepare_courses_list_data(semester: Optional[Semester]):
-    """Returns a dict used by course list and filter in various views."""
-    qs = CourseInstance.objects.filter(semester=semester).order_by('name')
-    courses = []
-    for course in qs.prefetch_related('effects', 'tags'):
-        course_dict = course.__json__()
-        course_dict.update({
-            'url': reverse('course-page', args=(course.slug,)),
-        })
-        courses.append(course_dict)
-    filters_dict = CourseInstance.prepare_filter_data(qs)
+    """Returns a dict used by course list and filter in various views.
+
+    The list of courses is not embedded in the page. It is downloaded from
+    `courses_url` instead, so the browser can keep it between pages.
+    """
     all_semesters = Semester.objects.filter(visible=True)
     return {
         'semester': semester,
         'all_semesters': all_semesters,
-        'courses_json': json.dumps(courses),
-        'filters_json': json.dumps(filters_dict),
+        'courses_url': reverse('semester-courses', args=(semester.pk,)) if semester else None,
+        'filters_json': catalogue.get_catalogue(semester).filters_json,
     }
 
 
+def _courses_etag(request, semester_id: int) -> str:
+    return catalogue.get_version(semester_id)
+
+
+@condition(etag_func=_courses_etag)
+def semester_courses(request, semester_id: int):
+    """Serves the JSON list of courses in the semester.
+
+    The list is tagged with the version of the semester catalogue. Browsers keep
+    it and only revalidate it, so it is not downloaded again for every page.
+    """
+    semester = get_object_or_404(Semester, pk=semester_id)
+    courses = catalogue.get_catalogue(semester)
+    response = HttpResponse(courses.courses_json, content_type='application/json')
+    response['ETag'] = quote_etag(courses.version)
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
 def courses_list(request, semester_id: Optional[int] = None):
     """A basic courses view with courses listed on the right and no course selected."""
     semester: Optional[Semester]
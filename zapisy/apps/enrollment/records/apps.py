@@ -10,5 +10,6 @@ class RecordsAppConfig(AppConfig):
     name = 'apps.enrollment.records'
 
     def ready(self):
+        import apps.enrollment.records.changes  # noqa
         import apps.enrollment.records.signals  # noqa
         import apps.enrollment.records.tasks  # noqa
@@ -0,0 +1,146 @@
+"""Log of changes of groups used by the prototype to poll for updates.
+
+Every change of a group that students see in the prototype (a record changing
+its status, the limit, the terms or the guaranteed spots of the group) is
+assigned the next number of a sequence. The log keeps, in Redis, the number of
+the latest change of every group. A client remembers the position of the log
+at its last poll and asks only for the groups changed since then. If nothing
+changed at all, answering the poll costs a single Redis read.
+
+The log is identified by a random epoch. Should Redis lose the log, a new epoch
+is drawn and the clients holding positions in the old one know they need to
+fetch everything again.
+
+As with the occupancy counters, changes are logged once the transaction
+commits, and the keys are namespaced with the database name.
+"""
+import logging
+import uuid
+from typing import Iterable, NamedTuple, Optional, Set
+
+import django_rq
+import redis
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.common.redis import flush_by_pattern
+from apps.enrollment.courses.models import Group
+from apps.enrollment.courses.models.group import GuaranteedSpots
+from apps.enrollment.courses.models.term import Term
+
+LOGGER = logging.getLogger(__name__)
+
+KEY_PREFIX = 'enrollment:changes:'
+
+# Sequence number and the groups are updated atomically, so a reader never sees
+# the new number before the groups it refers to.
+_MARK_CHANGED = """
+local seq = redis.call('incr', KEYS[1])
+for _, group_id in ipairs(ARGV) do
+    redis.call('hset', KEYS[2], group_id, seq)
+end
+return seq
+"""
+
+
+class Position(NamedTuple):
+    """Position in the log of changes."""
+    epoch: str
+    seq: int
+
+    def __str__(self):
+        return f'{self.epoch}.{self.seq}'
+
+    @classmethod
+    def parse(cls, value: str) -> Optional['Position']:
+        """Reads the position from its string form. Returns None if malformed."""
+        try:
+            epoch, seq = value.split('.')
+            return cls(epoch, int(seq))
+        except (AttributeError, ValueError):
+            return None
+
+
+def _key(name: str) -> str:
+    return f'{KEY_PREFIX}{connection.settings_dict["NAME"]}:{name}'
+
+
+def _redis_client() -> redis.Redis:
+    return django_rq.get_connection()
+
+
+def _mark_changed_now(group_ids: Set[int]):
+    try:
+        _redis_client().register_script(_MARK_CHANGED)(
+            keys=[_key('seq'), _key('groups')], args=sorted(group_ids))
+    except redis.RedisError:
+        LOGGER.exception('Could not log changes of groups %s.', sorted(group_ids))
+
+
+def mark_changed(group_ids: Iterable[int]):
+    """Logs the changes of the groups, once the current transaction commits."""
+    group_ids = set(group_ids)
+    if group_ids:
+        transaction.on_commit(lambda: _mark_changed_now(group_ids))
+
+
+def get_position() -> Optional[Position]:
+    """Returns the current position of the log, or None if Redis is unavailable."""
+    try:
+        client = _redis_client()
+        epoch, seq = client.mget(_key('epoch'), _key('seq'))
+        if epoch is None:
+            # Some other process may be starting the epoch at the same time.
+            client.set(_key('epoch'), uuid.uuid4().hex[:8], nx=True)
+            epoch, seq = client.mget(_key('epoch'), _key('seq'))
+    except redis.RedisError:
+        LOGGER.exception('Could not read the position of the log of group changes.')
+        return None
+    return Position(epoch.decode(), int(seq or 0))
+
+
+def changed_since(since: Position, group_ids: Iterable[int]) -> Optional[Set[int]]:
+    """Returns those of the groups that changed after the given position.
+
+    Returns None when the log cannot tell: the position is from another epoch
+    (or from the future) or Redis is unavailable.
+    """
+    group_ids = list(group_ids)
+    try:
+        pipe = _redis_client().pipeline(transaction=True)
+        pipe.mget(_key('epoch'), _key('seq'))
+        if group_ids:
+            pipe.hmget(_key('groups'), *group_ids)
+        results = pipe.execute()
+    except redis.RedisError:
+        LOGGER.exception('Could not read the log of group changes.')
+        return None
+    epoch, seq = results[0]
+    if epoch is None or epoch.decode() != since.epoch or int(seq or 0) < since.seq:
+        return None
+    if not group_ids:
+        return set()
+    return {
+        group_id
+        for group_id, changed_at in zip(group_ids, results[1])
+        if changed_at is not None and int(changed_at) > since.seq
+    }
+
+
+def flush():
+    """Drops the log of the current database."""
+    flush_by_pattern(_redis_client(), _key('*'))
+
+
+@receiver(post_save, sender=Group)
+def group_changed(sender, instance: Group, **kwargs):
+    mark_changed([instance.pk])
+
+
+@receiver(post_save, sender=Term)
+@receiver(post_delete, sender=Term)
+@receiver(post_save, sender=GuaranteedSpots)
+@receiver(post_delete, sender=GuaranteedSpots)
+def group_detail_changed(sender, instance, **kwargs):
+    mark_changed([instance.group_id])
@@ -0,0 +1,527 @@
+"""Load test of the enrollment rush at the moment when T0s pass.
+
+The test seeds a separate semester with courses, groups and students. Every
+student gets a T0 within a short window. Then many threads act on behalf of the
+students: when a student's T0 passes, the thread enqueues them into a few
+groups and removes them from some of those again. The traffic goes directly
+through `Record.enqueue_student` and `Record.remove_from_group`, so the web
+stack is left out of the measurement.
+
+The queues are drained either eagerly, in the threads that change the groups
+(as with `RUN_ASYNC=False`), or by worker threads consuming the drain jobs from
+a separate queue in the local Redis, so that real workers are not involved.
+
+The report contains latencies of the operations, lock waits sampled from
+Postgres, deadlocks, transaction retries in `Record.fill_group` and the result
+of a consistency check of the groups after all the queues are drained.
+
+The seeded semester and users are deleted afterwards by `tear_down`.
+
+`benchmark_free_spots` reuses the seeding to time `Record.free_spots_by_role`,
+which runs under the group lock in every pull, on a large lecture.
+"""
+import logging
+import math
+import queue
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+from unittest import mock
+
+import django_rq
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group as AuthGroup
+from django.db import DatabaseError, connection, connections
+from django.db.models import Count
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rq import Queue
+
+from apps.enrollment.courses.models import CourseInstance, Group, Semester
+from apps.enrollment.courses.models.course_type import Type
+from apps.enrollment.courses.models.group import GroupType, GuaranteedSpots
+from apps.enrollment.records import occupancy, tasks
+from apps.enrollment.records.models import GroupOpeningTimes, Record, RecordStatus, T0Times
+from apps.enrollment.records.models.records import LOGGER as RECORDS_LOGGER
+from apps.users.models import Employee, Student, User
+
+LOGGER = logging.getLogger(__name__)
+
+EAGER = 'eager'
+RQ = 'rq'
+# The drain jobs are redirected to this queue for the duration of the test.
+LOAD_TEST_QUEUE = 'enrollment-load-test'
+
+ENQUEUE = 'enqueue'
+DEQUEUE = 'dequeue'
+
+LOCK_SAMPLING_INTERVAL = 0.05
+
+# A single student's actions: pairs of (ENQUEUE or DEQUEUE, group id).
+Plan = List[Tuple[str, int]]
+
+
+@dataclass
+class Scenario:
+    """Describes the simulated enrollment rush.
+
+    Courses are not equally popular: the i-th course is chosen by students with
+    weight 1/(i+1), so the first courses are crowded.
+    """
+    num_students: int = 1000
+    num_courses: int = 20
+    groups_per_course: int = 3
+    group_limit: int = 15
+    # Every student enqueues into groups of that many distinct courses.
+    groups_per_student: int = 4
+    # Probability that the student leaves each of their groups afterwards.
+    dequeue_probability: float = 0.2
+    # Number of threads acting on behalf of the students.
+    concurrency: int = 16
+    # T0s of the students are spread uniformly over that many seconds.
+    t0_spread_seconds: float = 10
+    # EAGER or RQ.
+    workers: str = EAGER
+    num_rq_workers: int = 4
+    seed: int = 0
+
+
+@dataclass
+class SeededData:
+    """Objects created by `seed`."""
+    run_id: str
+    semester: Semester
+    course_type: Type
+    group_ids: List[int]
+    students: List[Student]
+    user_ids: List[int]
+
+
+@dataclass
+class Report:
+    latencies: Dict[str, List[float]] = field(default_factory=dict)
+    failed_operations: int = 0
+    duration_seconds: float = 0
+    lock_wait_samples: List[int] = field(default_factory=list)
+    deadlocks: int = 0
+    fill_group_retries: int = 0
+    failed_jobs: int = 0
+    dispatch_counters: Dict[str, int] = field(default_factory=dict)
+    consistency_problems: List[str] = field(default_factory=list)
+
+    def format(self) -> List[str]:
+        """Returns the report as lines of text."""
+        lines = [f"Duration: {self.duration_seconds:.1f}s"]
+        for kind, latencies in sorted(self.latencies.items()):
+            if not latencies:
+                continue
+            lines.append(
+                f"{kind}: {len(latencies)} operations, "
+                f"p50 {percentile(latencies, 50) * 1000:.1f}ms, "
+                f"p99 {percentile(latencies, 99) * 1000:.1f}ms, "
+                f"max {max(latencies) * 1000:.1f}ms")
+        lines.append(f"Failed operations: {self.failed_operations}")
+        if self.lock_wait_samples:
+            waiting = [s for s in self.lock_wait_samples if s]
+            lines.append(
+                f"Lock waits: seen in {len(waiting)}/{len(self.lock_wait_samples)} samples, "
+                f"at most {max(self.lock_wait_samples)} backends waiting at once")
+        lines.append(f"Deadlocks: {self.deadlocks}")
+        lines.append(f"Transaction retries in fill_group: {self.fill_group_retries}")
+        if self.dispatch_counters:
+            lines.append(f"Drain jobs: {self.dispatch_counters['dispatched']} dispatched, "
+                         f"{self.dispatch_counters['collapsed']} collapsed, "
+                         f"{self.failed_jobs} failed")
+        if self.consistency_problems:
+            lines.append(f"Consistency problems ({len(self.consistency_problems)}):")
+            lines.extend(f"  {problem}" for problem in self.consistency_problems)
+        else:
+            lines.append("The groups are consistent.")
+        return lines
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Returns the p-th percentile of values (nearest-rank method)."""
+    ordered = sorted(values)
+    rank = max(math.ceil(p / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def _free_semester_year() -> str:
+    taken = set(Semester.objects.filter(type=Semester.TYPE_WINTER).values_list('year', flat=True))
+    for raw_year in range(9000, 9999):
+        year = f'{raw_year}/{(raw_year + 1) % 100:02d}'
+        if year not in taken:
+            return year
+    raise ValueError("No free year left for the load test semester.")
+
+
+def seed(scenario: Scenario) -> SeededData:
+    """Creates the semester, its courses and groups, and the students."""
+    run_id = uuid.uuid4().hex[:8]
+    now = datetime.now()
+    day = timedelta(days=1)
+    semester = Semester.objects.create(
+        type=Semester.TYPE_WINTER, year=_free_semester_year(), visible=False,
+        records_opening=now, records_closing=now + day, records_ending=now + day,
+        records_ects_limit_abolition=now + day,
+        lectures_beginning=now.date() + day, lectures_ending=now.date() + 100 * day,
+        semester_beginning=now.date() + day, semester_ending=now.date() + 100 * day)
+
+    teacher_user = User.objects.create(
+        username=f'loadtest_{run_id}_teacher', password=make_password(None))
+    teacher = Employee.objects.create(user=teacher_user)
+    course_type = Type.objects.create(name='load test')
+    # The students must not hit the ECTS limit, or they would not be pulled
+    # into the groups.
+    points = min(6, settings.ECTS_INITIAL_LIMIT // scenario.groups_per_student)
+    group_ids = []
+    for i in range(scenario.num_courses):
+        course = CourseInstance.objects.create(
+            name=f'Load test {i}', semester=semester, owner=teacher, course_type=course_type,
+            points=points)
+        for _ in range(scenario.groups_per_course):
+            group = Group.objects.create(
+                course=course, teacher=teacher, type=GroupType.EXERCISES,
+                limit=scenario.group_limit)
+            group_ids.append(group.pk)
+
+    users = User.objects.bulk_create([
+        User(username=f'loadtest_{run_id}_{n}', password=make_password(None))
+        for n in range(scenario.num_students)
+    ])
+    students = Student.objects.bulk_create([
+        Student(user=user, matricula=f'lt{run_id}{n}') for n, user in enumerate(users)
+    ])
+    return SeededData(
+        run_id=run_id, semester=semester, course_type=course_type, group_ids=group_ids,
+        students=students, user_ids=[u.pk for u in users] + [teacher_user.pk])
+
+
+def tear_down(seeded: SeededData):
+    """Deletes everything created by `seed` and `run`."""
+    seeded.semester.delete()
+    User.objects.filter(pk__in=seeded.user_ids).delete()
+    seeded.course_type.delete()
+    occupancy.invalidate(seeded.group_ids)
+
+
+def _make_plans(scenario: Scenario, seeded: SeededData, rng: random.Random) -> List[Plan]:
+    groups_by_course: Dict[int, List[int]] = {}
+    for group_id, course_id in Group.objects.filter(pk__in=seeded.group_ids).values_list(
+            'id', 'course_id').order_by('id'):
+        groups_by_course.setdefault(course_id, []).append(group_id)
+    courses = sorted(groups_by_course)
+    weights = [1 / (i + 1) for i in range(len(courses))]
+    num_courses = min(scenario.groups_per_student, len(courses))
+
+    plans = []
+    for _ in seeded.students:
+        chosen = set()
+        while len(chosen) < num_courses:
+            chosen.add(rng.choices(courses, weights)[0])
+        group_ids = [rng.choice(groups_by_course[c]) for c in sorted(chosen)]
+        plan = [(ENQUEUE, g) for g in group_ids]
+        plan.extend((DEQUEUE, g) for g in group_ids if rng.random() < scenario.dequeue_probability)
+        plans.append(plan)
+    return plans
+
+
+def _schedule_t0s(scenario: Scenario, seeded: SeededData, rng: random.Random) -> List[datetime]:
+    """Sets T0s of the students starting one second from now."""
+    start = datetime.now() + timedelta(seconds=1)
+    t0s = [
+        start + timedelta(seconds=rng.uniform(0, scenario.t0_spread_seconds))
+        for _ in seeded.students
+    ]
+    T0Times.objects.filter(semester=seeded.semester).delete()
+    T0Times.objects.bulk_create([
+        T0Times(student=student, semester=seeded.semester, time=t0)
+        for student, t0 in zip(seeded.students, t0s)
+    ])
+    GroupOpeningTimes.invalidate_cache(seeded.semester)
+    return t0s
+
+
+class _ThreadStats:
+    """Measurements of a single traffic thread, merged after the run."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {ENQUEUE: [], DEQUEUE: []}
+        self.failed_operations = 0
+
+
+def _act_as_students(students: 'queue.Queue[Tuple[datetime, Student, Plan]]', group_ids: List[int],
+                     stats: _ThreadStats):
+    """Takes students off the queue and performs their plans once their T0 passes."""
+    try:
+        # Every thread has its own Group objects, as permission checks annotate
+        # them with per-student data.
+        groups = Group.objects.filter(pk__in=group_ids).select_related('course', 'course__semester')
+        groups = {g.pk: g for g in groups}
+        while True:
+            try:
+                t0, student, plan = students.get_nowait()
+            except queue.Empty:
+                return
+            delay = (t0 - datetime.now()).total_seconds()
+            if delay > 0:
+                time.sleep(delay)
+            for action, group_id in plan:
+                function = Record.enqueue_student if action == ENQUEUE else Record.remove_from_group
+                start = time.perf_counter()
+                try:
+                    function(student, groups[group_id])
+                except DatabaseError:
+                    LOGGER.exception('%s of student %s in group %s failed.', action, student.pk, group_id)
+                    stats.failed_operations += 1
+                    continue
+                stats.latencies[action].append(time.perf_counter() - start)
+    finally:
+        connections.close_all()
+
+
+class _RQWorkers:
+    """Threads performing the drain jobs from a separate Redis queue.
+
+    While the workers run, `drain_group` jobs are enqueued into that queue
+    instead of the 'default' one.
+    """
+
+    def __init__(self, num_workers: int):
+        self.queue = Queue(LOAD_TEST_QUEUE, connection=django_rq.get_connection())
+        self.redirect = mock.patch.object(tasks.drain_group, 'delay', self._enqueue_drain)
+        self.stopping = threading.Event()
+        self.failed_jobs = 0
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._work) for _ in range(num_workers)]
+
+    def _enqueue_drain(self, group_id: int):
+        return self.queue.enqueue(tasks.drain_group, group_id)
+
+    def start(self):
+        self.queue.empty()
+        self.redirect.start()
+        for thread in self.threads:
+            thread.start()
+
+    def finish(self):
+        """Waits until the queue is empty and stops the workers."""
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+        self.redirect.stop()
+        self.queue.empty()
+
+    def _work(self):
+        try:
+            while True:
+                job_and_queue = Queue.dequeue_any([self.queue], None, connection=self.queue.connection)
+                if job_and_queue is None:
+                    # Jobs are only enqueued by the traffic threads and by the
+                    # jobs themselves, so an empty queue is final after the
+                    # traffic ends.
+                    if self.stopping.is_set():
+                        return
+                    time.sleep(0.01)
+                    continue
+                job, _ = job_and_queue
+                try:
+                    job.perform()
+                except Exception:
+                    LOGGER.exception('Job %s failed.', job.id)
+                    with self.lock:
+                        self.failed_jobs += 1
+                finally:
+                    job.delete()
+        finally:
+            connections.close_all()
+
+
+class _LockMonitor:
+    """Samples the number of backends waiting for a lock in the database."""
+
+    def __init__(self):
+        self.samples: List[int] = []
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._sample)
+
+    def start(self):
+        self.thread.start()
+
+    def finish(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def _sample(self):
+        try:
+            with connection.cursor() as cursor:
+                while not self.stopping.wait(LOCK_SAMPLING_INTERVAL):
+                    cursor.execute(
+                        "SELECT count(*) FROM pg_stat_activity "
+                        "WHERE datname = current_database() AND wait_event_type = 'Lock'")
+                    self.samples.append(cursor.fetchone()[0])
+        finally:
+            connections.close_all()
+
+
+class _RetryCounter(logging.Handler):
+    """Counts the retries logged by `Record.fill_group`."""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord):
+        if record.funcName == 'fill_group':
+            self.count += 1
+
+
+def _deadlocks() -> int:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()")
+        return cursor.fetchone()[0]
+
+
+def check_consistency(group_ids: List[int]) -> List[str]:
+    """Verifies the groups after all the queues have been drained.
+
+    No group may exceed its limits, nobody may wait in the queue of a group
+    with vacancies, nobody may be enrolled twice and the occupancy counters must
+    agree with the database. Returns the descriptions of the problems found.
+    """
+    problems = []
+    counted = Record.count_groups_stats(group_ids)
+    cached = occupancy.get(group_ids)
+    for group in Group.objects.filter(pk__in=group_ids).order_by('id'):
+        stats = counted[group.pk]
+        free_spots = Record.free_spots_by_role(group)
+        if any(spots < 0 for spots in free_spots.values()):
+            problems.append(f"Group {group.pk} exceeds its limits: {free_spots}.")
+        if free_spots['-'] > 0 and stats['num_enqueued'] > 0:
+            problems.append(f"Group {group.pk} has {free_spots['-']} free spots and "
+                            f"{stats['num_enqueued']} students waiting.")
+        if group.pk in cached and cached[group.pk] != stats:
+            problems.append(f"Occupancy counters of group {group.pk} are {cached[group.pk]}, "
+                            f"but the database says {stats}.")
+    duplicates = Record.objects.filter(
+        group_id__in=group_ids, status=RecordStatus.ENROLLED).values('student_id', 'group_id').annotate(
+            num_records=Count('id')).filter(num_records__gt=1).order_by('group_id', 'student_id')
+    for duplicate in duplicates:
+        problems.append(f"Student {duplicate['student_id']} is enrolled in group "
+                        f"{duplicate['group_id']} {duplicate['num_records']} times.")
+    return problems
+
+
+def run(scenario: Scenario, seeded: SeededData) -> Report:
+    """Fires the traffic at the seeded semester and measures it."""
+    rng = random.Random(scenario.seed)
+    plans = _make_plans(scenario, seeded, rng)
+    t0s = _schedule_t0s(scenario, seeded, rng)
+    students: 'queue.Queue[Tuple[datetime, Student, Plan]]' = queue.Queue()
+    for item in sorted(zip(t0s, seeded.students, plans), key=lambda item: item[0]):
+        students.put(item)
+
+    report = Report()
+    retry_counter = _RetryCounter()
+    RECORDS_LOGGER.addHandler(retry_counter)
+    lock_monitor = _LockMonitor()
+    thread_stats = [_ThreadStats() for _ in range(scenario.concurrency)]
+    threads = [
+        threading.Thread(target=_act_as_students, args=(students, seeded.group_ids, stats))
+        for stats in thread_stats
+    ]
+    rq_workers = _RQWorkers(scenario.num_rq_workers) if scenario.workers == RQ else None
+    deadlocks_before = _deadlocks()
+    start = time.monotonic()
+    try:
+        with override_settings(RUN_ASYNC=scenario.workers == RQ):
+            if rq_workers is not None:
+                tasks.reset_dispatch_counters()
+                rq_workers.start()
+            lock_monitor.start()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if rq_workers is not None:
+                rq_workers.finish()
+                report.failed_jobs = rq_workers.failed_jobs
+                report.dispatch_counters = tasks.get_dispatch_counters()
+            lock_monitor.finish()
+    finally:
+        RECORDS_LOGGER.removeHandler(retry_counter)
+    report.duration_seconds = time.monotonic() - start
+
+    for kind in (ENQUEUE, DEQUEUE):
+        report.latencies[kind] = [x for stats in thread_stats for x in stats.latencies[kind]]
+    report.failed_operations = sum(stats.failed_operations for stats in thread_stats)
+    report.lock_wait_samples = lock_monitor.samples
+    report.deadlocks = _deadlocks() - deadlocks_before
+    report.fill_group_retries = retry_counter.count
+    report.consistency_problems = check_consistency(seeded.group_ids)
+    return report
+
+
+@dataclass
+class FreeSpotsBenchmark:
+    latencies: List[float]
+    num_queries: int
+    free_spots: Dict[str, int]
+
+    def format(self) -> List[str]:
+        """Returns the results as lines of text."""
+        return [
+            f"free_spots_by_role: {len(self.latencies)} calls, "
+            f"p50 {percentile(self.latencies, 50) * 1000:.1f}ms, "
+            f"p99 {percentile(self.latencies, 99) * 1000:.1f}ms, "
+            f"max {max(self.latencies) * 1000:.1f}ms",
+            f"Queries per call: {self.num_queries}",
+            f"Free spots: {self.free_spots}",
+        ]
+
+
+def benchmark_free_spots(num_students: int = 300, num_rules: int = 4,
+                         repeat: int = 50) -> FreeSpotsBenchmark:
+    """Times `Record.free_spots_by_role` on a lecture full of students.
+
+    The lecture has `num_rules` guaranteed spots rules for distinct roles.
+    Every student has one of the roles and every fifth student has two, so some
+    students are matched by more than one rule.
+    """
+    scenario = Scenario(num_students=num_students, num_courses=1, groups_per_course=1,
+                        group_limit=num_students)
+    seeded = seed(scenario)
+    roles = [AuthGroup.objects.create(name=f'loadtest_{seeded.run_id}_{i}') for i in range(num_rules)]
+    try:
+        group = Group.objects.get(pk=seeded.group_ids[0])
+        for role in roles:
+            GuaranteedSpots.objects.create(group=group, role=role,
+                                           limit=num_students // (num_rules + 1))
+        memberships = []
+        for n, student in enumerate(seeded.students):
+            memberships.append(User.groups.through(user_id=student.user_id, group=roles[n % num_rules]))
+            if n % 5 == 0:
+                memberships.append(User.groups.through(
+                    user_id=student.user_id, group=roles[(n + 1) % num_rules]))
+        User.groups.through.objects.bulk_create(memberships)
+        Record.objects.bulk_create([
+            Record(student=student, group=group, status=RecordStatus.ENROLLED)
+            for student in seeded.students
+        ])
+
+        latencies = []
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                free_spots = Record.free_spots_by_role(group)
+                latencies.append(time.perf_counter() - start)
+        return FreeSpotsBenchmark(latencies, len(queries), free_spots)
+    finally:
+        tear_down(seeded)
+        AuthGroup.objects.filter(pk__in=[role.pk for role in roles]).delete()
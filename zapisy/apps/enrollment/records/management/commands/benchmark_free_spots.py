@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.enrollment.records import load_test
+
+
+class Command(BaseCommand):
+    help = ("Times the computation of free spots in a large lecture with guaranteed spots. The "
+            "command creates a separate semester with its own students in the database and "
+            "deletes them when it is done.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--students", type=int, default=300)
+        parser.add_argument("--rules", type=int, default=4,
+                            help="Number of guaranteed spots rules in the lecture")
+        parser.add_argument("--repeat", type=int, default=50)
+        parser.add_argument("--force", action="store_true",
+                            help="Run even if DEBUG is off")
+
+    def handle(self, *args, **kwargs):
+        if not settings.DEBUG and not kwargs["force"]:
+            raise CommandError("The benchmark writes to the database. Use --force to run it "
+                               "with DEBUG off.")
+        benchmark = load_test.benchmark_free_spots(
+            num_students=kwargs["students"], num_rules=kwargs["rules"], repeat=kwargs["repeat"])
+        for line in benchmark.format():
+            self.stdout.write(line)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from apps.enrollment.records.tasks import get_dispatch_counters, reset_dispatch_counters
+
+
+class Command(BaseCommand):
+    help = "Prints the numbers of dispatched and collapsed group drain jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="Reset the counters afterwards")
+
+    def handle(self, *args, **kwargs):
+        counters = get_dispatch_counters()
+        self.stdout.write(f"dispatched: {counters['dispatched']}")
+        self.stdout.write(f"collapsed: {counters['collapsed']}")
+        if kwargs["reset"]:
+            reset_dispatch_counters()
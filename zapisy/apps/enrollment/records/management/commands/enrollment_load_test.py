@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.enrollment.records import load_test
+
+
+class Command(BaseCommand):
+    help = ("Simulates the enrollment rush at the moment when T0s pass and reports latencies, "
+            "lock waits, deadlocks and the consistency of the groups afterwards. The command "
+            "creates a separate semester with its own students in the database and deletes "
+            "them when it is done.")
+
+    def add_arguments(self, parser):
+        defaults = load_test.Scenario()
+        parser.add_argument("--students", type=int, default=defaults.num_students)
+        parser.add_argument("--courses", type=int, default=defaults.num_courses)
+        parser.add_argument("--groups-per-course", type=int, default=defaults.groups_per_course)
+        parser.add_argument("--limit", type=int, default=defaults.group_limit,
+                            help="Limit of every group")
+        parser.add_argument("--groups-per-student", type=int, default=defaults.groups_per_student)
+        parser.add_argument("--dequeue-probability", type=float, default=defaults.dequeue_probability,
+                            help="Probability that a student leaves each of their groups")
+        parser.add_argument("--concurrency", type=int, default=defaults.concurrency,
+                            help="Number of threads acting on behalf of the students")
+        parser.add_argument("--t0-spread", type=float, default=defaults.t0_spread_seconds,
+                            help="Length of the window with students' T0s (in seconds)")
+        parser.add_argument("--workers", choices=[load_test.EAGER, load_test.RQ],
+                            default=defaults.workers,
+                            help="Drain the queues eagerly or with jobs in the local Redis queue")
+        parser.add_argument("--rq-workers", type=int, default=defaults.num_rq_workers)
+        parser.add_argument("--seed", type=int, default=defaults.seed)
+        parser.add_argument("--keep", action="store_true",
+                            help="Do not delete the seeded semester and students")
+        parser.add_argument("--force", action="store_true",
+                            help="Run even if DEBUG is off")
+
+    def handle(self, *args, **kwargs):
+        if not settings.DEBUG and not kwargs["force"]:
+            raise CommandError("The load test writes to the database. Use --force to run it "
+                               "with DEBUG off.")
+        if kwargs["workers"] == load_test.RQ and not settings.RQ_QUEUES['default']['ASYNC']:
+            raise CommandError("RQ workers require RUN_ASYNC to be set.")
+        scenario = load_test.Scenario(
+            num_students=kwargs["students"],
+            num_courses=kwargs["courses"],
+            groups_per_course=kwargs["groups_per_course"],
+            group_limit=kwargs["limit"],
+            groups_per_student=kwargs["groups_per_student"],
+            dequeue_probability=kwargs["dequeue_probability"],
+            concurrency=kwargs["concurrency"],
+            t0_spread_seconds=kwargs["t0_spread"],
+            workers=kwargs["workers"],
+            num_rq_workers=kwargs["rq_workers"],
+            seed=kwargs["seed"],
+        )
+        seeded = load_test.seed(scenario)
+        self.stdout.write(f"Seeded `{seeded.semester}` with {len(seeded.students)} students and "
+                          f"{len(seeded.group_ids)} groups.")
+        try:
+            report = load_test.run(scenario, seeded)
+        finally:
+            if not kwargs["keep"]:
+                load_test.tear_down(seeded)
+        for line in report.format():
+            self.stdout.write(line)
+        if report.consistency_problems:
+            raise CommandError("The groups are inconsistent after the load test.")
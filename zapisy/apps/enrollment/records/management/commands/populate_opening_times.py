@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.enrollment.courses.models import Semester
+from apps.enrollment.records.models import GroupOpeningTimes, T0Times
+
+
+class Command(BaseCommand):
+    help = ("Computes T0s and group opening times of all active students in a semester. If not "
+            "specified, upcoming is assumed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("-s", "--semester", type=int, help="ID of the semester")
+
+    def progress(self, name: str):
+        def report(count: int):
+            self.stdout.write(f"   {name}: {count}")
+        return report
+
+    def handle(self, *args, **kwargs):
+        if kwargs["semester"]:
+            semester = Semester.objects.get(id=kwargs["semester"])
+        else:
+            semester = Semester.get_upcoming_semester()
+        self.stdout.write(f"Selected semester: `{semester}` with id {semester.id}")
+
+        start = time.monotonic()
+        num_t0 = T0Times.populate_t0(semester, progress=self.progress("T0"))
+        self.stdout.write(f"Created {num_t0} T0s in {time.monotonic() - start:.1f}s.")
+
+        start = time.monotonic()
+        num_opening_times = GroupOpeningTimes.populate_opening_times(
+            semester, progress=self.progress("opening times"))
+        self.stdout.write(
+            f"Created {num_opening_times} group opening times in {time.monotonic() - start:.1f}s.")
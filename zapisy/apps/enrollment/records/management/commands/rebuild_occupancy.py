@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from apps.enrollment.courses.models import Group, Semester
+from apps.enrollment.records import occupancy
+from apps.enrollment.records.models import Record
+
+
+class Command(BaseCommand):
+    help = ("Recounts occupancy counters of groups in a semester. If not specified, upcoming is "
+            "assumed. It can be run periodically to reconcile the counters with the database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("-s", "--semester", type=int, help="ID of the semester")
+        parser.add_argument("--flush", action="store_true",
+                            help="Drop the counters of all groups first")
+
+    def handle(self, *args, **kwargs):
+        if kwargs["semester"]:
+            semester = Semester.objects.get(id=kwargs["semester"])
+        else:
+            semester = Semester.get_upcoming_semester()
+        if kwargs["flush"]:
+            occupancy.flush()
+        group_ids = list(Group.objects.filter(course__semester=semester).values_list('id', flat=True))
+        Record.rebuild_groups_stats(group_ids)
+        self.stdout.write(f"Rebuilt occupancy counters of {len(group_ids)} groups in `{semester}`.")
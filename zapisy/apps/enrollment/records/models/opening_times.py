@@ -4,20 +4,65 @@ Every student has their T0 - the time, when their enrollment starts. For some
 courses they have a time advantage coming from their votes. Additionally, some groups
 will have their own opening time. Some groups will also provide a time advantage
 for a selected group of students (ex. ISIM students).
+
+Permission checks need all these times for a student many times per request.
+They are therefore loaded once per (student, semester) into a
+`StudentOpeningTimes` map, which is cached and memoized on the Student object.
+The cache is invalidated whenever the times are populated again.
 """
+import logging
+import time as timer
 from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import Dict, Iterable, List
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
 
 from django.conf import settings
 from django.db import models, transaction
+from django.db.models import QuerySet
+from more_itertools import chunked
 
+from apps.common import tagged_cache
 from apps.enrollment.courses.models import CourseInstance, Group, Semester
 from apps.grade.ticket_create.models.student_graded import StudentGraded
 from apps.offer.vote.models.single_vote import SingleVote
 from apps.users.models import Student
 
 
+LOGGER = logging.getLogger(__name__)
+
+OPENING_TIMES_CACHE_TIMEOUT = 60 * 60
+# The populated times are inserted in batches of this size, so the memory used
+# does not depend on the number of students.
+POPULATE_BATCH_SIZE = 5000
+
+# Called with the number of rows inserted so far.
+ProgressCallback = Callable[[int], None]
+
+
+def _bulk_create_in_batches(model: models.Model, objects: Iterable[models.Model],
+                            progress: Optional[ProgressCallback]) -> int:
+    """Inserts the objects batch by batch and returns their number."""
+    start = timer.monotonic()
+    count = 0
+    for batch in chunked(objects, POPULATE_BATCH_SIZE):
+        model.objects.bulk_create(batch)
+        count += len(batch)
+        if progress is not None:
+            progress(count)
+    LOGGER.info('Populated %d %s objects in %.1fs.', count, model.__name__,
+                timer.monotonic() - start)
+    return count
+
+
+class StudentOpeningTimes(NamedTuple):
+    """All the opening times of a single student in a semester.
+
+    The `groups` dict maps group ids to GroupOpeningTimes of the student.
+    """
+    t0: Optional[datetime]
+    groups: Dict[int, datetime]
+
+
 class T0Times(models.Model):
     """This model stores a T0 for a student.
 
@@ -46,18 +91,17 @@ class T0Times(models.Model):
             return False
         if semester.records_closing is not None and time > semester.records_closing:
             return False
-        t0_record = None
-        try:
-            t0_record = cls.objects.get(student=student, semester=semester)
-        except cls.DoesNotExist:
+        t0 = GroupOpeningTimes.get_student_opening_times(student, semester).t0
+        if t0 is None:
             return False
-        if time < t0_record.time:
+        if time < t0:
             return False
         return True
 
     @classmethod
     @transaction.atomic
-    def populate_t0(cls, semester: Semester, students: Iterable[Student] = None):
+    def populate_t0(cls, semester: Semester, students: Iterable[Student] = None, *,
+                    progress: Optional[ProgressCallback] = None) -> int:
         """Computes T0s for selected students.
 
         The arguments are the semester of the T0s to be computed and the
@@ -69,6 +113,10 @@ class T0Times(models.Model):
         participation in courses' grading. The additional administrative bonus
         is also taken into account.
 
+        The students are streamed and the T0s are inserted in batches. After
+        every batch `progress` is called with the number of T0s inserted so far.
+        Returns the number of T0s created.
+
         The function will throw a DatabaseError if something goes wrong.
         """
         if not students:
@@ -77,7 +125,6 @@ class T0Times(models.Model):
         # First we delete T0 records in the semester for the selected students
         cls.objects.filter(student__in=students, semester=semester).delete()
 
-        created: List[cls] = []
         # For each student_id we want to know, how many times they have
         # generated grading tickets in the last two semesters.
         generated_tickets: Dict[int, int] = dict(
@@ -86,29 +133,37 @@ class T0Times(models.Model):
                 ], student__in=students).values('student_id').annotate(num_tickets=models.Count('id')).values_list(
                     'student_id', 'num_tickets'))
 
-        student: Student
-        for student in students:
-            record = cls(student=student, semester=semester)
-            record.time = semester.records_opening
-            # Every ECTS gives 5 minutes bonus, but with logic splitting
-            # that over nighttime. 720 minutes is equal to12 hours. If
-            # ((student.ects * ECTS_BONUS) // 12 hours) is odd, we subtract
-            # additional 12 hours from T0. This way T0's are separated by
-            # ECTS_BONUS minutes per point, but never fall in the nighttime.
-            record.time -= timedelta(
-                minutes=((student.ects * settings.ECTS_BONUS) // 720) * 720)
-            record.time -= timedelta(minutes=settings.ECTS_BONUS) * student.ects
-            # Every participation in classes grading gives a day worth
-            # advantage.
-            student_generated_tickets = generated_tickets.get(student.pk, 0)
-            record.time -= timedelta(days=1) * student_generated_tickets
-            # We may add some bonus by hand.
-            record.time -= timedelta(minutes=1) * student.records_opening_bonus_minutes
-            # Finally, everyone gets 2 hours. This way, nighttime pause is
-            # shifted from 00:00-12:00 to 22:00-10:00.
-            record.time -= timedelta(hours=2)
-            created.append(record)
-        cls.objects.bulk_create(created)
+        if isinstance(students, QuerySet):
+            students = students.only('id', 'ects', 'records_opening_bonus_minutes').order_by().iterator(
+                chunk_size=POPULATE_BATCH_SIZE)
+
+        def generate() -> Iterator[cls]:
+            student: Student
+            for student in students:
+                record = cls(student_id=student.pk, semester=semester)
+                record.time = semester.records_opening
+                # Every ECTS gives 5 minutes bonus, but with logic splitting
+                # that over nighttime. 720 minutes is equal to12 hours. If
+                # ((student.ects * ECTS_BONUS) // 12 hours) is odd, we subtract
+                # additional 12 hours from T0. This way T0's are separated by
+                # ECTS_BONUS minutes per point, but never fall in the nighttime.
+                record.time -= timedelta(
+                    minutes=((student.ects * settings.ECTS_BONUS) // 720) * 720)
+                record.time -= timedelta(minutes=settings.ECTS_BONUS) * student.ects
+                # Every participation in classes grading gives a day worth
+                # advantage.
+                student_generated_tickets = generated_tickets.get(student.pk, 0)
+                record.time -= timedelta(days=1) * student_generated_tickets
+                # We may add some bonus by hand.
+                record.time -= timedelta(minutes=1) * student.records_opening_bonus_minutes
+                # Finally, everyone gets 2 hours. This way, nighttime pause is
+                # shifted from 00:00-12:00 to 22:00-10:00.
+                record.time -= timedelta(hours=2)
+                yield record
+
+        count = _bulk_create_in_batches(cls, generate(), progress)
+        GroupOpeningTimes.invalidate_cache(semester)
+        return count
 
 
 class GroupOpeningTimes(models.Model):
@@ -123,12 +178,52 @@ class GroupOpeningTimes(models.Model):
     group = models.ForeignKey(Group, on_delete=models.CASCADE)
     time = models.DateTimeField()
 
+    # Bumped whenever the opening times change, to drop memoized maps.
+    _generation = 0
+
     class Meta:
         unique_together = ("student", "group")
         indexes = [
             models.Index(fields=["student", "group"]),
         ]
 
+    @staticmethod
+    def _cache_tag(semester_id: int) -> str:
+        return tagged_cache.tag('opening_times', 'semester', semester_id)
+
+    @classmethod
+    def invalidate_cache(cls, semester: Semester):
+        """Drops all the cached StudentOpeningTimes maps in the semester."""
+        cls._generation += 1
+        tagged_cache.invalidate(cls._cache_tag(semester.pk))
+
+    @classmethod
+    def get_student_opening_times(cls, student: Student,
+                                  semester: Semester) -> StudentOpeningTimes:
+        """Returns the T0 and all the group opening times of the student.
+
+        The map is loaded from the database at most once per request: it is
+        memoized on the student object and stored in the cache.
+        """
+        memo = student.__dict__.setdefault('_opening_times', {})
+        generation, opening_times = memo.get(semester.pk, (None, None))
+        if opening_times is not None and generation == cls._generation:
+            return opening_times
+
+        def build() -> StudentOpeningTimes:
+            t0 = T0Times.objects.filter(
+                student=student, semester=semester).values_list('time', flat=True).first()
+            groups = dict(
+                cls.objects.filter(student=student, group__course__semester=semester).values_list(
+                    'group_id', 'time'))
+            return StudentOpeningTimes(t0, groups)
+
+        opening_times = tagged_cache.get_or_build(
+            'opening_times', f'{semester.pk}:{student.pk}', [cls._cache_tag(semester.pk)], build,
+            OPENING_TIMES_CACHE_TIMEOUT)
+        memo[semester.pk] = (cls._generation, opening_times)
+        return opening_times
+
     @classmethod
     def is_group_open_for_student(cls, student: Student, group: Group, time: datetime) -> bool:
         """Checks if group is open for the student to enroll."""
@@ -152,14 +247,14 @@ class GroupOpeningTimes(models.Model):
         if not groups:
             return {}
         # We assume all the groups are in the same semester.
-        is_after_t0 = T0Times.is_after_t0(student, groups[0].course.semester, time)
+        semester = groups[0].course.semester
+        is_after_t0 = T0Times.is_after_t0(student, semester, time)
+        opening_times = cls.get_student_opening_times(student, semester)
 
         groups: Dict[int, Group] = {g.id: g for g in groups}
 
         for k in groups:
-            groups[k].opening_time_for_student = None
-        for rec in cls.objects.filter(student=student, group__in=groups):
-            groups[rec.group_id].opening_time_for_student = rec.time
+            groups[k].opening_time_for_student = opening_times.groups.get(k)
 
         ret: Dict[int, bool] = {}
         for k, group in groups.items():
@@ -200,11 +295,16 @@ class GroupOpeningTimes(models.Model):
     @classmethod
     @transaction.atomic
     def populate_opening_times(cls, semester: Semester, *,
-                               students: Iterable[Student] = None, groups: Iterable[Group] = None):
+                               students: Iterable[Student] = None, groups: Iterable[Group] = None,
+                               progress: Optional[ProgressCallback] = None) -> int:
         """Computes opening times for selected students that cast votes.
 
         Voting for a course results in a quicker enrollment.
 
+        The votes are streamed from the database and the opening times are
+        inserted in batches, so the memory used does not grow with the number
+        of votes.
+
         Args:
             semester: Semester for which we calculate opening times.
             students: Students for whom we calculate opening times. If None,
@@ -212,6 +312,11 @@ class GroupOpeningTimes(models.Model):
             groups: Groups for which we calculate opening times. If None,
                 calculation will be carried out for all groups in the specified
                 semester.
+            progress: Called after every batch with the number of opening
+                times inserted so far.
+
+        Returns:
+            The number of opening times created.
 
         Raises:
             DatabaseError: Operation is unsuccessful.
@@ -232,24 +337,22 @@ class GroupOpeningTimes(models.Model):
                 T0Times.objects.filter(semester_id=semester.id, student__in=students).values_list('student_id', 'time')
             )
 
-        opening_time_objects: List[cls] = []
-        votes = SingleVote.objects.meaningful().in_semester(semester=semester).filter(
-            student__in=students, proposal__courseinstance__groups__in=groups).distinct()
-
-        votes_by_proposal: Dict[int, List[SingleVote]] = defaultdict(list)
-        for vote in votes:
-            votes_by_proposal[vote.proposal_id].append(vote)
-
         groups_by_proposal: Dict[int, List[Group]] = defaultdict(list)
         for group in groups:
             groups_by_proposal[group.course.offer_id].append(group)
 
-        for proposal_id, groups in groups_by_proposal.items():
-            single_vote: SingleVote
-            for single_vote in votes_by_proposal[proposal_id]:
+        votes = SingleVote.objects.meaningful().in_semester(semester=semester).filter(
+            student__in=students, proposal__courseinstance__groups__in=groups).values_list(
+                'student_id', 'proposal_id', 'value', 'correction').order_by().distinct()
+
+        def generate() -> Iterator[cls]:
+            for student_id, proposal_id, value, correction in votes.iterator(
+                    chunk_size=POPULATE_BATCH_SIZE):
+                # The same as `SingleVote.val`.
+                val = correction or value
                 # Every point gives a day worth of bonus.
-                for group in groups:
-                    bonus_obj = cls(student_id=single_vote.student_id, group_id=group.pk)
+                for group in groups_by_proposal[proposal_id]:
+                    bonus_obj = cls(student_id=student_id, group_id=group.pk)
                     bonus_obj.time = max(
                         filter(
                             None,
@@ -260,10 +363,13 @@ class GroupOpeningTimes(models.Model):
                                 # If the student does not have T0, we use
                                 # the general records opening time in the
                                 # semester.
-                                t0times.get(single_vote.student_id, semester.records_opening) -
-                                timedelta(days=single_vote.val),
+                                t0times.get(student_id, semester.records_opening) -
+                                timedelta(days=val),
                             )
                         )
                     )
-                    opening_time_objects.append(bonus_obj)
-        cls.objects.bulk_create(opening_time_objects)
+                    yield bonus_obj
+
+        count = _bulk_create_in_batches(cls, generate(), progress)
+        cls.invalidate_cache(semester)
+        return count
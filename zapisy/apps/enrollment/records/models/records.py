@@ -19,12 +19,17 @@ Record Lifetime:
     `apps/enrollment/records/tasks.py`.
 
   fill_group(group_id): The asynchronous task runs this function. It is a loop
-    calling `pull_record_into_group` as long as it returns True, which means
-    that there still place in the group and students in the queue.
+    calling `pull_records_into_group` (or `pull_record_into_group` when batching
+    is disabled) as long as it returns True, which means that there still place
+    in the group and students in the queue.
 
   pull_record_into_group(group_id): Picks the first student in the group's queue
     and tries to enroll him in the group using `enroll_or_remove`.
 
+  pull_records_into_group(group_id, max_pulls): Does the same as a sequence of
+    `pull_record_into_group` calls, but locks the group once and enrolls a batch
+    of students in a single transaction.
+
   enroll_or_remove(record): Takes the record and tries to change its status from
     QUEUED to ENROLLED. This operation will be unsuccessful if the function
     `can_enroll` does not pass, in which case the record's status will be
@@ -45,12 +50,14 @@ from datetime import datetime
 from enum import Enum
 from typing import DefaultDict, Dict, Iterable, List, Optional, Set
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import DatabaseError, models, transaction
 
 from apps.enrollment.courses.models import CourseInstance, Group, Semester
 from apps.enrollment.courses.models.group import GuaranteedSpots
+from apps.enrollment.records import changes, occupancy
 from apps.enrollment.records.models.opening_times import GroupOpeningTimes
 from apps.enrollment.records.signals import GROUP_CHANGE_SIGNAL
 from apps.notifications.custom_signals import student_not_pulled, student_pulled
@@ -279,56 +286,115 @@ class Record(models.Model):
         The data will be returned in the form of a dict indexed by group id.
         Every entry will be a dict with fields 'num_enrolled' and
         'num_enqueued'.
+
+        The numbers are read from the occupancy counters (see
+        `apps/enrollment/records/occupancy.py`). Only the groups missing there
+        are counted in the database.
         """
+        group_ids = [g.pk for g in groups]
+        ret_dict = occupancy.get(group_ids)
+        missing = [group_id for group_id in group_ids if group_id not in ret_dict]
+        if missing:
+            counted = cls.count_groups_stats(missing)
+            occupancy.store(counted)
+            ret_dict.update(counted)
+        return ret_dict
+
+    @classmethod
+    def count_groups_stats(cls, group_ids: List[int]) -> Dict[int, Dict[str, int]]:
+        """Counts enqueued and enrolled students of the groups in the database."""
         enrolled_agg = models.Count('id', filter=models.Q(status=RecordStatus.ENROLLED))
         enqueued_agg = models.Count('id', filter=models.Q(status=RecordStatus.QUEUED))
-        records = cls.objects.filter(group__in=groups).exclude(
+        records = cls.objects.filter(group_id__in=group_ids).exclude(
             status=RecordStatus.REMOVED).values('group_id').annotate(
                 num_enrolled=enrolled_agg, num_enqueued=enqueued_agg).values(
                     'group_id', 'num_enrolled', 'num_enqueued')
         ret_dict: Dict[int, Dict[str, int]] = {
-            g.pk: {
+            group_id: {
                 'num_enrolled': 0,
                 'num_enqueued': 0
             }
-            for g in groups
+            for group_id in group_ids
         }
         for rec in records:
             ret_dict[rec['group_id']]['num_enrolled'] = rec['num_enrolled']
             ret_dict[rec['group_id']]['num_enqueued'] = rec['num_enqueued']
         return ret_dict
 
+    @classmethod
+    def rebuild_groups_stats(cls, group_ids: List[int]):
+        """Recounts the occupancy counters of the groups in the database."""
+        occupancy.store(cls.count_groups_stats(group_ids))
+
+    @classmethod
+    def invalidate_groups_stats(cls, group_ids: List[int]):
+        """Must be called when records of the groups are modified in bulk."""
+        occupancy.invalidate(group_ids)
+        changes.mark_changed(group_ids)
+
+    @staticmethod
+    def _adjust_groups_stats(group_id: int, old_status: Optional[RecordStatus],
+                             new_status: RecordStatus):
+        """Updates the occupancy counters and logs the change of the group."""
+        delta = defaultdict(int)
+        delta[old_status] -= 1
+        delta[new_status] += 1
+        occupancy.adjust(group_id,
+                         num_enrolled=delta[RecordStatus.ENROLLED],
+                         num_enqueued=delta[RecordStatus.QUEUED])
+        if old_status != new_status:
+            changes.mark_changed([group_id])
+
     @classmethod
     def free_spots_by_role(cls, group: Group) -> Dict[str, int]:
         """Counts the number of free spots indexed by user role.
 
         The purpose of this is to establish if the group has free place in it at
         all and how many students are enrolled according to which
-        GuaranteedSpots rule. Note, that this function will only work
-        deterministically and sanely, if the roles defined in GuaranteedSpots
-        rules are distinct for this groups.
+        GuaranteedSpots rule. Note, that this function will only work sanely, if
+        the roles defined in GuaranteedSpots rules are distinct for this groups.
+        The rules are filled in the order of their creation, each with the
+        students (in order of their user ids) not matched by the previous ones.
 
         The number of students not matched to any GuaranteedSpots rule will be
         indexed with '-'.
+
+        This runs under the group lock in every pull, so the matching is done
+        on sets of ids fetched with two queries, and not on model instances.
         """
-        ret: Dict[str, int] = {}
-        guaranteed_spots_rules = GuaranteedSpots.objects.filter(group=group)
-        all_enrolled_records = cls.objects.filter(
-            group=group, status=RecordStatus.ENROLLED).select_related(
-                'student', 'student__user').prefetch_related('student__user__groups')
-        all_enrolled_students = set(r.student.user for r in all_enrolled_records)
+        guaranteed_spots_rules = list(
+            GuaranteedSpots.objects.filter(group=group).select_related('role').order_by('pk'))
+        enrolled_user_ids = set(cls.objects.filter(
+            group=group, status=RecordStatus.ENROLLED).values_list('student__user_id', flat=True))
+        # Users of every role among the enrolled ones.
+        role_members: DefaultDict[int, Set[int]] = defaultdict(set)
+        for user_id, role_id in User.groups.through.objects.filter(
+                user_id__in=enrolled_user_ids,
+                group_id__in=[gsr.role_id for gsr in guaranteed_spots_rules]).values_list(
+                    'user_id', 'group_id'):
+            role_members[role_id].add(user_id)
+        return cls._allocate_spots(group, guaranteed_spots_rules, enrolled_user_ids, role_members)
+
+    @staticmethod
+    def _allocate_spots(group: Group, guaranteed_spots_rules: List[GuaranteedSpots],
+                        enrolled_user_ids: Set[int],
+                        role_members: DefaultDict[int, Set[int]]) -> Dict[str, int]:
+        """Counts the free spots by role as described in `free_spots_by_role`.
 
+        Args:
+            guaranteed_spots_rules: GuaranteedSpots rules of the group ordered
+                by their primary keys.
+            enrolled_user_ids: Ids of users enrolled into the group.
+            role_members: Maps ids of roles to the ids of their members (it may
+                contain users not enrolled into the group).
+        """
+        ret: Dict[str, int] = {}
+        unmatched_user_ids = enrolled_user_ids
         for gsr in guaranteed_spots_rules:
-            role = gsr.role
-            counter = 0
-            for user in all_enrolled_students.copy():
-                if role in user.groups.all():
-                    all_enrolled_students.remove(user)
-                    counter += 1
-                    if counter == gsr.limit:
-                        break
-            ret[gsr.role.name] = gsr.limit - counter
-        ret['-'] = group.limit - len(all_enrolled_students)
+            matched = sorted(role_members[gsr.role_id] & unmatched_user_ids)[:gsr.limit]
+            unmatched_user_ids = unmatched_user_ids.difference(matched)
+            ret[gsr.role.name] = gsr.limit - len(matched)
+        ret['-'] = group.limit - len(unmatched_user_ids)
         return ret
 
     @classmethod
@@ -376,6 +442,7 @@ class Record(models.Model):
             return True
         Record.objects.create(
             group=group, student=student, status=RecordStatus.QUEUED, created=cur_time)
+        cls._adjust_groups_stats(group.id, None, RecordStatus.QUEUED)
         LOGGER.info('User %s is enqueued into group %s', student, group)
         GROUP_CHANGE_SIGNAL.send(None, group_id=group.id)
         return True
@@ -401,8 +468,10 @@ class Record(models.Model):
                 student=student, group=group).exclude(status=RecordStatus.REMOVED).get()
         except cls.DoesNotExist:
             return False
+        old_status = record.status
         record.status = RecordStatus.REMOVED
         record.save()
+        cls._adjust_groups_stats(record.group_id, old_status, RecordStatus.REMOVED)
         LOGGER.info('User %s removed from group %s', student, group)
         GROUP_CHANGE_SIGNAL.send(None, group_id=record.group_id)
         return True
@@ -477,17 +546,122 @@ class Record(models.Model):
         return True
 
     @classmethod
-    def fill_group(cls, group_id: int):
+    def pull_records_into_group(cls, group_id: int, max_pulls: int) -> bool:
+        """Pulls a batch of records from the queue into the group.
+
+        The outcome is the same as of calling `pull_record_into_group` until it
+        returns False or `max_pulls` records are pulled, but all of it happens
+        in a single transaction. The records of the group are locked once and
+        read together with the roles of their students. The free spots and the
+        heads of the queue are then tracked in memory, so the database is only
+        consulted by `enroll_or_remove`, which still checks the ECTS limit and
+        queue priorities of each pulled student.
+
+        The pulling is done in rounds, just like in `pull_record_into_group`:
+        in every round the free spots are counted and at most one student is
+        pulled per role. The batch ends after the round in which `max_pulls` is
+        reached, so slightly more records may be pulled.
+
+        Returns:
+          The function will return False if the group is already full, or the
+          queue is empty or the enrollment is closed for the semester. True
+          value will mean, that it should be run again on that group. The
+          function may throw DatabaseError if transaction fails.
+
+        Concurrency:
+          Unlike in `pull_record_into_group`, all the non-removed records of the
+          group are locked for the whole transaction, so the in-memory state
+          cannot go stale. Records enqueued in the meantime will be picked up
+          by the next batch.
+        """
+        group = Group.objects.select_related('course', 'course__semester').get(id=group_id)
+        if not GroupOpeningTimes.is_enrollment_open(group.course, datetime.now()):
+            return False
+        # Groups that will need to be pulled into afterwards.
+        trigger_groups = []
+        no_one_waiting = False
+
+        with transaction.atomic():
+            records = list(
+                cls.objects.filter(group_id=group_id).exclude(
+                    status=RecordStatus.REMOVED).select_related(
+                        'student', 'student__user').select_for_update(of=('self',)).order_by(
+                            'created', 'id'))
+            guaranteed_spots_rules = list(
+                GuaranteedSpots.objects.filter(group=group).select_related('role').order_by('pk'))
+            role_ids = {gsr.role.name: gsr.role_id for gsr in guaranteed_spots_rules}
+            role_members: DefaultDict[int, Set[int]] = defaultdict(set)
+            memberships = User.groups.through.objects.filter(
+                user_id__in={r.student.user_id for r in records},
+                group_id__in=role_ids.values()).values_list('user_id', 'group_id')
+            for user_id, role_id in memberships:
+                role_members[role_id].add(user_id)
+            for record in records:
+                record.group = group
+
+            num_pulled = 0
+            while num_pulled < max_pulls:
+                enrolled_user_ids = {
+                    r.student.user_id for r in records if r.status == RecordStatus.ENROLLED
+                }
+                free_spots_by_role = cls._allocate_spots(group, guaranteed_spots_rules,
+                                                         enrolled_user_ids, role_members)
+                no_one_waiting = True
+                # We rely here on the fact, that '-' will be in the order before
+                # all the role names.
+                for role in sorted(free_spots_by_role):
+                    if free_spots_by_role[role] <= 0:
+                        continue
+                    first_in_line = next(
+                        (r for r in records if r.status == RecordStatus.QUEUED and
+                         (role == '-' or r.student.user_id in role_members[role_ids[role]])),
+                        None)
+                    if first_in_line is None:
+                        continue
+                    no_one_waiting = False
+                    trigger_groups.extend(first_in_line.enroll_or_remove(group))
+                    num_pulled += 1
+                    if first_in_line.status == RecordStatus.ENROLLED:
+                        # Mirror the removals `enroll_or_remove` made among the
+                        # student's other records in this group.
+                        for r in records:
+                            if (r.student_id == first_in_line.student_id and
+                                    r.pk != first_in_line.pk and
+                                    (r.priority < first_in_line.priority or
+                                     r.status == RecordStatus.ENROLLED)):
+                                r.status = RecordStatus.REMOVED
+                    records = [r for r in records if r.status != RecordStatus.REMOVED]
+                if no_one_waiting:
+                    break
+
+        # The tasks should be triggered outside of the transaction
+        for trigger_group_id in trigger_groups:
+            GROUP_CHANGE_SIGNAL.send(None, group_id=trigger_group_id)
+        return not no_one_waiting
+
+    @classmethod
+    def fill_group(cls, group_id: int, batch_size: Optional[int] = None):
         """Pulls records from the queue into the group as long as possible.
 
+        Args:
+            batch_size: How many students may be pulled in a single transaction.
+                Defaults to `settings.ENROLLMENT_DRAIN_BATCH_SIZE`. If it is 0,
+                every pull is performed in a separate transaction by
+                `pull_record_into_group`.
+
         This function may raise a DatabaseError when too many transaction errors
         occur.
         """
+        if batch_size is None:
+            batch_size = settings.ENROLLMENT_DRAIN_BATCH_SIZE
         num_transaction_errors = 0
         still_free = True
         while still_free:
             try:
-                still_free = cls.pull_record_into_group(group_id)
+                if batch_size > 0:
+                    still_free = cls.pull_records_into_group(group_id, batch_size)
+                else:
+                    still_free = cls.pull_record_into_group(group_id)
             except DatabaseError:
                 # Transaction failure probably means that Postgres decided to
                 # terminate the transaction in order to eliminate a deadlock. We
@@ -496,6 +670,7 @@ class Record(models.Model):
                 num_transaction_errors += 1
                 if num_transaction_errors == 3:
                     raise
+                LOGGER.warning('Transaction error while filling group %s, retrying.', group_id)
 
     @classmethod
     def update_records_in_auto_enrollment_group(cls, group_id: int):
@@ -538,6 +713,7 @@ class Record(models.Model):
         # Drop records of people not in the group.
         cls.objects.filter(group_id=group_id).exclude(status=RecordStatus.REMOVED).exclude(
             student_id__in=(enrolled_other | queued_other)).update(status=RecordStatus.REMOVED)
+        cls.invalidate_groups_stats([group_id])
 
     def enroll_or_remove(self, group: Group) -> List[int]:
         """Tries to change a single QUEUED record status to ENROLLED.
@@ -564,8 +740,10 @@ class Record(models.Model):
             # Check if he can be enrolled at all.
             can_enroll = self.can_enroll(self.student, group)
             if not can_enroll:
+                old_status = self.status
                 self.status = RecordStatus.REMOVED
                 self.save()
+                self._adjust_groups_stats(self.group_id, old_status, RecordStatus.REMOVED)
 
                 # Send notifications
                 student_not_pulled.send_robust(
@@ -585,12 +763,17 @@ class Record(models.Model):
             # The list of groups to trigger must be computed now, after the
             # update it would be empty. Note that this list should have at most
             # one element.
-            other_groups_query_list = list(
-                other_groups_query.filter(status=RecordStatus.ENROLLED).values_list(
-                    'group_id', flat=True))
+            other_records = list(other_groups_query.values_list('group_id', 'status'))
+            other_groups_query_list = [
+                group_id for group_id, status in other_records if status == RecordStatus.ENROLLED
+            ]
             other_groups_query.update(status=RecordStatus.REMOVED)
+            for group_id, status in other_records:
+                self._adjust_groups_stats(group_id, status, RecordStatus.REMOVED)
+            old_status = self.status
             self.status = RecordStatus.ENROLLED
             self.save()
+            self._adjust_groups_stats(self.group_id, old_status, RecordStatus.ENROLLED)
             # Send notification to user
             student_pulled.send_robust(
                 sender=self.__class__, instance=self.group, user=self.student.user)
@@ -0,0 +1,127 @@
+"""Live occupancy counters of groups kept in Redis.
+
+Every course page, timetable and prototype poll needs to know how many students
+are enrolled and enqueued in the displayed groups. Instead of aggregating the
+records table every time, these numbers are kept in a Redis hash per group:
+
+  * When a record changes its status, the counters of its group are adjusted
+    in place. This happens only once the surrounding transaction commits.
+  * A group with no counters is counted in Postgres by the reader, who then
+    stores the numbers (again, only once its transaction commits).
+  * Counters expire after `RECONCILE_SECONDS`, so any drift (i.e. caused by
+    records modified directly in the admin or by scripts) is reconciled with
+    Postgres periodically. The `rebuild_occupancy` management command rebuilds
+    the counters of a whole semester at once.
+
+The keys are namespaced with the database name, so separate databases sharing
+one Redis instance (like parallel test databases) do not clash.
+
+If Redis is unavailable, the readers fall back to the database.
+"""
+import logging
+from typing import Dict, Iterable, List
+
+import django_rq
+import redis
+from django.db import connection, transaction
+
+from apps.common.redis import flush_by_pattern
+
+LOGGER = logging.getLogger(__name__)
+
+KEY_PREFIX = 'enrollment:occupancy:'
+RECONCILE_SECONDS = 15 * 60
+FIELDS = ('num_enrolled', 'num_enqueued')
+
+GroupStats = Dict[str, int]
+
+# Counters that do not exist are not incremented. They will be counted from
+# scratch by the next reader.
+_INCREMENT_IF_EXISTS = """
+if redis.call('exists', KEYS[1]) == 1 then
+    redis.call('hincrby', KEYS[1], 'num_enrolled', ARGV[1])
+    redis.call('hincrby', KEYS[1], 'num_enqueued', ARGV[2])
+end
+"""
+
+
+def _key(group_id: int) -> str:
+    return f'{KEY_PREFIX}{connection.settings_dict["NAME"]}:{group_id}'
+
+
+def _redis_client() -> redis.Redis:
+    return django_rq.get_connection()
+
+
+def get(group_ids: Iterable[int]) -> Dict[int, GroupStats]:
+    """Returns the counters of those groups that have them in Redis."""
+    group_ids = list(group_ids)
+    try:
+        pipe = _redis_client().pipeline(transaction=False)
+        for group_id in group_ids:
+            pipe.hmget(_key(group_id), *FIELDS)
+        values = pipe.execute()
+    except redis.RedisError:
+        LOGGER.exception('Could not read group occupancy counters.')
+        return {}
+    ret: Dict[int, GroupStats] = {}
+    for group_id, (num_enrolled, num_enqueued) in zip(group_ids, values):
+        if num_enrolled is None or num_enqueued is None:
+            continue
+        ret[group_id] = {
+            'num_enrolled': int(num_enrolled),
+            'num_enqueued': int(num_enqueued),
+        }
+    return ret
+
+
+def _store_now(stats: Dict[int, GroupStats]):
+    try:
+        pipe = _redis_client().pipeline(transaction=False)
+        for group_id, group_stats in stats.items():
+            key = _key(group_id)
+            pipe.hset(key, mapping={f: group_stats[f] for f in FIELDS})
+            pipe.expire(key, RECONCILE_SECONDS)
+        pipe.execute()
+    except redis.RedisError:
+        LOGGER.exception('Could not store group occupancy counters.')
+
+
+def store(stats: Dict[int, GroupStats]):
+    """Stores counters of groups, once the current transaction commits."""
+    if stats:
+        transaction.on_commit(lambda: _store_now(stats))
+
+
+def _adjust_now(group_id: int, num_enrolled: int, num_enqueued: int):
+    try:
+        client = _redis_client()
+        client.register_script(_INCREMENT_IF_EXISTS)(
+            keys=[_key(group_id)], args=[num_enrolled, num_enqueued])
+    except redis.RedisError:
+        LOGGER.exception('Could not adjust occupancy counters of group %s.', group_id)
+
+
+def adjust(group_id: int, num_enrolled: int = 0, num_enqueued: int = 0):
+    """Adjusts counters of the group, once the current transaction commits."""
+    if num_enrolled or num_enqueued:
+        transaction.on_commit(lambda: _adjust_now(group_id, num_enrolled, num_enqueued))
+
+
+def _invalidate_now(group_ids: List[int]):
+    try:
+        _redis_client().delete(*[_key(group_id) for group_id in group_ids])
+    except redis.RedisError:
+        LOGGER.exception('Could not invalidate group occupancy counters.')
+
+
+def invalidate(group_ids: Iterable[int]):
+    """Drops counters of the groups, once the current transaction commits."""
+    group_ids = list(group_ids)
+    if group_ids:
+        transaction.on_commit(lambda: _invalidate_now(group_ids))
+
+
+def flush():
+    """Drops all the counters in the current database."""
+    flush_by_pattern(_redis_client(), _key('*'))
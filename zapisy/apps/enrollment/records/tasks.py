@@ -4,7 +4,17 @@ They will perform actions that must be taken but should not block server
 threads. A typical example is, when a student decides to leave a group, we
 should not make him wait for another student being pulled from the queue to take
 place he leaves vacant.
+
+A burst of changes in a single group (which is typical at the moment when
+students' T0 passes) would flood the task queue with identical jobs. The jobs
+are therefore coalesced: a group is marked as pending in Redis when its drain
+job is enqueued, and as long as the mark is there, no other job is enqueued
+for that group. The job removes the mark before it starts draining, so no
+change is ever left unprocessed.
 """
+from typing import Dict
+
+import django_rq
 from django.conf import settings
 from django.db.models.signals import post_save
 from django.dispatch import receiver
@@ -15,6 +25,13 @@ from apps.enrollment.records.models.opening_times import GroupOpeningTimes
 from apps.enrollment.records.models.records import Record
 from apps.enrollment.records.signals import GROUP_CHANGE_SIGNAL
 
+DISPATCH_KEY_PREFIX = 'enrollment:dispatch:'
+PENDING_KEY = DISPATCH_KEY_PREFIX + 'pending:%d'
+DISPATCHED_COUNTER_KEY = DISPATCH_KEY_PREFIX + 'dispatched'
+COLLAPSED_COUNTER_KEY = DISPATCH_KEY_PREFIX + 'collapsed'
+# The pending mark expires in case the job gets lost (i.e. the worker dies).
+PENDING_TIMEOUT_SECONDS = 600
+
 
 @job
 def pull_from_queue(group_id: int):
@@ -33,28 +50,62 @@ def update_auto_enrollment_groups(group_id: int):
         Record.update_records_in_auto_enrollment_group(group.id)
 
 
-@receiver(GROUP_CHANGE_SIGNAL)
-def pull_from_queue_signal_receiver(sender, **kwargs):
-    """Receives the signal call and runs pull_from_queue.
+@job
+def drain_group(group_id: int):
+    """Pulls students from the queue and updates the auto-enrollment groups.
 
-    Depending on RQ_QUEUES setting it will either run eagerly or asynchronously.
+    This is the job enqueued by `dispatch_group_change`. The pending mark is
+    removed first, so changes coming during the drain will enqueue another job.
+    """
+    django_rq.get_connection().delete(PENDING_KEY % group_id)
+    pull_from_queue(group_id)
+    update_auto_enrollment_groups(group_id)
+
+
+def dispatch_group_change(group_id: int):
+    """Makes sure the group will be drained after it has changed.
+
+    Depending on RQ_QUEUES setting it will either run eagerly or enqueue the
+    `drain_group` job, unless one is already pending for the group.
     """
-    group_id = kwargs.get('group_id')
     if not settings.RUN_ASYNC:
         pull_from_queue(group_id)
         update_auto_enrollment_groups(group_id)
+        return
+    connection = django_rq.get_connection()
+    if connection.set(PENDING_KEY % group_id, 1, nx=True, ex=PENDING_TIMEOUT_SECONDS):
+        connection.incr(DISPATCHED_COUNTER_KEY)
+        drain_group.delay(group_id)
     else:
-        pull_from_queue.delay(group_id)
-        update_auto_enrollment_groups.delay(group_id)
+        connection.incr(COLLAPSED_COUNTER_KEY)
+
+
+def get_dispatch_counters() -> Dict[str, int]:
+    """Returns the numbers of dispatched and collapsed drain jobs."""
+    dispatched, collapsed = django_rq.get_connection().mget(DISPATCHED_COUNTER_KEY,
+                                                            COLLAPSED_COUNTER_KEY)
+    return {
+        'dispatched': int(dispatched or 0),
+        'collapsed': int(collapsed or 0),
+    }
+
+
+def reset_dispatch_counters():
+    django_rq.get_connection().delete(DISPATCHED_COUNTER_KEY, COLLAPSED_COUNTER_KEY)
+
+
+@receiver(GROUP_CHANGE_SIGNAL)
+def pull_from_queue_signal_receiver(sender, **kwargs):
+    """Receives the signal call and dispatches draining of the group."""
+    dispatch_group_change(kwargs.get('group_id'))
 
 
 @receiver(post_save, sender=Group)
 def group_save_signal_receiver(sender, instance, created, raw, using, **kwargs):
     """Receives the signal when the group is modified.
 
-    The modification might be a limit change or a creation. pull_from_queue
-    needs to be run. Depending on RQ_QUEUES setting it will either run eagerly
-    or asynchronously.
+    The modification might be a limit change or a creation. The group needs to
+    be drained then.
 
     For a newly created group will generate opening times, if the opening times
     have been already generated in the semester.
@@ -72,9 +123,4 @@ def group_save_signal_receiver(sender, instance, created, raw, using, **kwargs):
         GroupOpeningTimes.populate_opening_times(instance.course.semester, groups=[instance])
         # Do not trigger pulling for new groups.
         return
-    if not settings.RUN_ASYNC:
-        pull_from_queue(group_id)
-        update_auto_enrollment_groups(group_id)
-    else:
-        pull_from_queue.delay(group_id)
-        update_auto_enrollment_groups.delay(group_id)
+    dispatch_group_change(group_id)
@@ -0,0 +1,143 @@
+"""Tests that the batched queue draining agrees with pulling one by one."""
+from datetime import timedelta
+
+from django.contrib.auth.models import Group as AuthGroup
+from django.db import transaction
+from django.test import TestCase, override_settings
+from freezegun import freeze_time
+
+from apps.enrollment.courses.models import Group
+from apps.enrollment.courses.models.group import GuaranteedSpots
+from apps.enrollment.courses.tests.factories import CourseInstanceFactory, GroupFactory
+from apps.enrollment.records.models import GroupOpeningTimes, Record, RecordStatus, T0Times
+from apps.users.tests.factories import StudentFactory
+
+
+class _Rollback(Exception):
+    """Raised to roll back the changes made by a single drain."""
+
+
+class _DrainMixin:
+    def drain(self, batch_size: int, limit: int):
+        """Raises the group limit and returns the resulting states of records.
+
+        All the changes are rolled back afterwards.
+        """
+        state = None
+        try:
+            with transaction.atomic(), override_settings(ENROLLMENT_DRAIN_BATCH_SIZE=batch_size):
+                with freeze_time(self.opening_time + timedelta(days=1)):
+                    group = Group.objects.get(pk=self.group.pk)
+                    group.limit = limit
+                    group.save()
+                state = dict(Record.objects.values_list('id', 'status'))
+                raise _Rollback
+        except _Rollback:
+            pass
+        return state
+
+    def assert_same_final_states(self, limits, batch_sizes=(1, 2, 3, 50)):
+        for limit in limits:
+            expected = self.drain(0, limit)
+            for batch_size in batch_sizes:
+                with self.subTest(limit=limit, batch_size=batch_size):
+                    self.assertDictEqual(self.drain(batch_size, limit), expected)
+
+
+@override_settings(RUN_ASYNC=False)
+class BatchedDrainTest(_DrainMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        course = CourseInstanceFactory()
+        semester = course.semester
+        cls.group = GroupFactory(course=course, limit=0)
+        cls.parallel_group = GroupFactory(course=course, limit=1)
+        heavy_course = CourseInstanceFactory(semester=semester, points=40)
+        heavy_group = GroupFactory(course=heavy_course)
+
+        cls.students = [StudentFactory() for _ in range(12)]
+        T0Times.populate_t0(semester)
+        GroupOpeningTimes.populate_opening_times(semester)
+
+        isim = AuthGroup.objects.create(name='isim')
+        for student in cls.students[6:9]:
+            student.user.groups.add(isim)
+        GuaranteedSpots.objects.create(group=cls.group, role=isim, limit=2)
+
+        cls.opening_time = semester.records_opening
+        with freeze_time(cls.opening_time + timedelta(hours=1), auto_tick_seconds=60):
+            # The second student already has 40 ECTS and will exceed the limit.
+            Record.objects.create(
+                student=cls.students[1], group=heavy_group, status=RecordStatus.ENROLLED)
+            # The third student sits in the parallel group and will leave it.
+            Record.objects.create(
+                student=cls.students[2], group=cls.parallel_group, status=RecordStatus.ENROLLED)
+            # The fourth student also waits for the parallel group, but
+            # prefers our group.
+            Record.objects.create(
+                student=cls.students[3], group=cls.parallel_group, status=RecordStatus.QUEUED,
+                priority=3)
+            for student in cls.students:
+                Record.objects.create(student=student, group=cls.group, status=RecordStatus.QUEUED)
+            # The fifth student is enqueued twice by mistake.
+            Record.objects.create(
+                student=cls.students[4], group=cls.group, status=RecordStatus.QUEUED, priority=3)
+
+    def test_same_final_state(self):
+        self.assert_same_final_states([1, 4, 7, 20])
+
+    def test_batched_drain_semantics(self):
+        state = self.drain(50, 7)
+        enrolled = Record.objects.filter(pk__in=[
+            k for k, v in state.items() if v == RecordStatus.ENROLLED
+        ], group=self.group).values_list('student_id', flat=True)
+        # Seven regular spots and two guaranteed ones for ISIM students.
+        self.assertEqual(len(enrolled), 9)
+        self.assertNotIn(self.students[1].pk, enrolled)
+        self.assertIn(self.students[2].pk, enrolled)
+        self.assertNotIn(self.students[10].pk, enrolled)
+        parallel_records = Record.objects.filter(group=self.parallel_group)
+        self.assertTrue(all(state[r.pk] == RecordStatus.REMOVED for r in parallel_records))
+
+
+@override_settings(RUN_ASYNC=False)
+class OverlappingRolesDrainTest(_DrainMixin, TestCase):
+    """Students have several roles and one of the rules guarantees no spots."""
+
+    @classmethod
+    def setUpTestData(cls):
+        course = CourseInstanceFactory()
+        semester = course.semester
+        cls.group = GroupFactory(course=course, limit=0)
+        cls.students = [StudentFactory() for _ in range(10)]
+        T0Times.populate_t0(semester)
+        GroupOpeningTimes.populate_opening_times(semester)
+
+        isim = AuthGroup.objects.create(name='isim')
+        erasmus = AuthGroup.objects.create(name='erasmus')
+        zero = AuthGroup.objects.create(name='zero')
+        for i in [2, 3, 4, 5]:
+            cls.students[i].user.groups.add(isim)
+        for i in [2, 3, 4, 8]:
+            cls.students[i].user.groups.add(erasmus)
+        for i in [5, 6, 7]:
+            cls.students[i].user.groups.add(zero)
+        GuaranteedSpots.objects.create(group=cls.group, role=isim, limit=2)
+        GuaranteedSpots.objects.create(group=cls.group, role=erasmus, limit=1)
+        GuaranteedSpots.objects.create(group=cls.group, role=zero, limit=0)
+
+        cls.opening_time = semester.records_opening
+        with freeze_time(cls.opening_time + timedelta(hours=1), auto_tick_seconds=60):
+            for student in cls.students:
+                Record.objects.create(student=student, group=cls.group, status=RecordStatus.QUEUED)
+
+    def test_same_final_state(self):
+        self.assert_same_final_states([1, 2, 3, 5])
+
+    def test_zero_limit_rule_takes_no_spots(self):
+        group = Group.objects.get(pk=self.group.pk)
+        for student in self.students[5:8]:
+            Record.objects.filter(student=student, group=group).update(status=RecordStatus.ENROLLED)
+        self.assertDictEqual(Record.free_spots_by_role(group),
+                             {'isim': 1, 'erasmus': 1, 'zero': 0, '-': -2})
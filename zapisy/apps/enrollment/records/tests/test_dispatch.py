@@ -0,0 +1,47 @@
+"""Tests for coalescing of the group drain jobs."""
+from unittest.mock import patch
+
+import django_rq
+from django.test import TestCase, override_settings
+
+from apps.common.redis import flush_by_pattern
+from apps.enrollment.records import tasks
+from apps.enrollment.records.signals import GROUP_CHANGE_SIGNAL
+
+
+@override_settings(RUN_ASYNC=True)
+class DispatchCoalescingTest(TestCase):
+
+    def setUp(self):
+        flush_by_pattern(django_rq.get_connection(), tasks.DISPATCH_KEY_PREFIX + '*')
+
+    def tearDown(self):
+        flush_by_pattern(django_rq.get_connection(), tasks.DISPATCH_KEY_PREFIX + '*')
+
+    @patch('apps.enrollment.records.tasks.drain_group.delay')
+    def test_burst_is_collapsed(self, delay):
+        for _ in range(5):
+            GROUP_CHANGE_SIGNAL.send(None, group_id=1)
+        GROUP_CHANGE_SIGNAL.send(None, group_id=2)
+
+        self.assertEqual(delay.call_count, 2)
+        delay.assert_any_call(1)
+        delay.assert_any_call(2)
+        self.assertDictEqual(tasks.get_dispatch_counters(), {'dispatched': 2, 'collapsed': 4})
+
+    @patch('apps.enrollment.records.tasks.update_auto_enrollment_groups')
+    @patch('apps.enrollment.records.tasks.pull_from_queue')
+    @patch('apps.enrollment.records.tasks.drain_group.delay')
+    def test_job_clears_pending_mark(self, delay, pull_from_queue, update_auto_enrollment_groups):
+        GROUP_CHANGE_SIGNAL.send(None, group_id=1)
+        # The job runs and the group changes again afterwards.
+        tasks.drain_group(1)
+        pull_from_queue.assert_called_once_with(1)
+        update_auto_enrollment_groups.assert_called_once_with(1)
+        GROUP_CHANGE_SIGNAL.send(None, group_id=1)
+
+        self.assertEqual(delay.call_count, 2)
+        self.assertDictEqual(tasks.get_dispatch_counters(), {'dispatched': 2, 'collapsed': 0})
+
+        tasks.reset_dispatch_counters()
+        self.assertDictEqual(tasks.get_dispatch_counters(), {'dispatched': 0, 'collapsed': 0})
@@ -7,7 +7,7 @@ from freezegun import freeze_time
 
 from apps.enrollment.courses.models.group import GuaranteedSpots
 from apps.enrollment.courses.tests.factories import GroupFactory
-from apps.enrollment.records.models import Record, T0Times
+from apps.enrollment.records.models import Record, RecordStatus, T0Times
 from apps.users.tests.factories import StudentFactory
 
 
@@ -157,3 +157,22 @@ class GuaranteedSpotsEnrollmentTest(TestCase):
         self.assertTrue(Record.is_enrolled(self.uszatek, self.group))
         self.assertTrue(Record.is_enrolled(self.tola, self.group))
         self.assertFalse(Record.is_enrolled(self.lolek, self.group))
+
+    def test_free_spots_with_several_roles(self):
+        """Students matched by many rules take the spot of the first rule with room."""
+        group = GroupFactory(limit=3, course=self.group.course)
+        erasmus_role = AuthGroup.objects.create(name='erasmus')
+        self.uszatek.user.groups.add(erasmus_role)
+        self.bolek.user.groups.add(erasmus_role)
+        GuaranteedSpots.objects.create(group=group, role=self.isim_role, limit=1)
+        GuaranteedSpots.objects.create(group=group, role=erasmus_role, limit=3)
+        for student in (self.bolek, self.lolek, self.tola, self.reksio, self.uszatek):
+            Record.objects.create(student=student, group=group, status=RecordStatus.ENROLLED)
+
+        # Tola takes the ISIM spot, Uszatek and Bolek two of the Erasmus ones.
+        with self.assertNumQueries(3):
+            self.assertDictEqual(Record.free_spots_by_role(group), {
+                'isim': 0,
+                'erasmus': 1,
+                '-': 1,
+            })
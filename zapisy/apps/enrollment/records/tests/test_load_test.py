@@ -0,0 +1,79 @@
+"""Tests for the enrollment load test harness."""
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TransactionTestCase
+
+from apps.enrollment.courses.models import Semester
+from apps.enrollment.records import load_test, occupancy
+from apps.enrollment.records.models import Record, RecordStatus
+from apps.users.models import Student
+
+
+class LoadTestHarnessTest(TransactionTestCase):
+    """The traffic threads use their own connections, hence the TransactionTestCase."""
+
+    scenario = load_test.Scenario(
+        num_students=24, num_courses=3, groups_per_course=2, group_limit=3, groups_per_student=2,
+        concurrency=4, t0_spread_seconds=0.5, num_rq_workers=2)
+
+    def setUp(self):
+        occupancy.flush()
+
+    def tearDown(self):
+        occupancy.flush()
+
+    def test_eager_run(self):
+        seeded = load_test.seed(self.scenario)
+        report = load_test.run(self.scenario, seeded)
+
+        self.assertListEqual(report.consistency_problems, [])
+        self.assertEqual(report.failed_operations, 0)
+        self.assertEqual(len(report.latencies[load_test.ENQUEUE]), 48)
+        self.assertTrue(Record.objects.filter(status=RecordStatus.ENROLLED).exists())
+
+        load_test.tear_down(seeded)
+        self.assertFalse(Semester.objects.exists())
+        self.assertFalse(Student.objects.exists())
+        self.assertFalse(Record.objects.exists())
+
+    def test_rq_run(self):
+        out = StringIO()
+        call_command('enrollment_load_test', students=24, courses=3, groups_per_course=2, limit=3,
+                     groups_per_student=2, concurrency=4, t0_spread=0.5, workers=load_test.RQ,
+                     rq_workers=2, force=True, stdout=out)
+
+        self.assertIn("enqueue: 48 operations", out.getvalue())
+        self.assertIn("The groups are consistent.", out.getvalue())
+        self.assertFalse(Semester.objects.exists())
+
+    def test_inconsistency_is_detected(self):
+        seeded = load_test.seed(self.scenario)
+        group_id = seeded.group_ids[0]
+        for student in seeded.students[:4]:
+            Record.objects.create(student=student, group_id=group_id, status=RecordStatus.ENROLLED)
+        Record.objects.create(
+            student=seeded.students[0], group_id=group_id, status=RecordStatus.ENROLLED)
+        Record.objects.create(
+            student=seeded.students[5], group_id=seeded.group_ids[1], status=RecordStatus.QUEUED)
+
+        self.assertListEqual(load_test.check_consistency(seeded.group_ids), [
+            f"Group {group_id} exceeds its limits: {{'-': -1}}.",
+            f"Group {seeded.group_ids[1]} has 3 free spots and 1 students waiting.",
+            f"Student {seeded.students[0].pk} is enrolled in group {group_id} 2 times.",
+        ])
+
+    def test_percentile(self):
+        values = [0.1 * i for i in range(1, 101)]
+        self.assertAlmostEqual(load_test.percentile(values, 50), 5.0)
+        self.assertAlmostEqual(load_test.percentile(values, 99), 9.9)
+        self.assertAlmostEqual(load_test.percentile([1.0], 99), 1.0)
+
+    def test_free_spots_benchmark(self):
+        out = StringIO()
+        call_command('benchmark_free_spots', students=20, rules=3, repeat=2, force=True, stdout=out)
+
+        self.assertIn("free_spots_by_role: 2 calls", out.getvalue())
+        self.assertIn("Queries per call: 3", out.getvalue())
+        self.assertIn("'-': 15", out.getvalue())
+        self.assertFalse(Semester.objects.exists())
@@ -0,0 +1,87 @@
+"""Tests for the occupancy counters backing Record.groups_stats."""
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+from freezegun import freeze_time
+
+from apps.enrollment.courses.tests.factories import GroupFactory
+from apps.enrollment.records import occupancy
+from apps.enrollment.records.models import GroupOpeningTimes, Record, RecordStatus, T0Times
+from apps.users.tests.factories import StudentFactory
+
+
+class _Rollback(Exception):
+    """Raised to roll back a transaction."""
+
+
+@override_settings(RUN_ASYNC=False)
+class OccupancyCountersTest(TransactionTestCase):
+    """The counters are only written on commit, hence the TransactionTestCase."""
+
+    def setUp(self):
+        occupancy.flush()
+        self.group = GroupFactory(limit=1)
+        self.bolek = StudentFactory()
+        self.lolek = StudentFactory()
+        self.tola = StudentFactory()
+        semester = self.group.course.semester
+        T0Times.populate_t0(semester)
+        GroupOpeningTimes.populate_opening_times(semester)
+        self.enrollment_time = freeze_time(semester.records_opening + timedelta(days=1))
+
+    def tearDown(self):
+        occupancy.flush()
+
+    def test_counters_follow_records(self):
+        self.assertDictEqual(
+            Record.groups_stats([self.group]),
+            {self.group.pk: {'num_enrolled': 0, 'num_enqueued': 0}})
+
+        with self.enrollment_time:
+            Record.enqueue_student(self.bolek, self.group)
+            Record.enqueue_student(self.lolek, self.group)
+            Record.enqueue_student(self.tola, self.group)
+        # The counters are read from Redis.
+        with self.assertNumQueries(0):
+            self.assertDictEqual(
+                Record.groups_stats([self.group]),
+                {self.group.pk: {'num_enrolled': 1, 'num_enqueued': 2}})
+
+        with self.enrollment_time:
+            Record.remove_from_group(self.bolek, self.group)
+            Record.remove_from_group(self.tola, self.group)
+        with self.assertNumQueries(0):
+            self.assertDictEqual(
+                Record.groups_stats([self.group]),
+                {self.group.pk: {'num_enrolled': 1, 'num_enqueued': 0}})
+        self.assertDictEqual(
+            Record.groups_stats([self.group]), Record.count_groups_stats([self.group.pk]))
+
+    def test_rolled_back_changes_are_not_counted(self):
+        Record.groups_stats([self.group])
+        try:
+            with transaction.atomic():
+                with self.enrollment_time:
+                    Record.enqueue_student(self.bolek, self.group)
+                raise _Rollback
+        except _Rollback:
+            pass
+        self.assertDictEqual(
+            Record.groups_stats([self.group]),
+            {self.group.pk: {'num_enrolled': 0, 'num_enqueued': 0}})
+
+    def test_rebuild(self):
+        Record.groups_stats([self.group])
+        # Records created behind the scenes are not reflected in the counters.
+        Record.objects.create(student=self.bolek, group=self.group, status=RecordStatus.ENROLLED)
+        self.assertDictEqual(
+            Record.groups_stats([self.group]),
+            {self.group.pk: {'num_enrolled': 0, 'num_enqueued': 0}})
+
+        call_command('rebuild_occupancy', semester=self.group.course.semester_id, stdout=StringIO())
+        self.assertDictEqual(
+            Record.groups_stats([self.group]),
+            {self.group.pk: {'num_enrolled': 1, 'num_enqueued': 0}})
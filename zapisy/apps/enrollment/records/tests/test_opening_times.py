@@ -4,6 +4,7 @@ The generation itself has been tested to comply to the previously used SQL
 functions. This tests will verify, that the functions use the data correctly.
 """
 from datetime import timedelta
+from unittest.mock import patch
 
 from django.test import TestCase
 
@@ -136,3 +137,41 @@ class OpeningTimesTest(TestCase):
         lolek_knitting_opening2 = GroupOpeningTimes.objects.get(
                 student=self.lolek, group=self.knitting_lecture_group).time
         assert bolek_knitting_opening2 - lolek_knitting_opening2 == timedelta(hours=2)
+
+    def test_opening_times_loaded_once(self):
+        """Repeated checks for the same student do not hit the database."""
+        bolek = Student.objects.get(pk=1)
+        groups = list(Group.objects.filter(course__semester=self.semester).select_related(
+            'course', 'course__semester'))
+        # T0 and group opening times are fetched once.
+        with self.assertNumQueries(2):
+            GroupOpeningTimes.are_groups_open_for_student(bolek, groups,
+                                                          self.semester.records_closing)
+        with self.assertNumQueries(0):
+            GroupOpeningTimes.are_groups_open_for_student(bolek, groups[:1],
+                                                          self.semester.records_closing)
+            T0Times.is_after_t0(bolek, self.semester, self.semester.records_closing)
+
+    def test_opening_times_invalidated(self):
+        """Populating the times again drops the memoized opening times."""
+        bolek = Student.objects.get(pk=1)
+        bolek_t0 = T0Times.objects.get(student=bolek, semester=self.semester).time
+        self.assertTrue(T0Times.is_after_t0(bolek, self.semester, bolek_t0))
+        # The enrollment is postponed by a day.
+        semester = Semester.objects.get(pk=self.semester.pk)
+        semester.records_opening += timedelta(days=1)
+        T0Times.populate_t0(semester, students=Student.objects.filter(pk=bolek.pk))
+        self.assertFalse(T0Times.is_after_t0(bolek, self.semester, bolek_t0))
+
+    def test_populated_in_batches(self):
+        """Populating in small batches gives the same times and reports progress."""
+        expected = set(GroupOpeningTimes.objects.values_list('student_id', 'group_id', 'time'))
+        reported = []
+        with patch('apps.enrollment.records.models.opening_times.POPULATE_BATCH_SIZE', 2):
+            count = GroupOpeningTimes.populate_opening_times(self.semester,
+                                                             progress=reported.append)
+        self.assertEqual(count, len(expected))
+        self.assertEqual(reported[-1], count)
+        self.assertEqual(len(reported), (count + 1) // 2)
+        self.assertSetEqual(
+            set(GroupOpeningTimes.objects.values_list('student_id', 'group_id', 'time')), expected)
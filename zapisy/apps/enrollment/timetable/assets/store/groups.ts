@@ -21,14 +21,23 @@ function coalesce(...args: Array<any | null | undefined>) {
 }
 
 // Store holds the data for all groups that are currently visible, but also for
-// those, that had been visible.
+// those, that had been visible. Version identifies the state of the data on the
+// server, so that polls only bring the groups that changed since.
 interface State {
   store: GroupById;
+  version: string | null;
 }
 const state: State = {
   store: {},
+  version: null,
 };
 
+// Response to the poll for updated groups.
+interface GroupsUpdateJSON {
+  version: string | null;
+  groups: GroupJSON[];
+}
+
 const getters = {
   // visibleGroups returns all the groups presented at the moment.
   visibleGroups(state: State) {
@@ -92,6 +101,9 @@ const mutations = {
     }
     Vue.set(state.store, group.id.toString(), group);
   },
+  setVersion(state: State, version: string | null) {
+    state.version = version;
+  },
   // Flips the selection flag for the group whose selection changed.
   updateGroupSelection(state: State, ids: number[]) {
     const currentSelection = values(state.store)
@@ -172,6 +184,10 @@ const actions = {
     groupsDump.forEach((groupJSON) => {
       commit("updateGroup", { groupJSON });
     });
+    const version = JSON.parse(
+      document.getElementById("prototype-version")!.innerHTML
+    ) as string | null;
+    commit("setVersion", version);
   },
 
   queryUpdatedGroupsStatus({ state, commit }: ActionContext<State, any>) {
@@ -183,12 +199,13 @@ const actions = {
       document.getElementById("prototype-update-url") as HTMLInputElement
     ).value;
     axios
-      .post(updateURL, groupsToUpdate)
+      .post(updateURL, { ids: groupsToUpdate, version: state.version })
       .then((response) => {
-        const updatedGroups = response.data as GroupJSON[];
-        updatedGroups.forEach((g: GroupJSON) => {
+        const update = response.data as GroupsUpdateJSON;
+        update.groups.forEach((g: GroupJSON) => {
           commit("updateGroup", { groupJSON: g });
         });
+        commit("setVersion", update.version);
       })
       .catch((reason) => {
         console.log("Group info update failed: ", reason);
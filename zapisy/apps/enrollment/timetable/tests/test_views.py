@@ -0,0 +1,160 @@
+"""Tests for the timetable prototype views."""
+from datetime import timedelta
+
+from django.contrib.auth.models import Group as AuthGroup
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from freezegun import freeze_time
+
+from apps.enrollment.courses.models import CourseInstance
+from apps.enrollment.courses.models.group import GuaranteedSpots
+from apps.enrollment.courses.tests.factories import (CourseInstanceFactory, GroupFactory,
+                                                     SemesterFactory, TermFactory)
+from apps.enrollment.records import changes, occupancy
+from apps.enrollment.records.models import Record, RecordStatus, T0Times
+from apps.enrollment.timetable.models import Pin
+from apps.enrollment.timetable.views import PROTOTYPE_FULL_UPDATE_INTERVAL
+from apps.users.tests.factories import StudentFactory
+
+
+class PrototypeViewTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.semester = SemesterFactory()
+        cls.student = StudentFactory()
+        cls.isim = AuthGroup.objects.create(name='isim')
+        T0Times.populate_t0(cls.semester)
+
+    def add_groups(self, num_groups: int):
+        """Adds groups in separate courses: enrolled, enqueued and pinned ones."""
+        groups = []
+        for i in range(num_groups):
+            course = CourseInstanceFactory(
+                semester=self.semester, name=f'Przedmiot {CourseInstance.objects.count()}')
+            group = GroupFactory(course=course)
+            TermFactory(group=group)
+            GuaranteedSpots.objects.create(group=group, role=self.isim, limit=1)
+            if i % 3 == 0:
+                Record.objects.create(student=self.student, group=group, status=RecordStatus.ENROLLED)
+            elif i % 3 == 1:
+                Record.objects.create(student=self.student, group=group, status=RecordStatus.QUEUED)
+            else:
+                Pin.objects.create(student=self.student, group=group)
+            groups.append(group)
+        return groups
+
+    def setUp(self):
+        enrollment_time = freeze_time(self.semester.records_opening + timedelta(days=1))
+        enrollment_time.start()
+        self.addCleanup(enrollment_time.stop)
+        self.client.force_login(self.student.user)
+
+    def test_query_count_does_not_depend_on_groups(self):
+        self.add_groups(3)
+        with CaptureQueriesContext(connection) as few_groups:
+            self.client.get(reverse('my-prototype'))
+        self.add_groups(9)
+        with CaptureQueriesContext(connection) as many_groups:
+            response = self.client.get(reverse('my-prototype'))
+
+        self.assertEqual(len(response.context['groups_json']), 12)
+        self.assertEqual(len(response.context['courses_json']), 12)
+        self.assertEqual(len(many_groups), len(few_groups))
+
+    def test_groups_are_annotated(self):
+        enrolled, enqueued, pinned = self.add_groups(3)
+        response = self.client.get(reverse('my-prototype'))
+
+        groups = {g['id']: g for g in response.context['groups_json']}
+        self.assertTrue(groups[enrolled.pk]['is_enrolled'])
+        self.assertFalse(groups[enrolled.pk]['is_enqueued'])
+        self.assertTrue(groups[enqueued.pk]['is_enqueued'])
+        self.assertTrue(groups[pinned.pk]['is_pinned'])
+        self.assertFalse(groups[pinned.pk]['is_enrolled'])
+        self.assertTrue(groups[enrolled.pk]['can_dequeue'])
+        self.assertTrue(groups[pinned.pk]['can_enqueue'])
+        self.assertEqual(groups[enrolled.pk]['num_enrolled'], 1)
+        self.assertListEqual(groups[enrolled.pk]['guaranteed_spots'], [{'role': 'isim', 'limit': 1}])
+        self.assertEqual(groups[enrolled.pk]['url'], reverse('group-view', args=(enrolled.pk, )))
+        self.assertEqual(groups[enrolled.pk]['action_url'],
+                         reverse('prototype-action', args=(enrolled.pk, )))
+        self.assertEqual(groups[enrolled.pk]['course']['url'],
+                         reverse('course-page', args=(enrolled.course.slug, )))
+        self.assertEqual(groups[enrolled.pk]['teacher']['url'],
+                         reverse('employee-profile', args=(enrolled.teacher.user_id, )))
+
+
+class PrototypeUpdateTest(TransactionTestCase):
+    """Changes of groups are logged on commit, hence the TransactionTestCase."""
+
+    def setUp(self):
+        for redis_data in (changes, occupancy):
+            redis_data.flush()
+            self.addCleanup(redis_data.flush)
+        self.semester = SemesterFactory()
+        self.student = StudentFactory()
+        T0Times.populate_t0(self.semester)
+        self.enrolled, self.shown = [
+            GroupFactory(course=CourseInstanceFactory(semester=self.semester, name=name))
+            for name in ("Przedmiot 1", "Przedmiot 2")
+        ]
+        Record.objects.create(student=self.student, group=self.enrolled, status=RecordStatus.ENROLLED)
+        self.enrollment_time = freeze_time(self.semester.records_opening + timedelta(days=1))
+        self.enrollment_time.start()
+        self.addCleanup(self.enrollment_time.stop)
+        self.client.force_login(self.student.user)
+
+    def poll(self, version, ids=None):
+        if ids is None:
+            ids = [str(self.shown.pk)]
+        return self.client.post(reverse('prototype-update'), {'ids': ids, 'version': version},
+                                content_type='application/json').json()
+
+    def test_only_changed_groups_are_sent(self):
+        version = self.client.get(reverse('my-prototype')).context['version']
+        update = self.poll(None)
+        self.assertSetEqual({g['id'] for g in update['groups']}, {self.enrolled.pk, self.shown.pk})
+        self.assertTrue(next(g for g in update['groups'] if g['id'] == self.enrolled.pk)['is_enrolled'])
+        self.assertEqual(update['version'], version)
+
+        with CaptureQueriesContext(connection) as queries:
+            update = self.poll(version)
+        self.assertListEqual(update['groups'], [])
+        self.assertEqual(update['version'], version)
+        self.assertFalse([q for q in queries if '"courses_group"' in q['sql'] or '"records_record"' in q['sql']])
+
+        self.shown.limit += 1
+        self.shown.save()
+        update = self.poll(version)
+        self.assertListEqual([g['id'] for g in update['groups']], [self.shown.pk])
+        self.assertEqual(update['groups'][0]['limit'], self.shown.limit)
+        self.assertIsNone(update['groups'][0]['is_pinned'])
+        self.assertNotEqual(update['version'], version)
+
+        version = update['version']
+        self.assertTrue(Record.remove_from_group(self.student, self.enrolled))
+        update = self.poll(version, ids=[self.enrolled.pk, self.shown.pk])
+        self.assertListEqual([g['id'] for g in update['groups']], [self.enrolled.pk])
+        self.assertFalse(update['groups'][0]['is_enrolled'])
+        self.assertEqual(self.poll(update['version'])['groups'], [])
+
+    def test_everything_is_sent_when_permissions_may_change(self):
+        version = self.poll(None)['version']
+        self.enrollment_time.stop()
+        with freeze_time(self.semester.records_opening + timedelta(days=1) +
+                         PROTOTYPE_FULL_UPDATE_INTERVAL):
+            update = self.poll(version)
+        self.assertEqual(len(update['groups']), 2)
+
+        changes.flush()
+        self.enrollment_time.start()
+        update = self.poll(version)
+        self.assertEqual(len(update['groups']), 2)
+
+    def test_list_of_ids_gets_list_of_groups(self):
+        response = self.client.post(reverse('prototype-update'), [self.shown.pk],
+                                    content_type='application/json')
+        self.assertSetEqual({g['id'] for g in response.json()}, {self.enrolled.pk, self.shown.pk})
@@ -2,32 +2,84 @@
 import collections
 import csv
 import json
-from typing import List, Optional
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
 
 from django.contrib.auth.decorators import login_required
-from django.db.models import Count, Q
+from django.db.models import Prefetch, Q, QuerySet
 from django.forms.models import model_to_dict
 from django.http import JsonResponse
 from django.shortcuts import Http404, HttpResponse, get_object_or_404, render
-from django.urls import reverse
 from django.views.decorators.http import require_POST
 
+from apps.common.reverse import url_template
+from apps.enrollment.courses import catalogue
 from apps.enrollment.courses.models import CourseInstance, Group, Semester
+from apps.enrollment.courses.models.group import GuaranteedSpots
 from apps.enrollment.courses.templatetags.course_types import decode_class_type_singular
-from apps.enrollment.records.models import Record, RecordStatus
+from apps.enrollment.records import changes
+from apps.enrollment.records.models import GroupOpeningTimes, Record, RecordStatus
 from apps.enrollment.timetable.models import Pin
 from apps.schedule.models.term import Term as SchTerm
 from apps.users.decorators import student_required
 from apps.users.models import Employee, Student
 
+# Prototype polls are answered in full at least this often, so that the changes
+# not followed by the log of group changes (like a renamed course) show up too.
+PROTOTYPE_FULL_UPDATE_INTERVAL = timedelta(minutes=10)
 
-def build_group_list(groups: List[Group]):
+
+class PrototypeVersion(NamedTuple):
+    """State of the groups data held by the prototype.
+
+    The data reflects the log of group changes up to `position`. The
+    permissions to enqueue and dequeue stay valid until `valid_until`.
+    """
+    position: changes.Position
+    valid_until: datetime
+
+    TIME_FORMAT = '%Y%m%d%H%M%S'
+
+    def __str__(self):
+        return f'{self.position}.{self.valid_until.strftime(self.TIME_FORMAT)}'
+
+    @classmethod
+    def parse(cls, value) -> Optional['PrototypeVersion']:
+        """Reads the version sent by the client. Returns None if malformed."""
+        try:
+            position, valid_until = value.rsplit('.', 1)
+            valid_until = datetime.strptime(valid_until, cls.TIME_FORMAT)
+        except (AttributeError, ValueError):
+            return None
+        position = changes.Position.parse(position)
+        if position is None:
+            return None
+        return cls(position, valid_until)
+
+
+def prefetch_group_data(groups: QuerySet) -> QuerySet:
+    """Makes the queryset fetch everything `build_group_list` needs.
+
+    The number of queries does not depend on the number of groups then.
+    """
+    return groups.select_related(
+        'course', 'course__semester', 'teacher', 'teacher__user').prefetch_related(
+            'term', 'term__classrooms',
+            Prefetch('guaranteed_spots', queryset=GuaranteedSpots.objects.select_related('role')))
+
+
+def build_group_list(groups: Iterable[Group]):
     """Builds a serializable object containing relevant information about groups.
 
     The information must be sufficient to display information in the timetable
     and perform actions (enqueuing/dequeuing).
     """
+    groups = list(groups)
     stats = Record.groups_stats(groups)
+    course_url = url_template('course-page')
+    group_url = url_template('group-view')
+    employee_url = url_template('employee-profile')
+    action_url = url_template('prototype-action')
     group_dicts = []
     group: Group
     for group in groups:
@@ -43,15 +95,15 @@ def build_group_list(groups: List[Group]):
         } for gs in group.guaranteed_spots.all()]
         group_dict.update({
             'course': {
-                'url': reverse('course-page', args=(group.course.slug, )),
+                'url': course_url(group.course.slug),
                 'name': group.course.name,
                 'shortName': group.course.short_name,
             },
             'type': decode_class_type_singular(group.type),
-            'url': reverse('group-view', args=(group.pk, )),
+            'url': group_url(group.pk),
             'teacher': {
                 'id': group.teacher_id,
-                'url': reverse('employee-profile', args=(group.teacher.user_id, )),
+                'url': employee_url(group.teacher.user_id),
                 'name': group.teacher.user.get_full_name(),
             },
             'num_enrolled': stats.get(group.pk).get('num_enrolled'),
@@ -62,7 +114,7 @@ def build_group_list(groups: List[Group]):
             'is_pinned': getattr(group, 'is_pinned', None),
             'can_enqueue': getattr(group, 'can_enqueue', None),
             'can_dequeue': getattr(group, 'can_dequeue', None),
-            'action_url': reverse('prototype-action', args=(group.pk, )),
+            'action_url': action_url(group.pk),
         })
         group_dicts.append(group_dict)
     return group_dicts
@@ -73,15 +125,90 @@ def list_courses_in_semester(semester: Semester):
 
     This list will be used in prototype.
     """
-    qs = CourseInstance.objects.filter(semester=semester).prefetch_related('effects', 'tags')
-    courses = []
-    for course in qs:
-        course_dict = course.__json__()
-        course_dict.update({
-            'url': reverse('prototype-get-course', args=(course.id,)),
-        })
-        courses.append(course_dict)
-    return courses
+    course_url = url_template('prototype-get-course')
+    return [{
+        **course,
+        'url': course_url(course['id']),
+    } for course in catalogue.get_catalogue(semester).courses]
+
+
+def annotate_prototype_groups(student: Student, groups: List[Group],
+                              statuses: Dict[int, RecordStatus], pinned: Optional[Set[int]]):
+    """Sets the per-student attributes of groups shown in the prototype.
+
+    Args:
+        statuses: Maps ids of groups to the status of the student's record.
+        pinned: Ids of groups pinned by the student. If None, the pins are left
+            out and the prototype keeps the ones it knows.
+    """
+    can_enqueue_dict = Record.can_enqueue_groups(student, groups)
+    can_dequeue_dict = Record.can_dequeue_groups(student, groups)
+    for group in groups:
+        group.is_enrolled = statuses.get(group.pk) == RecordStatus.ENROLLED
+        group.is_enqueued = statuses.get(group.pk) == RecordStatus.QUEUED
+        if pinned is not None:
+            group.is_pinned = group.pk in pinned
+        group.can_enqueue = can_enqueue_dict.get(group.pk)
+        group.can_dequeue = can_dequeue_dict.get(group.pk)
+
+
+def permissions_valid_until(student: Student, semester: Optional[Semester],
+                            group_ids: Iterable[int], now: datetime) -> datetime:
+    """Returns the moment when the student's permissions to the groups may change.
+
+    The permissions to enqueue and dequeue (see `annotate_prototype_groups`)
+    depend on time. They may only change when the student's T0 or opening time
+    passes, or when the enrollment in the semester or in the course opens or
+    closes. The moment is never later than `PROTOTYPE_FULL_UPDATE_INTERVAL`
+    from now.
+    """
+    group_ids = set(group_ids)
+    moments = list(Group.objects.filter(pk__in=group_ids).values_list(
+        'course__records_start', 'course__records_end', 'course__semester__records_opening',
+        'course__semester__records_closing', 'course__semester__records_ending').distinct())
+    moments = [moment for row in moments for moment in row]
+    if semester is not None:
+        opening_times = GroupOpeningTimes.get_student_opening_times(student, semester)
+        moments.append(opening_times.t0)
+        moments.extend(t for group_id, t in opening_times.groups.items() if group_id in group_ids)
+    moments.append(now + PROTOTYPE_FULL_UPDATE_INTERVAL)
+    return min(m for m in moments if m is not None and m > now)
+
+
+def prototype_version(student: Student, semester: Optional[Semester], group_ids: Iterable[int],
+                      position: Optional[changes.Position],
+                      now: datetime) -> Optional[PrototypeVersion]:
+    """Returns the version of the groups data, if the log of changes is available."""
+    if position is None:
+        return None
+    return PrototypeVersion(position, permissions_valid_until(student, semester, group_ids, now))
+
+
+def prototype_data(student: Student, semester: Optional[Semester]):
+    """Collects the prototype data for a student.
+
+    These are the enrolled, enqueued and pinned groups annotated with the
+    student's state, the course filters and the list of courses, and the
+    version of the data to poll for updates with. The number of database
+    queries does not depend on the number of groups nor courses.
+    """
+    now = datetime.now()
+    # Anything changed after this position will be sent in the first poll.
+    position = changes.get_position()
+    statuses: Dict[int, RecordStatus] = dict(
+        Record.objects.filter(student=student, group__course__semester=semester).exclude(
+            status=RecordStatus.REMOVED).values_list('group_id', 'status'))
+    pinned = set(Pin.objects.filter(
+        student=student, group__course__semester=semester).values_list('group_id', flat=True))
+    groups = list(prefetch_group_data(Group.objects.filter(pk__in=statuses.keys() | pinned)))
+    annotate_prototype_groups(student, groups, statuses, pinned)
+    version = prototype_version(student, semester, statuses.keys() | pinned, position, now)
+    return {
+        'groups_json': build_group_list(groups),
+        'version': version and str(version),
+        'filters_json': catalogue.get_catalogue(semester).filters,
+        'courses_json': list_courses_in_semester(semester),
+    }
 
 
 def student_timetable_data(student: Student, semester: Optional[Semester]):
@@ -108,9 +235,7 @@ def student_timetable_data(student: Student, semester: Optional[Semester]):
 
 def employee_timetable_data(employee: Employee, semester: Optional[Semester]):
     """Collects the timetable data for an employee."""
-    groups = Group.objects.filter(teacher=employee, course__semester=semester).select_related(
-        'teacher', 'teacher__user', 'course').prefetch_related(
-            'term', 'term__classrooms', 'guaranteed_spots', 'guaranteed_spots__role')
+    groups = prefetch_group_data(Group.objects.filter(teacher=employee, course__semester=semester))
     group_dicts = build_group_list(groups)
     data = {
         'groups_dicts': group_dicts,
@@ -143,48 +268,8 @@ def my_timetable(request, semester_id: Optional[int] = None):
 @student_required
 def my_prototype(request):
     """Renders the prototype with enrolled, enqueued, and pinned groups."""
-    student = request.user.student
     semester = Semester.get_upcoming_semester()
-
-    # This costs an additional join, but works if there is no current semester.
-    records = Record.objects.filter(
-        student=student,
-        group__course__semester=semester).exclude(status=RecordStatus.REMOVED).select_related(
-            'group__teacher', 'group__teacher__user',
-            'group__course', 'group__course__semester').prefetch_related(
-                'group__term', 'group__term__classrooms', 'group__guaranteed_spots',
-                'group__guaranteed_spots__role')
-    pinned = Pin.student_pins_in_semester(student, semester)
-    pinned = list(pinned)
-    all_groups_by_id = {r.group_id: r.group for r in records}
-    all_groups_by_id.update({p.pk: p for p in pinned})
-    all_groups = list(all_groups_by_id.values())
-    can_enqueue_dict = Record.can_enqueue_groups(student, all_groups)
-    can_dequeue_dict = Record.can_dequeue_groups(student, all_groups)
-
-    for record in records:
-        group = all_groups_by_id.get(record.group_id)
-        group.is_enrolled = record.status == RecordStatus.ENROLLED
-        group.is_enqueued = record.status == RecordStatus.QUEUED
-
-    for pin in pinned:
-        group = all_groups_by_id.get(pin.pk)
-        group.is_pinned = True
-
-    all_groups = all_groups_by_id.values()
-    for group in all_groups:
-        group.can_enqueue = can_enqueue_dict.get(group.pk)
-        group.can_dequeue = can_dequeue_dict.get(group.pk)
-
-    group_dicts = build_group_list(all_groups)
-    filters_dict = CourseInstance.prepare_filter_data(
-        CourseInstance.objects.filter(semester=semester))
-    courses_json = list_courses_in_semester(semester)
-    data = {
-        'groups_json': group_dicts,
-        'filters_json': filters_dict,
-        'courses_json': courses_json,
-    }
+    data = prototype_data(request.user.student, semester)
     return render(request, 'timetable/prototype.html', data)
 
 
@@ -232,9 +317,7 @@ def prototype_get_course(request, course_id):
     """Retrieves the annotated groups of a single course."""
     student = request.user.student
     course = CourseInstance.objects.get(pk=course_id)
-    groups = course.groups.exclude(extra='hidden').select_related(
-        'course', 'teacher', 'course__semester', 'teacher__user'
-    ).prefetch_related('term', 'term__classrooms', 'guaranteed_spots', 'guaranteed_spots__role')
+    groups = prefetch_group_data(course.groups.exclude(extra='hidden'))
     can_enqueue_dict = Record.can_enqueue_groups(student, groups)
     can_dequeue_dict = Record.can_dequeue_groups(student, groups)
     for group in groups:
@@ -247,42 +330,51 @@ def prototype_get_course(request, course_id):
 @student_required
 @require_POST
 def prototype_update_groups(request):
-    """Retrieves the updated group annotations.
+    """Retrieves the annotations of groups changed since the last poll.
+
+    The JSON body of the request holds the `ids` of groups shown in the
+    prototype and the `version` returned by the previous poll (or rendered with
+    the prototype). The response holds the new `version` and the `groups` that
+    may have changed since, including those the student is enrolled or enqueued
+    in. Without a valid version all the groups are sent. A poll with nothing to
+    update costs a single Redis read.
 
-    The list of groups ids to update will be sent in JSON body of the request.
+    A request with just a list of ids is answered with the list of all the
+    groups, as it used to be.
     """
     student = request.user.student
-    semester = Semester.get_upcoming_semester()
+    now = datetime.now()
     # Axios sends POST data in json rather than _Form-Encoded_.
-    ids: List[int] = json.loads(request.body.decode('utf-8'))
-    num_enrolled = Count('record', filter=Q(record__status=RecordStatus.ENROLLED))
-    is_enrolled = Count(
-        'record',
-        filter=(Q(record__status=RecordStatus.ENROLLED, record__student_id=student.pk)))
-    is_enqueued = Count(
-        'record',
-        filter=(Q(record__status=RecordStatus.QUEUED, record__student_id=student.pk)))
-
-    groups_from_ids = Group.objects.filter(pk__in=ids)
-    groups_enrolled_or_enqueued = Group.objects.filter(
-        course__semester=semester,
-        record__status__in=[RecordStatus.QUEUED, RecordStatus.ENROLLED],
-        record__student=student)
-    groups_all = groups_from_ids | groups_enrolled_or_enqueued
-    groups = groups_all.annotate(num_enrolled=num_enrolled).annotate(
-        is_enrolled=is_enrolled).annotate(is_enqueued=is_enqueued).select_related(
-            'course', 'teacher', 'course__semester', 'teacher__user').prefetch_related(
-                'term', 'term__classrooms', 'guaranteed_spots', 'guaranteed_spots__role')
+    data = json.loads(request.body.decode('utf-8'))
+    legacy = isinstance(data, list)
+    if legacy:
+        data = {'ids': data}
+    since = PrototypeVersion.parse(data.get('version'))
+    if since is not None and now >= since.valid_until:
+        since = None
+    position = changes.get_position()
+    if since is not None and position == since.position:
+        return JsonResponse({'version': str(since), 'groups': []})
 
-    can_enqueue_dict = Record.can_enqueue_groups(student, groups)
-    can_dequeue_dict = Record.can_dequeue_groups(student, groups)
-    for group in groups:
-        group.can_enqueue = can_enqueue_dict.get(group.pk)
-        group.can_dequeue = can_dequeue_dict.get(group.pk)
-        group.is_enqueued = bool(group.is_enqueued)
-        group.is_enrolled = bool(group.is_enrolled)
+    semester = Semester.get_upcoming_semester()
+    ids: Set[int] = {int(group_id) for group_id in data.get('ids', [])}
+    statuses: Dict[int, RecordStatus] = dict(
+        Record.objects.filter(
+            Q(group__course__semester=semester) | Q(group_id__in=ids), student=student).exclude(
+                status=RecordStatus.REMOVED).values_list('group_id', 'status'))
+    group_ids = ids | statuses.keys()
+    changed = None
+    if since is not None:
+        changed = changes.changed_since(since.position, group_ids)
+    if changed is None:
+        changed = group_ids
+    groups = list(prefetch_group_data(Group.objects.filter(pk__in=changed)))
+    annotate_prototype_groups(student, groups, statuses, None)
     group_dicts = build_group_list(groups)
-    return JsonResponse(group_dicts, safe=False)
+    if legacy:
+        return JsonResponse(group_dicts, safe=False)
+    version = prototype_version(student, semester, group_ids, position, now)
+    return JsonResponse({'version': version and str(version), 'groups': group_dicts})
 
 
 @login_required
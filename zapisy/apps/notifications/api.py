@@ -1,33 +1,64 @@
-from typing import List
+from typing import Iterable, List
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import QuerySet
+from django_rq import job
 
+from apps.notifications import digests
 from apps.notifications.datatypes import Notification
 from apps.notifications.repositories import get_notifications_repository
-from apps.notifications.tasks import dispatch_notifications_task
 
 
 def notify_user(user: User, notification: Notification, repo=None):
     """Dispatch one notification to one user.
 
     Repository saves notification to redis.
-    Then we queue user to send (regarding preferences)
-    all his pending notifications, including this one.
+    Then we schedule user to be sent (regarding preferences)
+    all his pending notifications, including this one, in one e-mail.
 
     Notifications repository can be initialised outside for perfomance reasons.
     """
     if repo is None:
         repo = get_notifications_repository()
     repo.save(user, notification)
+    digests.schedule([user.pk])
+
+
+@job('default')
+def fan_out_task(user_ids: List[int], notification: Notification):
+    """Saves the notification for all the users and schedules their digests.
+
+    The notifications are saved with pipelined Redis commands. The users are
+    then sent their digests in batches by a single job.
+    """
+    get_notifications_repository().save_many(user_ids, notification)
+    digests.schedule(user_ids)
+
+
+def notify_users_by_ids(user_ids: Iterable[int], notification: Notification):
+    """Dispatch one notification to the users with the given ids.
+
+    With RUN_ASYNC the work is done by a job queued once the current
+    transaction commits, so that the request does not wait for it.
+    """
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return
     if not settings.RUN_ASYNC:
-        dispatch_notifications_task(user)
+        fan_out_task(user_ids, notification)
     else:
-        dispatch_notifications_task.delay(user)
+        transaction.on_commit(lambda: fan_out_task.delay(user_ids, notification))
+
 
+def notify_selected_users(users: Iterable[User], notification: Notification):
+    """Dispatch one notification to multiple users.
 
-def notify_selected_users(users: List[User], notification: Notification):
-    """Dispatch one notification to multiple users."""
-    repo = get_notifications_repository()
-    for user in users:
-        notify_user(user, notification, repo)
+    Users may also be given as a QuerySet, which is then not loaded.
+    """
+    if isinstance(users, QuerySet):
+        user_ids = users.values_list('pk', flat=True)
+    else:
+        user_ids = [user.pk for user in users]
+    notify_users_by_ids(user_ids, notification)
@@ -0,0 +1,230 @@
+"""Sending notifications by e-mail in digests.
+
+Notified users are not sent e-mails right away. They are marked as pending in
+Redis, and a single `send_pending_digests` job is scheduled to run after
+NOTIFICATIONS_DIGEST_WINDOW seconds, so every user notified in the meantime
+gets all their pending notifications in one e-mail. Further notifications
+schedule another job only once that one has started.
+
+All the e-mails sent by a worker go through one SMTP connection, kept open
+between jobs and reopened when the server drops it. The rate of e-mails is
+limited globally (for all the workers) with a token bucket of EMAIL_RATE_BURST
+tokens refilled at EMAIL_RATE_LIMIT per second. When the bucket runs dry, the
+remaining users are put back in the pending set and the job is scheduled again
+for when the next token comes, instead of holding the worker.
+"""
+import logging
+import smtplib
+from datetime import timedelta
+from typing import Iterable, List, Optional, Tuple
+
+import django_rq
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import EmailMessage, get_connection
+from django.template.loader import render_to_string
+from django.utils.html import strip_tags
+from django_rq import job
+
+from apps.notifications.models import NotificationPreferencesStudent, NotificationPreferencesTeacher
+from apps.notifications.repositories import NotificationsRepository, get_notifications_repository
+from apps.notifications.utils import render_description, render_title
+
+LOGGER = logging.getLogger(__name__)
+
+QUEUE_NAME = 'dispatch-notifications'
+DISPATCH_KEY_PREFIX = 'notifications:dispatch:'
+PENDING_KEY = DISPATCH_KEY_PREFIX + 'pending'
+SCHEDULED_KEY = DISPATCH_KEY_PREFIX + 'scheduled'
+BUCKET_KEY = DISPATCH_KEY_PREFIX + 'bucket'
+# The scheduled mark expires in case the job gets lost (i.e. the worker dies).
+SCHEDULED_TIMEOUT_SECONDS = 600
+# Number of users loaded from the database at once.
+DIGEST_BATCH_SIZE = 100
+
+EMAIL_SUBJECT_TEMPLATE = "[ZAPISY] %s"
+DIGEST_TITLE_TEMPLATE = "Nowe powiadomienia (%d)"
+
+# Takes a token from the bucket. Returns 0 if there was one, or the number of
+# seconds until there is one otherwise.
+TAKE_TOKEN_SCRIPT = """
+    local rate = tonumber(ARGV[1])
+    local burst = tonumber(ARGV[2])
+    local time = redis.call('TIME')
+    local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+    local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens') or burst)
+    local updated = tonumber(redis.call('HGET', KEYS[1], 'updated') or now)
+    tokens = math.min(burst, tokens + (now - updated) * rate)
+    local wait = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+    else
+        wait = (1 - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return tostring(wait)
+"""
+
+_connection = None
+
+
+def _redis():
+    return django_rq.get_connection(QUEUE_NAME)
+
+
+def _queue():
+    return django_rq.get_queue(QUEUE_NAME)
+
+
+def _take_token() -> float:
+    """Returns the number of seconds to wait before the next e-mail can be sent."""
+    if not settings.EMAIL_RATE_LIMIT:
+        return 0
+    script = _redis().register_script(TAKE_TOKEN_SCRIPT)
+    return float(script(keys=[BUCKET_KEY],
+                        args=[settings.EMAIL_RATE_LIMIT, settings.EMAIL_RATE_BURST]))
+
+
+def _send(message: EmailMessage):
+    """Sends the message through the worker's connection, reopening it if needed."""
+    global _connection
+    if _connection is None:
+        _connection = get_connection(fail_silently=False)
+    try:
+        _connection.open()
+        _connection.send_messages([message])
+    except smtplib.SMTPServerDisconnected:
+        LOGGER.info('The SMTP connection was closed, reconnecting.')
+        _connection.close()
+        _connection.open()
+        _connection.send_messages([message])
+
+
+def close_connection():
+    """Closes the worker's SMTP connection, if there is one."""
+    global _connection
+    if _connection is not None:
+        _connection.close()
+        _connection = None
+
+
+def _preferences(user: User):
+    if user.employee:
+        model = getattr(user, 'notificationpreferencesteacher', None)
+        if model is None:
+            model, created = NotificationPreferencesTeacher.objects.get_or_create(user=user)
+        return model
+    if user.student:
+        model = getattr(user, 'notificationpreferencesstudent', None)
+        if model is None:
+            model, created = NotificationPreferencesStudent.objects.get_or_create(user=user)
+        return model
+    return None
+
+
+def _digest(user: User, preferences, pending) -> Optional[EmailMessage]:
+    """Composes a single e-mail of the pending notifications the user wants."""
+    wanted = [pn for pn in pending if getattr(preferences, pn.description_id, None)]
+    if not wanted:
+        return None
+    if len(wanted) == 1:
+        title = render_title(wanted[0].description_id, wanted[0].description_args)
+    else:
+        title = DIGEST_TITLE_TEMPLATE % len(wanted)
+    ctx = {
+        'content': '\n\n'.join(
+            render_description(pn.description_id, pn.description_args) for pn in wanted),
+        'greeting': f'Dzień dobry, {user.first_name}',
+    }
+    message_contents = render_to_string('notifications/email_base.html', ctx)
+    return EmailMessage(EMAIL_SUBJECT_TEMPLATE % title, strip_tags(message_contents),
+                        settings.MASS_MAIL_FROM, [user.email])
+
+
+def send_digests(user_ids: Iterable[int], rate_limited: bool = True,
+                 repo: Optional[NotificationsRepository] = None) -> Tuple[List[int], float]:
+    """Sends every user their pending notifications in one e-mail.
+
+    Notifications are marked as sent once the e-mail goes out (also the ones
+    the user does not want by e-mail). If sending to a user fails, the error
+    is logged and their notifications stay unsent. If the rate limit is hit,
+    returns the ids of the users left out and the number of seconds to wait.
+    """
+    if repo is None:
+        repo = get_notifications_repository()
+    users = list(User.objects.filter(pk__in=list(user_ids)).select_related(
+        'employee', 'student', 'notificationpreferencesteacher',
+        'notificationpreferencesstudent').order_by('pk'))
+    for i, user in enumerate(users):
+        preferences = _preferences(user)
+        if preferences is None:
+            continue
+        pending = repo.get_unsent_for_user(user)
+        if not pending:
+            continue
+        message = _digest(user, preferences, pending)
+        if message is not None:
+            wait = _take_token() if rate_limited else 0
+            if wait > 0:
+                return [u.pk for u in users[i:]], wait
+            try:
+                _send(message)
+            except smtplib.SMTPException:
+                LOGGER.exception('Sending the notifications to user %s failed.', user.pk)
+                continue
+        for pn in pending:
+            repo.mark_as_sent(user, pn)
+    return [], 0
+
+
+def _schedule_job(delay: float):
+    if _redis().set(SCHEDULED_KEY, 1, nx=True, ex=int(delay) + SCHEDULED_TIMEOUT_SECONDS):
+        _queue().enqueue_in(timedelta(seconds=delay), send_pending_digests)
+
+
+def schedule(user_ids: Iterable[int]):
+    """Makes sure the users will be sent their pending notifications.
+
+    Depending on the RUN_ASYNC setting, the e-mails are either sent right
+    away or by the digest job scheduled for the end of the current window.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    if not settings.RUN_ASYNC:
+        send_digests(user_ids, rate_limited=False)
+        return
+    pipe = _redis().pipeline(transaction=False)
+    for i in range(0, len(user_ids), DIGEST_BATCH_SIZE * 10):
+        pipe.sadd(PENDING_KEY, *user_ids[i:i + DIGEST_BATCH_SIZE * 10])
+    pipe.execute()
+    _schedule_job(settings.NOTIFICATIONS_DIGEST_WINDOW)
+
+
+@job(QUEUE_NAME)
+def send_pending_digests():
+    """Sends the digests to all the pending users.
+
+    The scheduled mark is removed first, so users notified during the run are
+    handled by another job. If the job fails, the users of the current batch
+    are put back and another job is scheduled (the ones already sent to have
+    nothing pending any more).
+    """
+    connection = _redis()
+    connection.delete(SCHEDULED_KEY)
+    repo = get_notifications_repository()
+    while True:
+        user_ids = [int(user_id) for user_id in connection.spop(PENDING_KEY, DIGEST_BATCH_SIZE)]
+        if not user_ids:
+            return
+        try:
+            left_out, wait = send_digests(user_ids, repo=repo)
+        except Exception:
+            connection.sadd(PENDING_KEY, *user_ids)
+            _schedule_job(settings.NOTIFICATIONS_DIGEST_WINDOW)
+            raise
+        if left_out:
+            connection.sadd(PENDING_KEY, *left_out)
+            _schedule_job(wait)
+            return
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+
+from apps.notifications.repositories import KEY_PATTERN, KEY_PREFIX, get_notifications_repository
+
+# Sets of serialized notifications of every user, stored before notifications
+# were shared between their recipients.
+LEGACY_KEY_PATTERN = KEY_PREFIX + '*#*'
+
+
+class Command(BaseCommand):
+    help = ("Moves the notifications stored in the old format (a set of serialized notifications "
+            "for every user) to the shared storage, and reports the memory used by the "
+            "notifications before and after. Users keep their unsent and sent notifications. "
+            "Can be run again, keys already moved are skipped.")
+
+    def handle(self, *args, **kwargs):
+        repo = get_notifications_repository()
+        client = repo.redis_client
+        before = self.measure(client)
+        moved_keys = 0
+        moved_notifications = 0
+        for key in list(client.scan_iter(LEGACY_KEY_PATTERN)):
+            kind, user_id = key.decode()[len(KEY_PREFIX):].split('#')
+            notifications = [repo.serializer.deserialize(m) for m in client.smembers(key)]
+            target = repo._unsent_key(user_id) if kind == 'unsent' else repo._sent_key(user_id)
+            pipe = client.pipeline(transaction=True)
+            for notification in notifications:
+                pipe.set(repo._body_key(notification.id), repo.serializer.serialize(notification))
+                pipe.zadd(target, {notification.id: repo._score(notification.issued_on)}, nx=True)
+            pipe.delete(key)
+            added = pipe.execute()[1:-1:2]
+            pipe = client.pipeline(transaction=False)
+            for notification, was_added in zip(notifications, added):
+                if was_added:
+                    pipe.incr(repo._refs_key(notification.id))
+            pipe.execute()
+            moved_keys += 1
+            moved_notifications += len(notifications)
+        after = self.measure(client)
+        self.stdout.write(f"Moved {moved_notifications} notifications of {moved_keys} keys.")
+        self.stdout.write(f"Before: {before[0]} keys, {before[1]} bytes.")
+        self.stdout.write(f"After: {after[0]} keys, {after[1]} bytes.")
+
+    @staticmethod
+    def measure(client):
+        """Counts the keys of notifications and the memory they take."""
+        keys = list(client.scan_iter(KEY_PATTERN))
+        pipe = client.pipeline(transaction=False)
+        for key in keys:
+            pipe.memory_usage(key)
+        return len(keys), sum(usage or 0 for usage in pipe.execute())
@@ -0,0 +1,85 @@
+import time
+import uuid
+from datetime import datetime
+
+from unittest import mock
+
+import django_rq
+import rq
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.test import override_settings
+from more_itertools import chunked
+from rq.registry import ScheduledJobRegistry
+
+from apps.notifications import digests
+from apps.notifications.datatypes import Notification
+from apps.notifications.repositories import RedisNotificationsRepository, get_notifications_repository
+from apps.notifications.tasks import dispatch_notifications_task
+from apps.notifications.templates import NotificationType
+
+BENCHMARK_QUEUE = 'notifications-benchmark'
+BENCHMARK_PENDING_KEY = digests.DISPATCH_KEY_PREFIX + 'benchmark-pending'
+BENCHMARK_SCHEDULED_KEY = digests.DISPATCH_KEY_PREFIX + 'benchmark-scheduled'
+
+
+def benchmark_job():
+    """Stands in for `send_pending_digests`, which would read the real pending users."""
+
+
+class Command(BaseCommand):
+    help = ("Compares the time of saving a notification for many users and queueing their "
+            "dispatch one user at a time with the pipelined fan-out to a single digest job. "
+            "Made-up user ids, separate pending users and a separate queue are used, and "
+            "everything is deleted afterwards, so no e-mails are sent.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10000)
+
+    def handle(self, *args, **kwargs):
+        repo = get_notifications_repository()
+        queue = rq.Queue(BENCHMARK_QUEUE, connection=django_rq.get_connection())
+        first_id = (User.objects.aggregate(Max('pk'))['pk__max'] or 0) + 1000000
+        user_ids = list(range(first_id, first_id + kwargs["users"]))
+        notification = Notification(str(uuid.uuid1()), datetime.now(),
+                                    NotificationType.NEWS_HAS_BEEN_ADDED,
+                                    {'title': 'Benchmark', 'contents': ''}, '#')
+
+        def loop():
+            for user_id in user_ids:
+                user = User(pk=user_id)
+                repo.save(user, notification)
+                queue.enqueue(dispatch_notifications_task, user)
+
+        def fan_out():
+            repo.save_many(user_ids, notification)
+            with override_settings(RUN_ASYNC=True), \
+                    mock.patch.object(digests, 'PENDING_KEY', BENCHMARK_PENDING_KEY), \
+                    mock.patch.object(digests, 'SCHEDULED_KEY', BENCHMARK_SCHEDULED_KEY), \
+                    mock.patch.object(digests, 'send_pending_digests', benchmark_job), \
+                    mock.patch.object(digests, '_queue', lambda: queue):
+                digests.schedule(user_ids)
+
+        for name, run in (("loop", loop), ("fan-out", fan_out)):
+            try:
+                start = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - start
+                jobs = queue.count + ScheduledJobRegistry(queue=queue).count
+            finally:
+                self.clean_up(repo, queue, user_ids, notification)
+            self.stdout.write(f"{name}: {elapsed:.3f}s for {len(user_ids)} users, {jobs} jobs, "
+                              f"{len(user_ids) / elapsed:.0f} users/s")
+
+    @staticmethod
+    def clean_up(repo: RedisNotificationsRepository, queue: rq.Queue, user_ids,
+                 notification: Notification):
+        for batch in chunked(user_ids, 1000):
+            repo.redis_client.delete(*(repo._unsent_key(user_id) for user_id in batch))
+        repo.redis_client.delete(repo._body_key(notification.id), repo._refs_key(notification.id),
+                                 BENCHMARK_PENDING_KEY, BENCHMARK_SCHEDULED_KEY)
+        registry = ScheduledJobRegistry(queue=queue)
+        for job_id in registry.get_job_ids():
+            registry.remove(job_id, delete_job=True)
+        queue.empty()
@@ -0,0 +1,17 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+
+from apps.notifications.repositories import get_notifications_repository
+
+
+class Command(BaseCommand):
+    help = "Removes the notifications older than the given number of days from all the users."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=180)
+
+    def handle(self, *args, **kwargs):
+        until = datetime.now() - timedelta(days=kwargs["days"])
+        removed = get_notifications_repository().remove_all_older_than_for_all_users(until)
+        self.stdout.write(f"Removed {removed} notifications issued before {until:%Y-%m-%d %H:%M}.")
@@ -1,10 +1,14 @@
+import collections
+import heapq
+import itertools
 from abc import ABC, abstractmethod
 from datetime import datetime
-from typing import List
+from typing import Iterable, List
 
 import redis
 
 from django.contrib.auth.models import User
+from more_itertools import chunked
 
 from apps.common.redis import flush_by_pattern
 from apps.notifications.datatypes import Notification
@@ -12,6 +16,8 @@ from apps.notifications.serialization import JsonNotificationSerializer, Notific
 
 KEY_PREFIX = 'notifications:'
 KEY_PATTERN = KEY_PREFIX + '*'
+# Number of users `save_many` saves the notification for in one script call.
+PIPELINE_BATCH_SIZE = 1000
 
 
 class NotificationsRepository(ABC):
@@ -24,6 +30,10 @@ class NotificationsRepository(ABC):
     def get_all_for_user(self, user: User) -> List[Notification]:
         pass
 
+    @abstractmethod
+    def get_newest_for_user(self, user: User, limit: int, offset: int = 0) -> List[Notification]:
+        pass
+
     @abstractmethod
     def get_unsent_for_user(self, user: User) -> List[Notification]:
         pass
@@ -36,6 +46,10 @@ class NotificationsRepository(ABC):
     def save(self, user: User, notification: Notification) -> None:
         pass
 
+    @abstractmethod
+    def save_many(self, user_ids: Iterable[int], notification: Notification) -> None:
+        pass
+
     @abstractmethod
     def remove_all(self, user: User) -> None:
         pass
@@ -52,102 +66,182 @@ class NotificationsRepository(ABC):
     def remove_one_with_id(self, user: User, ID: str) -> int:
         pass
 
+    @abstractmethod
+    def remove_all_older_than_for_all_users(self, until: datetime) -> int:
+        pass
+
 
 class RedisNotificationsRepository(NotificationsRepository):
+    """Keeps every notification once, shared by all its recipients.
+
+    The serialized notification is stored under its id together with the
+    number of users referencing it, and is deleted when the last of them
+    removes it. Every user has two sorted sets (unsent and sent) of the ids
+    of their notifications, scored by the time they were issued.
+    """
+
+    # Decrements the references to a notification and deletes it when there
+    # are none left.
+    RELEASE_SCRIPT = """
+        local refs = redis.call('DECRBY', KEYS[1], ARGV[1])
+        if refs <= 0 then
+            redis.call('DEL', KEYS[1], KEYS[2])
+        end
+        return refs
+    """
+
+    # Adds the notification to the unsent sets of the users not holding it
+    # yet, and stores it with the number of users added, if there were any.
+    SAVE_SCRIPT = """
+        local added = 0
+        for i = 3, #KEYS do
+            added = added + redis.call('ZADD', KEYS[i], 'NX', ARGV[2], ARGV[3])
+        end
+        if added > 0 then
+            redis.call('SET', KEYS[2], ARGV[1])
+            redis.call('INCRBY', KEYS[1], added)
+        end
+        return added
+    """
 
     def __init__(self, serializer: NotificationSerializer):
         self.serializer = serializer
         self.redis_client = redis.Redis()
-        self.removed_count = 0
+        self.release_script = self.redis_client.register_script(self.RELEASE_SCRIPT)
+        self.save_script = self.redis_client.register_script(self.SAVE_SCRIPT)
 
     def get_count_for_user(self, user: User) -> int:
-        # SCARD returns 0 if one of them does not exist
-        # so no need to check for key existence here
-        unsent_count = self.redis_client.scard(
-            self._generate_unsent_key_for_user(user))
-        sent_count = self.redis_client.scard(
-            self._generate_sent_key_for_user(user))
-
-        return unsent_count + sent_count
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zcard(self._unsent_key(user.id))
+        pipe.zcard(self._sent_key(user.id))
+        return sum(pipe.execute())
 
     def get_all_for_user(self, user: User) -> List[Notification]:
-        serialized = self.redis_client.smembers(
-            self._generate_unsent_key_for_user(user))
-        serialized = serialized.union(
-            self.redis_client.smembers(self._generate_sent_key_for_user(user)))
-
-        return list(map(self.serializer.deserialize, serialized))
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zrange(self._unsent_key(user.id), 0, -1)
+        pipe.zrange(self._sent_key(user.id), 0, -1)
+        unsent, sent = pipe.execute()
+        return self._load(unsent + sent)
+
+    def get_newest_for_user(self, user: User, limit: int, offset: int = 0) -> List[Notification]:
+        """Returns a page of the user's notifications, newest first.
+
+        Only the first `offset + limit` entries of both sorted sets are read.
+        """
+        if limit <= 0:
+            return []
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zrevrange(self._unsent_key(user.id), 0, offset + limit - 1, withscores=True)
+        pipe.zrevrange(self._sent_key(user.id), 0, offset + limit - 1, withscores=True)
+        unsent, sent = pipe.execute()
+        newest = heapq.merge(unsent, sent, key=lambda entry: -entry[1])
+        return self._load([i for i, _ in itertools.islice(newest, offset, offset + limit)])
 
     def get_unsent_for_user(self, user: User) -> List[Notification]:
-        return list(map(
-            self.serializer.deserialize,
-            self.redis_client.smembers(self._generate_unsent_key_for_user(user))))
+        return self._load(self.redis_client.zrange(self._unsent_key(user.id), 0, -1))
 
     def mark_as_sent(self, user: User, notification: Notification) -> None:
-        serialized = self.serializer.serialize(notification)
-
-        self.redis_client.srem(
-            self._generate_unsent_key_for_user(user), serialized)
-        self.redis_client.sadd(
-            self._generate_sent_key_for_user(user), serialized)
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.zrem(self._unsent_key(user.id), notification.id)
+        pipe.zadd(self._sent_key(user.id), {notification.id: self._score(notification.issued_on)})
+        pipe.execute()
 
     def save(self, user: User, notification: Notification) -> None:
-        self.redis_client.sadd(
-            self._generate_unsent_key_for_user(user),
-            self.serializer.serialize(notification))
+        self.save_many([user.id], notification)
+
+    def save_many(self, user_ids: Iterable[int], notification: Notification) -> None:
+        """Saves the notification for all the users, a batch in a single script.
+
+        Each batch is atomic, so the notification and the count of its
+        references cannot be released in between.
+        """
+        keys = [self._refs_key(notification.id), self._body_key(notification.id)]
+        args = [self.serializer.serialize(notification), self._score(notification.issued_on),
+                notification.id]
+        for batch in chunked(user_ids, PIPELINE_BATCH_SIZE):
+            self.save_script(keys=keys + [self._unsent_key(user_id) for user_id in batch],
+                             args=args)
 
     def remove_all(self, user: User) -> None:
-        self.redis_client.delete(self._generate_unsent_key_for_user(user))
-        self.redis_client.delete(self._generate_sent_key_for_user(user))
+        keys = [self._unsent_key(user.id), self._sent_key(user.id)]
+        pipe = self.redis_client.pipeline(transaction=True)
+        for key in keys:
+            pipe.zrange(key, 0, -1)
+        pipe.delete(*keys)
+        *ids, _ = pipe.execute()
+        self._release([notification_id for key_ids in ids for notification_id in key_ids])
 
     def flush(self) -> None:
         flush_by_pattern(self.redis_client, KEY_PATTERN)
 
     def remove_all_older_than(self, user: User, until: datetime) -> int:
-        self.removed_count = 0
-
-        self._remove_all_older_than(
-            self._generate_unsent_key_for_user(user), until)
-        self._remove_all_older_than(
-            self._generate_sent_key_for_user(user), until)
-
-        return self.removed_count
-
-    def _remove_all_older_than(self, key: str, point_in_time: datetime) -> int:
-        notifications_under_that_key = map(
-            self.serializer.deserialize,
-            self.redis_client.smembers(key))
-
-        for notification in notifications_under_that_key:
-            if notification.issued_on < point_in_time:
-                self.redis_client.srem(
-                    key, self.serializer.serialize(notification))
-                self.removed_count += 1
-        return self.removed_count
+        keys = [self._unsent_key(user.id), self._sent_key(user.id)]
+        max_score = f'({self._score(until)}'
+        pipe = self.redis_client.pipeline(transaction=True)
+        for key in keys:
+            pipe.zrangebyscore(key, '-inf', max_score)
+            pipe.zremrangebyscore(key, '-inf', max_score)
+        results = pipe.execute()
+        removed = [notification_id for key_ids in results[::2] for notification_id in key_ids]
+        self._release(removed)
+        return len(removed)
 
     def remove_one_with_id(self, user: User, ID: str) -> int:
-        self.removed_count = 0
-
-        self._remove_one_with_id(self._generate_unsent_key_for_user(user), ID)
-        self._remove_one_with_id(self._generate_sent_key_for_user(user), ID)
-
-        return self.removed_count
-
-    def _remove_one_with_id(self, key: str, ID: str) -> int:
-        notifications_under_that_key = map(self.serializer.deserialize,
-                                           self.redis_client.smembers(key))
-
-        for notification in notifications_under_that_key:
-            if notification.id == ID:
-                self.redis_client.srem(key, self.serializer.serialize(notification))
-                self.removed_count += 1
-        return self.removed_count
-
-    def _generate_unsent_key_for_user(self, user: User) -> str:
-        return f'{KEY_PREFIX}unsent#{user.id}'
-
-    def _generate_sent_key_for_user(self, user: User) -> str:
-        return f'{KEY_PREFIX}sent#{user.id}'
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.zrem(self._unsent_key(user.id), ID)
+        pipe.zrem(self._sent_key(user.id), ID)
+        removed = sum(pipe.execute())
+        if removed:
+            self._release([ID] * removed)
+        return removed
+
+    def remove_all_older_than_for_all_users(self, until: datetime) -> int:
+        """Removes the notifications issued before `until` from every user."""
+        user_ids = {
+            key.decode()[len(KEY_PREFIX):].split(':')[1]
+            for key in self.redis_client.scan_iter(self._unsent_key('*'))
+        } | {
+            key.decode()[len(KEY_PREFIX):].split(':')[1]
+            for key in self.redis_client.scan_iter(self._sent_key('*'))
+        }
+        return sum(self.remove_all_older_than(User(pk=int(user_id)), until) for user_id in user_ids)
+
+    def _load(self, ids: List[bytes]) -> List[Notification]:
+        if not ids:
+            return []
+        bodies = self.redis_client.mget([self._body_key(i.decode()) for i in ids])
+        return [self.serializer.deserialize(body) for body in bodies if body is not None]
+
+    def _release(self, ids: Iterable) -> None:
+        counts = collections.Counter(i.decode() if isinstance(i, bytes) else i for i in ids)
+        if not counts:
+            return
+        pipe = self.redis_client.pipeline(transaction=False)
+        for notification_id, count in counts.items():
+            self.release_script(keys=[self._refs_key(notification_id),
+                                      self._body_key(notification_id)],
+                                args=[count], client=pipe)
+        pipe.execute()
+
+    @staticmethod
+    def _score(issued_on: datetime) -> float:
+        return issued_on.timestamp()
+
+    @staticmethod
+    def _body_key(notification_id: str) -> str:
+        return f'{KEY_PREFIX}body:{notification_id}'
+
+    @staticmethod
+    def _refs_key(notification_id: str) -> str:
+        return f'{KEY_PREFIX}refs:{notification_id}'
+
+    @staticmethod
+    def _unsent_key(user_id: int) -> str:
+        return f'{KEY_PREFIX}user:{user_id}:unsent'
+
+    @staticmethod
+    def _sent_key(user_id: int) -> str:
+        return f'{KEY_PREFIX}user:{user_id}:sent'
 
 
 def get_notifications_repository() -> NotificationsRepository:
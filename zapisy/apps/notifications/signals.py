@@ -10,7 +10,7 @@ from apps.enrollment.courses.models.group import Group
 from apps.enrollment.courses.views import course_view
 from apps.enrollment.records.models import Record, RecordStatus
 from apps.news.models import News, PriorityChoices
-from apps.notifications.api import notify_selected_users, notify_user
+from apps.notifications.api import notify_selected_users, notify_user, notify_users_by_ids
 from apps.notifications.custom_signals import (student_not_pulled, student_pulled, teacher_changed,
                                                thesis_voting_activated, event_decision, thesis_accepted)
 from apps.notifications.datatypes import Notification
@@ -78,12 +78,11 @@ def notify_that_group_was_added_in_course(sender: Group, **kwargs) -> None:
                          {'course_name': course_name}, target))
 
     enrolled_or_queued = [RecordStatus.ENROLLED, RecordStatus.QUEUED]
-    records = Record.objects.filter(group__in=course_groups,
-                                    status__in=enrolled_or_queued).select_related(
-                                        'student', 'student__user')
-    users = {element.student.user for element in records}
-    notify_selected_users(
-        users,
+    user_ids = Record.objects.filter(group__in=course_groups,
+                                     status__in=enrolled_or_queued).values_list(
+                                         'student__user_id', flat=True)
+    notify_users_by_ids(
+        user_ids,
         Notification(get_id(), get_time(), NotificationType.ADDED_NEW_GROUP, {
             'course_name': course_name,
             'teacher': group.get_teacher_full_name()
@@ -147,13 +146,12 @@ def notify_that_news_was_added(sender: News, **kwargs) -> None:
     else:
         notification_type = NotificationType.NEWS_HAS_BEEN_ADDED_HIGH_PRIORITY
 
-    records = set(Employee.get_actives().select_related('user')) | set(
-        Student.get_active_students().select_related('user'))
-    users = [element.user for element in records]
+    user_ids = set(Employee.get_actives().values_list('user_id', flat=True)) | set(
+        Student.get_active_students().values_list('user_id', flat=True))
     target = reverse('news-one', args=[news.id])
 
-    notify_selected_users(
-        users,
+    notify_users_by_ids(
+        user_ids,
         Notification(get_id(), get_time(), notification_type, {
             'title': news.title,
             'contents': news.body
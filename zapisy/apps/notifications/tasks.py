@@ -1,67 +1,26 @@
-import time
+from typing import List
 
-from django.conf import settings
-from django.core.mail import send_mass_mail
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
 from django_rq import job
 
-from apps.notifications.models import NotificationPreferencesStudent, NotificationPreferencesTeacher
-from apps.notifications.repositories import get_notifications_repository
-from apps.notifications.utils import render_description
-from apps.notifications.utils import render_title
-
-EMAIL_SUBJECT_TEMPLATE = "[ZAPISY] %s"
+from apps.notifications.digests import send_digests
 
 
 @job('dispatch-notifications')
 def dispatch_notifications_task(user):
     """Dispatch all pending notifications for the given user by email.
 
-    We batch all the e-mails for the user together and send them using one SMTP
-    connection. We also wait for THROTTLE_SECONDS until we let the next task in
-    the work queue to send emails. This rate limiting is introduced for Gmail to
-    accept our queries.
+    The notifications are sent in one e-mail, see `apps.notifications.digests`.
+    The job is kept for the ones queued before digests were introduced,
+    notifications are now dispatched by `send_pending_digests`.
     """
-    if user.employee:
-        model, created = NotificationPreferencesTeacher.objects.get_or_create(user=user)
-    elif user.student:
-        model, created = NotificationPreferencesStudent.objects.get_or_create(user=user)
-    else:
-        return
-
-    repo = get_notifications_repository()
-    pending_notifications = repo.get_unsent_for_user(user)
-    if not pending_notifications:
-        return
-
-    messages = []
-    for pn in pending_notifications:
-        # User controls in account settings
-        # what notifications will be send
-        if not getattr(model, pn.description_id, None):
-            continue
-
-        ctx = {
-            'content': render_description(
-                pn.description_id, pn.description_args),
-            'greeting': f'Dzień dobry, {user.first_name}',
-        }
+    send_digests([user.pk], rate_limited=False)
 
-        subject = EMAIL_SUBJECT_TEMPLATE % render_title(pn.description_id, pn.description_args)
 
-        message_contents = render_to_string('notifications/email_base.html', ctx)
-
-        messages.append((
-            subject,
-            strip_tags(message_contents),
-            settings.MASS_MAIL_FROM,
-            [user.email],
-        ))
-    send_mass_mail(messages, fail_silently=False)
-
-    # Only mark the notifications as sent if the e-mails went out successfully.
-    for pn in pending_notifications:
-        repo.mark_as_sent(user, pn)
+@job('dispatch-notifications')
+def dispatch_notifications_batch_task(user_ids: List[int]):
+    """Dispatch all pending notifications for every user in the batch.
 
-    time.sleep(settings.EMAIL_THROTTLE_SECONDS)
+    Works like `dispatch_notifications_task`, but the users and their
+    preferences are loaded together.
+    """
+    send_digests(user_ids, rate_limited=False)
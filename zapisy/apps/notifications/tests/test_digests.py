@@ -0,0 +1,172 @@
+import importlib.util
+import smtplib
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+import django_rq
+from django import test
+from django.core import mail
+from rq.registry import ScheduledJobRegistry
+
+from apps.notifications import digests
+from apps.notifications.api import notify_user
+from apps.notifications.datatypes import Notification
+from apps.notifications.models import NotificationPreferencesStudent
+from apps.notifications.repositories import get_notifications_repository
+from apps.notifications.templates import NotificationType
+from apps.users.tests.factories import StudentFactory
+
+ISSUED_ON = datetime(2031, 3, 3, 12, 0)
+
+
+def news_notification(title: str, hours: int = 0) -> Notification:
+    return Notification(f'digest-test-{title}', ISSUED_ON + timedelta(hours=hours),
+                        NotificationType.NEWS_HAS_BEEN_ADDED, {'title': title, 'contents': ''}, '#')
+
+
+@test.override_settings(RUN_ASYNC=False, EMAIL_RATE_LIMIT=0)
+class DigestsTestCase(test.TestCase):
+    def setUp(self):
+        self.users = [StudentFactory().user for _ in range(3)]
+        for user in self.users:
+            NotificationPreferencesStudent.objects.create(user=user, news_has_been_added=True)
+        self.repository = get_notifications_repository()
+        self.redis = django_rq.get_connection(digests.QUEUE_NAME)
+        self.registry = ScheduledJobRegistry(queue=django_rq.get_queue(digests.QUEUE_NAME))
+        self.clean_up()
+        self.addCleanup(self.clean_up)
+
+    def clean_up(self):
+        for user in self.users:
+            self.repository.remove_all(user)
+        self.redis.delete(digests.PENDING_KEY, digests.SCHEDULED_KEY, digests.BUCKET_KEY)
+        for job_id in self.registry.get_job_ids():
+            self.registry.remove(job_id, delete_job=True)
+        mail.outbox = []
+
+    def test_notifications_are_sent_in_one_email(self):
+        user = self.users[0]
+        self.repository.save(user, news_notification('Pierwsze'))
+        self.repository.save(user, news_notification('Drugie', hours=1))
+        self.assertEqual(digests.send_digests([user.pk]), ([], 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, '[ZAPISY] Nowe powiadomienia (2)')
+        self.assertLess(mail.outbox[0].body.index('Pierwsze'), mail.outbox[0].body.index('Drugie'))
+        self.assertListEqual(self.repository.get_unsent_for_user(user), [])
+
+    def test_unwanted_notifications_are_not_sent(self):
+        user = self.users[0]
+        NotificationPreferencesStudent.objects.filter(user=user).update(news_has_been_added=False)
+        self.repository.save(user, news_notification('Pierwsze'))
+        digests.send_digests([user.pk])
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertListEqual(self.repository.get_unsent_for_user(user), [])
+
+    def test_refused_recipient_does_not_stop_the_rest(self):
+        refused = self.users[1]
+        for user in self.users:
+            self.repository.save(user, news_notification('Pierwsze'))
+        send = digests._send
+
+        def send_or_refuse(message):
+            if message.to == [refused.email]:
+                raise smtplib.SMTPRecipientsRefused({refused.email: (550, b'no')})
+            send(message)
+
+        with mock.patch.object(digests, '_send', side_effect=send_or_refuse), \
+                self.assertLogs(digests.LOGGER, 'ERROR'):
+            self.assertEqual(digests.send_digests([u.pk for u in self.users]), ([], 0))
+        self.assertCountEqual([m.to[0] for m in mail.outbox],
+                              [self.users[0].email, self.users[2].email])
+        self.assertEqual(len(self.repository.get_unsent_for_user(refused)), 1)
+        self.assertListEqual(self.repository.get_unsent_for_user(self.users[0]), [])
+
+    @test.override_settings(RUN_ASYNC=True)
+    def test_failed_job_puts_the_users_back(self):
+        user_ids = {u.pk for u in self.users}
+        self.redis.sadd(digests.PENDING_KEY, *user_ids)
+        with mock.patch.object(digests, 'send_digests', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                digests.send_pending_digests()
+        self.assertSetEqual({int(i) for i in self.redis.smembers(digests.PENDING_KEY)}, user_ids)
+        self.assertEqual(self.redis.exists(digests.SCHEDULED_KEY), 1)
+        self.assertEqual(self.registry.count, 1)
+
+    @test.override_settings(RUN_ASYNC=True)
+    def test_users_are_sent_digests_after_the_window(self):
+        for i, user in enumerate(self.users[:2]):
+            notify_user(user, news_notification('Pierwsze'))
+            notify_user(user, news_notification(f'Drugie{i}', hours=1))
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertSetEqual({int(i) for i in self.redis.smembers(digests.PENDING_KEY)},
+                            {u.pk for u in self.users[:2]})
+        self.assertEqual(self.registry.count, 1)
+
+        digests.send_pending_digests()
+        self.assertCountEqual([m.to[0] for m in mail.outbox], [u.email for u in self.users[:2]])
+        self.assertEqual(self.redis.scard(digests.PENDING_KEY), 0)
+        self.assertEqual(self.redis.exists(digests.SCHEDULED_KEY), 0)
+
+    @test.override_settings(RUN_ASYNC=True, EMAIL_RATE_LIMIT=0.5, EMAIL_RATE_BURST=2)
+    def test_rate_limit_postpones_the_rest(self):
+        for user in self.users:
+            self.repository.save(user, news_notification('Pierwsze'))
+        digests.schedule([u.pk for u in self.users])
+        self.redis.delete(digests.SCHEDULED_KEY)
+        for job_id in self.registry.get_job_ids():
+            self.registry.remove(job_id, delete_job=True)
+
+        digests.send_pending_digests()
+        self.assertEqual(len(mail.outbox), 2)
+        left_out = [int(i) for i in self.redis.smembers(digests.PENDING_KEY)]
+        self.assertEqual(len(left_out), 1)
+        self.assertEqual(self.redis.exists(digests.SCHEDULED_KEY), 1)
+        self.assertEqual(self.registry.count, 1)
+
+        remaining, wait = digests.send_digests(left_out)
+        self.assertListEqual(remaining, left_out)
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 2)
+
+
+@unittest.skipUnless(importlib.util.find_spec('aiosmtpd'), "aiosmtpd is not installed")
+@test.override_settings(RUN_ASYNC=False, EMAIL_RATE_LIMIT=0,
+                        EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                        EMAIL_HOST='127.0.0.1', EMAIL_PORT=8025, EMAIL_USE_TLS=False,
+                        EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='')
+class DigestsSMTPTestCase(test.TestCase):
+    """Sends the digests to a local SMTP server."""
+
+    def setUp(self):
+        from aiosmtpd.controller import Controller
+
+        class Handler:
+            def __init__(self):
+                self.messages = []
+                self.sessions = set()
+
+            async def handle_DATA(self, server, session, envelope):
+                self.messages.append(envelope)
+                self.sessions.add(id(session))
+                return '250 OK'
+
+        self.handler = Handler()
+        self.controller = Controller(self.handler, hostname='127.0.0.1', port=8025)
+        self.controller.start()
+        self.addCleanup(self.controller.stop)
+        digests.close_connection()
+        self.addCleanup(digests.close_connection)
+        self.users = [StudentFactory().user for _ in range(2)]
+        self.repository = get_notifications_repository()
+        for user in self.users:
+            NotificationPreferencesStudent.objects.create(user=user, news_has_been_added=True)
+            self.addCleanup(self.repository.remove_all, user)
+            self.repository.save(user, news_notification('Pierwsze'))
+            self.repository.save(user, news_notification('Drugie', hours=1))
+
+    def test_one_connection_for_all_digests(self):
+        digests.send_digests([u.pk for u in self.users])
+        self.assertCountEqual([e.rcpt_tos[0] for e in self.handler.messages],
+                              [u.email for u in self.users])
+        self.assertEqual(len(self.handler.sessions), 1)
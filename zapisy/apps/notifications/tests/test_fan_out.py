@@ -0,0 +1,75 @@
+from datetime import datetime
+from io import StringIO
+
+import django_rq
+import rq
+from django import test
+from django.core import mail
+from django.core.management import call_command
+
+from apps.notifications import digests
+from apps.notifications.api import notify_selected_users, notify_users_by_ids
+from apps.notifications.datatypes import Notification
+from apps.notifications.management.commands.notifications_fan_out_benchmark import BENCHMARK_QUEUE
+from apps.notifications.models import NotificationPreferencesStudent
+from apps.notifications.repositories import get_notifications_repository
+from apps.notifications.tasks import dispatch_notifications_batch_task
+from apps.notifications.templates import NotificationType
+from apps.users.tests.factories import EmployeeFactory, StudentFactory
+
+
+def news_notification(title: str) -> Notification:
+    return Notification(title, datetime.now(), NotificationType.NEWS_HAS_BEEN_ADDED,
+                        {'title': title, 'contents': ''}, '#')
+
+
+@test.override_settings(RUN_ASYNC=False)
+class FanOutTestCase(test.TestCase):
+    def setUp(self):
+        self.students = [StudentFactory() for _ in range(3)]
+        for student in self.students:
+            NotificationPreferencesStudent.objects.create(user=student.user,
+                                                          news_has_been_added=True)
+        # No preferences yet, these are created with the defaults.
+        self.teacher = EmployeeFactory()
+        self.repository = get_notifications_repository()
+        self.repository.flush()
+
+    def test_every_user_is_notified_once(self):
+        users = [s.user for s in self.students] + [self.teacher.user]
+        mail.outbox = []
+        notify_users_by_ids([u.pk for u in users] + [users[0].pk], news_notification('Ogłoszenie'))
+        self.assertCountEqual([m.to[0] for m in mail.outbox], [u.email for u in users])
+        for user in users:
+            self.assertListEqual(self.repository.get_unsent_for_user(user), [])
+            self.assertEqual(self.repository.get_count_for_user(user), 1)
+
+        mail.outbox = []
+        notify_selected_users(type(users[0]).objects.filter(pk=users[1].pk),
+                              news_notification('Drugie'))
+        self.assertListEqual([m.to[0] for m in mail.outbox], [users[1].email])
+
+    def test_batch_loads_users_at_once(self):
+        user_ids = [s.user.pk for s in self.students]
+        self.repository.save_many(user_ids, news_notification('Ogłoszenie'))
+        mail.outbox = []
+        with self.assertNumQueries(1):
+            dispatch_notifications_batch_task(user_ids)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_benchmark(self):
+        redis = django_rq.get_connection(digests.QUEUE_NAME)
+        queues = [django_rq.get_queue(digests.QUEUE_NAME), rq.Queue(BENCHMARK_QUEUE, connection=redis)]
+        pending_before = redis.smembers(digests.PENDING_KEY), redis.exists(digests.SCHEDULED_KEY)
+        jobs_before = [(q.count, q.scheduled_job_registry.count) for q in queues]
+        out = StringIO()
+        call_command('notifications_fan_out_benchmark', users=250, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('loop: '))
+        self.assertIn('250 users, 250 jobs', lines[0])
+        self.assertIn('250 users, 1 jobs', lines[1])
+        # Nothing is left behind and the real digests are not touched.
+        self.assertTupleEqual(
+            (redis.smembers(digests.PENDING_KEY), redis.exists(digests.SCHEDULED_KEY)), pending_before)
+        self.assertListEqual([(q.count, q.scheduled_job_registry.count) for q in queues],
+                             jobs_before)
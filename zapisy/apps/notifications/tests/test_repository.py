@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+from apps.notifications.datatypes import Notification
+from apps.notifications.repositories import get_notifications_repository
+from apps.notifications.templates import NotificationType
+
+ISSUED_ON = datetime(2031, 3, 3, 12, 0)
+
+
+def news_notification(id: str, issued_on: datetime = ISSUED_ON) -> Notification:
+    return Notification(id, issued_on, NotificationType.NEWS_HAS_BEEN_ADDED,
+                        {'title': id, 'contents': 'x' * 1000}, '#')
+
+
+class RedisNotificationsRepositoryTestCase(SimpleTestCase):
+    def setUp(self):
+        self.repo = get_notifications_repository()
+        # Made-up users, so that other tests' notifications are not touched.
+        self.users = [User(pk=pk) for pk in range(900001, 900004)]
+        self.clean_up()
+        self.addCleanup(self.clean_up)
+
+    def clean_up(self):
+        for user in self.users:
+            self.repo.remove_all(user)
+            self.repo.redis_client.delete(f'notifications:unsent#{user.pk}',
+                                          f'notifications:sent#{user.pk}')
+
+    def ids(self, notifications):
+        return [n.id for n in notifications]
+
+    def test_body_is_shared(self):
+        self.repo.save_many([u.pk for u in self.users], news_notification('repo-test-a'))
+        self.repo.save(self.users[0], news_notification('repo-test-a'))
+        client = self.repo.redis_client
+        self.assertEqual(int(client.get(self.repo._refs_key('repo-test-a'))), 3)
+
+        self.repo.mark_as_sent(self.users[0], news_notification('repo-test-a'))
+        self.assertListEqual(self.repo.get_unsent_for_user(self.users[0]), [])
+        self.assertListEqual(self.ids(self.repo.get_all_for_user(self.users[0])), ['repo-test-a'])
+
+        self.assertEqual(self.repo.remove_one_with_id(self.users[0], 'repo-test-a'), 1)
+        self.assertEqual(self.repo.remove_one_with_id(self.users[0], 'repo-test-a'), 0)
+        self.repo.remove_all(self.users[1])
+        self.assertListEqual(self.ids(self.repo.get_unsent_for_user(self.users[2])), ['repo-test-a'])
+        self.repo.remove_one_with_id(self.users[2], 'repo-test-a')
+        self.assertEqual(client.exists(self.repo._body_key('repo-test-a'), self.repo._refs_key('repo-test-a')), 0)
+
+    def test_nothing_is_kept_without_references(self):
+        client = self.repo.redis_client
+        body, refs = self.repo._body_key('repo-test-a'), self.repo._refs_key('repo-test-a')
+        self.repo.save_many([], news_notification('repo-test-a'))
+        self.assertEqual(client.exists(body, refs), 0)
+
+        self.repo.save(self.users[0], news_notification('repo-test-a'))
+        self.repo.save(self.users[0], news_notification('repo-test-a'))
+        self.assertEqual(int(client.get(refs)), 1)
+        self.repo.remove_all(self.users[0])
+        self.assertEqual(client.exists(body, refs), 0)
+
+    def test_ordered_by_issue_time(self):
+        user = self.users[0]
+        for i in (2, 0, 1):
+            self.repo.save(user, news_notification(f'repo-test-{i}', ISSUED_ON + timedelta(days=i)))
+        self.assertListEqual(self.ids(self.repo.get_unsent_for_user(user)),
+                             ['repo-test-0', 'repo-test-1', 'repo-test-2'])
+        self.assertEqual(self.repo.get_count_for_user(user), 3)
+
+        self.assertEqual(self.repo.remove_all_older_than(user, ISSUED_ON + timedelta(days=1)), 1)
+        self.assertListEqual(self.ids(self.repo.get_all_for_user(user)), ['repo-test-1', 'repo-test-2'])
+        self.assertIsNone(self.repo.redis_client.get(self.repo._body_key('repo-test-0')))
+
+    def test_newest_first_pages(self):
+        user = self.users[0]
+        for i in range(5):
+            self.repo.save(user, news_notification(f'repo-test-{i}', ISSUED_ON + timedelta(hours=i)))
+        self.repo.mark_as_sent(user, news_notification('repo-test-3', ISSUED_ON + timedelta(hours=3)))
+        self.repo.mark_as_sent(user, news_notification('repo-test-0', ISSUED_ON))
+        self.assertListEqual(self.ids(self.repo.get_newest_for_user(user, 2)),
+                             ['repo-test-4', 'repo-test-3'])
+        self.assertListEqual(self.ids(self.repo.get_newest_for_user(user, 2, offset=2)),
+                             ['repo-test-2', 'repo-test-1'])
+        self.assertListEqual(self.ids(self.repo.get_newest_for_user(user, 10, offset=4)),
+                             ['repo-test-0'])
+        self.assertListEqual(self.repo.get_newest_for_user(user, 0), [])
+
+    def test_removal_of_old_notifications_of_all_users(self):
+        # Other tests' notifications are never that old.
+        long_ago = datetime(1999, 1, 1)
+        self.repo.save_many([u.pk for u in self.users], news_notification('repo-test-old', long_ago))
+        self.repo.save(self.users[0], news_notification('repo-test-new'))
+        out = StringIO()
+        call_command('remove_old_notifications', days=365 * 20, stdout=out)
+        self.assertIn('Removed 3 notifications', out.getvalue())
+        self.assertListEqual(self.ids(self.repo.get_all_for_user(self.users[0])), ['repo-test-new'])
+        self.assertEqual(self.repo.get_count_for_user(self.users[1]), 0)
+        self.assertEqual(self.repo.redis_client.exists(self.repo._body_key('repo-test-old')), 0)
+
+    def test_migration_of_legacy_keys(self):
+        client = self.repo.redis_client
+        for user in self.users:
+            client.sadd(f'notifications:unsent#{user.pk}',
+                        self.repo.serializer.serialize(news_notification('repo-test-a')))
+        client.sadd('notifications:sent#900001', self.repo.serializer.serialize(
+            news_notification('repo-test-b', ISSUED_ON - timedelta(days=1))))
+
+        out = StringIO()
+        call_command('migrate_notifications_storage', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], 'Moved 4 notifications of 4 keys.')
+        self.assertTrue(lines[1].startswith('Before: '))
+        self.assertTrue(lines[2].startswith('After: '))
+        self.assertListEqual(self.ids(self.repo.get_all_for_user(self.users[0])), ['repo-test-a', 'repo-test-b'])
+        self.assertListEqual(self.ids(self.repo.get_unsent_for_user(self.users[2])), ['repo-test-a'])
+        self.assertEqual(int(client.get(self.repo._refs_key('repo-test-a'))), 3)
+
+        call_command('migrate_notifications_storage', stdout=StringIO())
+        self.assertEqual(int(client.get(self.repo._refs_key('repo-test-a'))), 3)
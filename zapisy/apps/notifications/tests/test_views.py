@@ -0,0 +1,46 @@
+import json
+from datetime import datetime, timedelta
+
+from django.test import TestCase
+from django.urls import reverse
+
+from apps.notifications.datatypes import Notification
+from apps.notifications.repositories import get_notifications_repository
+from apps.notifications.templates import NotificationType
+from apps.users.tests.factories import StudentFactory
+
+
+class NotificationsViewTestCase(TestCase):
+    def setUp(self):
+        self.user = StudentFactory().user
+        self.repo = get_notifications_repository()
+        self.addCleanup(self.repo.remove_all, self.user)
+        now = datetime.now()
+        for i in range(25):
+            self.repo.save(self.user, Notification(
+                f'view-test-{i}', now + timedelta(minutes=i), NotificationType.NEWS_HAS_BEEN_ADDED,
+                {'title': str(i), 'contents': ''}, '#'))
+        self.client.force_login(self.user)
+
+    def get(self, **params):
+        response = self.client.get(reverse('notifications:get_notifications'), params)
+        return json.loads(response.content)
+
+    def test_pages(self):
+        page = self.get()
+        self.assertEqual(page['count'], 25)
+        self.assertEqual(len(page['notifications']), 20)
+        self.assertEqual(page['notifications'][0]['id'], 'view-test-24')
+        page = self.get(offset=20, limit=10)
+        self.assertListEqual([n['id'] for n in page['notifications']],
+                             [f'view-test-{i}' for i in range(4, -1, -1)])
+        self.assertEqual(self.client.get(reverse('notifications:get_notifications'),
+                                         {'limit': 'x'}).status_code, 400)
+
+    def test_delete_one(self):
+        response = self.client.post(
+            reverse('notifications:delete-one-notification') + '?limit=30',
+            json.dumps({'uuid': 'view-test-24'}), content_type='application/json')
+        page = json.loads(response.content)
+        self.assertEqual(page['count'], 24)
+        self.assertEqual(len(page['notifications']), 24)
@@ -2,7 +2,7 @@ import json
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.http import HttpResponseBadRequest, JsonResponse
 from django.shortcuts import redirect
 from django.views.decorators.http import require_POST
 
@@ -11,13 +11,28 @@ from apps.notifications.models import NotificationPreferencesStudent, Notificati
 from apps.notifications.repositories import get_notifications_repository
 from apps.notifications.utils import render_description
 
+NOTIFICATIONS_PAGE_SIZE = 20
+NOTIFICATIONS_MAX_PAGE_SIZE = 100
+
 
 @login_required
 def get_notifications(request):
+    """Returns a page of the user's notifications, newest first.
+
+    The page is given by the `offset` and `limit` GET parameters. The response
+    also holds the number of all the user's notifications.
+    """
     def trunc(text):
         """Cuts text at 200 characters and adds dots if it was indeed longer."""
         return text[:200] + (text[200:] and '...')
 
+    try:
+        offset = max(int(request.GET.get('offset', 0)), 0)
+        limit = min(max(int(request.GET.get('limit', NOTIFICATIONS_PAGE_SIZE)), 0),
+                    NOTIFICATIONS_MAX_PAGE_SIZE)
+    except ValueError:
+        return HttpResponseBadRequest('Niepoprawny zakres powiadomień.')
+
     DATE_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
     repo = get_notifications_repository()
     notifications = [{
@@ -26,10 +41,12 @@ def get_notifications(request):
             render_description(notification.description_id, notification.description_args)),
         'issued_on': notification.issued_on.strftime(DATE_TIME_FORMAT),
         'target': notification.target,
-    } for notification in repo.get_all_for_user(request.user)]
-    notifications.sort(key=lambda x: x['issued_on'], reverse=True)
+    } for notification in repo.get_newest_for_user(request.user, limit, offset)]
 
-    return JsonResponse(notifications, safe=False)
+    return JsonResponse({
+        'count': repo.get_count_for_user(request.user),
+        'notifications': notifications,
+    })
 
 
 @require_POST
@@ -0,0 +1,153 @@
+"""Schedule terms of classes, materialized from the course terms.
+
+Every group has a class event in the schedule, with a term on every lecture day
+its course terms take place, in every classroom of the course term (or without
+a room if there is none). These terms are never edited by hand: they are
+brought in line with the course terms by `sync_groups`, which compares the
+terms the groups should have with the ones they have and applies the
+difference with one bulk insert and one set-based delete.
+
+Changing a course term syncs its group right away. Bulk changes (like an import
+of the whole schedule) should rather be made in a `deferred` block, so that
+every group is synced once at its end.
+"""
+import collections
+import contextlib
+import logging
+import threading
+from datetime import date, time
+from typing import DefaultDict, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from more_itertools import chunked
+
+from apps.enrollment.courses.models.group import Group
+from apps.enrollment.courses.models.semester import Semester
+from apps.enrollment.courses.models.term import Term as CourseTerm
+from apps.schedule.models.event import Event
+from apps.schedule.models.term import Term, invalidate_feeds
+
+LOGGER = logging.getLogger(__name__)
+
+SYNC_BATCH_SIZE = 200
+
+# Day, start, end and room of a term.
+TermKey = Tuple[date, time, time, Optional[int]]
+
+_deferred = threading.local()
+
+
+class SyncResult(NamedTuple):
+    created: int = 0
+    deleted: int = 0
+
+    def __add__(self, other: 'SyncResult') -> 'SyncResult':
+        return SyncResult(self.created + other.created, self.deleted + other.deleted)
+
+
+@contextlib.contextmanager
+def deferred():
+    """Postpones syncing the groups with changed course terms until the block ends.
+
+    If the block raises, nothing is synced. Nested blocks are synced with the
+    outermost one.
+    """
+    if getattr(_deferred, 'group_ids', None) is not None:
+        yield
+        return
+    _deferred.group_ids = set()
+    try:
+        yield
+        group_ids = _deferred.group_ids
+    finally:
+        _deferred.group_ids = None
+    sync_groups(group_ids)
+
+
+def group_changed(group_id: int):
+    """Syncs the group, or marks it to be synced at the end of a `deferred` block."""
+    pending = getattr(_deferred, 'group_ids', None)
+    if pending is not None:
+        pending.add(group_id)
+    else:
+        sync_groups([group_id])
+
+
+def _lecture_days(semester: Semester) -> Dict[str, List[date]]:
+    days = collections.defaultdict(list)
+    if semester.lectures_beginning is None or semester.lectures_ending is None:
+        return days
+    for day, day_of_week in semester.get_lecture_days().items():
+        days[day_of_week].append(day)
+    return days
+
+
+def _sync_batch(group_ids: List[int]) -> SyncResult:
+    groups = {
+        group.pk: group
+        for group in Group.objects.filter(pk__in=group_ids).select_related(
+            'course__semester', 'teacher__user')
+    }
+    desired: DefaultDict[int, Set[TermKey]] = collections.defaultdict(set)
+    days_by_semester: Dict[int, Dict[str, List[date]]] = {}
+    for group_id, day_of_week, start, end, room_id in CourseTerm.objects.filter(
+            group_id__in=groups).values_list(
+                'group_id', 'dayOfWeek', 'start_time', 'end_time', 'classrooms'):
+        semester = groups[group_id].course.semester
+        if semester.pk not in days_by_semester:
+            days_by_semester[semester.pk] = _lecture_days(semester)
+        for day in days_by_semester[semester.pk][day_of_week]:
+            desired[group_id].add((day, start, end, room_id))
+
+    events: Dict[int, Event] = {}
+    for event in Event.objects.filter(group_id__in=groups, type=Event.TYPE_CLASS).order_by('pk'):
+        events.setdefault(event.group_id, event)
+    existing: DefaultDict[int, DefaultDict[TermKey, List[int]]] = collections.defaultdict(
+        lambda: collections.defaultdict(list))
+    for pk, group_id, day, start, end, room_id in Term.objects.filter(
+            event__group_id__in=groups, event__type=Event.TYPE_CLASS).order_by().values_list(
+                'pk', 'event__group_id', 'day', 'start', 'end', 'room_id'):
+        existing[group_id][(day, start, end, room_id)].append(pk)
+
+    to_delete: List[int] = []
+    to_create: List[Term] = []
+    for group_id, group in groups.items():
+        for key, pks in existing[group_id].items():
+            # Duplicates are dropped along with the terms no longer needed.
+            to_delete.extend(pks[1:] if key in desired[group_id] else pks)
+        missing = sorted(desired[group_id] - existing[group_id].keys(), key=str)
+        if not missing:
+            continue
+        event = events.get(group_id)
+        if event is None:
+            if group.teacher is None:
+                LOGGER.warning('Group %s has no teacher to author its class event.', group_id)
+                continue
+            event = Event.objects.create(group=group, course=group.course,
+                                         title=group.course.get_short_name(),
+                                         type=Event.TYPE_CLASS, visible=True,
+                                         status=Event.STATUS_ACCEPTED, author=group.teacher.user)
+        to_create.extend(
+            Term(event=event, day=day, start=start, end=end, room_id=room_id)
+            for day, start, end, room_id in missing)
+    if to_delete:
+        Term.objects.filter(pk__in=to_delete).delete()
+    Term.objects.bulk_create(to_create)
+    # Unlike the deletions, the bulk insert sends no signals.
+    invalidate_feeds((term.room_id, term.day) for term in to_create)
+    return SyncResult(created=len(to_create), deleted=len(to_delete))
+
+
+def sync_groups(group_ids: Iterable[int]) -> SyncResult:
+    """Brings the terms of class events of the groups in line with their course terms.
+
+    Groups that no longer exist are skipped.
+    """
+    result = SyncResult()
+    for batch in chunked(sorted(set(group_ids)), SYNC_BATCH_SIZE):
+        result += _sync_batch(batch)
+    return result
+
+
+def rebuild(semester: Semester) -> SyncResult:
+    """Syncs the class events of all the groups in the semester."""
+    return sync_groups(Group.objects.filter(course__semester=semester).values_list('pk', flat=True))
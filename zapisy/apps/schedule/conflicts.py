@@ -0,0 +1,121 @@
+"""Report of overlapping terms of events, for the managers of the schedule.
+
+The terms of the range are read as plain rows sorted by room, day and start.
+A sweep over every (room, day) bucket keeps the terms still going on in a heap
+ordered by their ends: a term overlaps exactly the ones left in the heap after
+the finished ones are popped. This finds every overlapping pair, partial ones
+included, in O(n log n + number of pairs).
+
+Unlike the room occupancy, the report covers the terms of events of every
+status (and the terms of the same event), so that any double booking of a room
+shows up. The report is cached until the terms of any week in the range change.
+"""
+import collections
+import heapq
+from datetime import date, time, timedelta
+from typing import Dict, List, NamedTuple, Tuple
+
+from django.urls import NoReverseMatch, reverse
+
+from apps.common import tagged_cache
+from apps.schedule.models.term import Term, week_feed_tag
+
+CONFLICTS_CACHE_TIMEOUT = 60 * 60
+
+
+class ReportRoom(NamedTuple):
+    pk: int
+    number: str
+    url: str
+
+
+class ReportTerm(NamedTuple):
+    pk: int
+    start: time
+    end: time
+    title: str
+    author: str
+    url: str
+
+
+class Conflict(NamedTuple):
+    """A term together with the later terms overlapping it, ordered by start."""
+    head: ReportTerm
+    conflicted: List[ReportTerm]
+
+
+# Day, room, start, end, pk, event id, group id, title, author, room number, room slug.
+Row = Tuple[date, int, time, time, int, int, int, str, str, str, str]
+Report = Dict[date, Dict[ReportRoom, List[Conflict]]]
+
+
+def _report_term(row: Row) -> ReportTerm:
+    _, _, start, end, pk, event_id, group_id, title, author, _, _ = row
+    if group_id is not None:
+        url = reverse('group-view', args=[str(group_id)])
+    else:
+        url = reverse('events:show', args=[str(event_id)])
+    return ReportTerm(pk, start, end, title, author, url)
+
+
+def _room_url(slug: str) -> str:
+    # Like `Classroom.get_absolute_url`.
+    try:
+        return reverse('events:classroom', args=[slug])
+    except NoReverseMatch:
+        return reverse('events:classrooms')
+
+
+def _sweep(rows: List[Row]) -> List[Tuple[int, List[int]]]:
+    """Finds the overlapping terms of one room on one day.
+
+    The rows must be sorted by start. Returns the indices of the rows
+    overlapped by later rows, each with the indices of the latter.
+    """
+    ongoing: List[Tuple[time, int]] = []
+    conflicted: Dict[int, List[int]] = collections.defaultdict(list)
+    for i, row in enumerate(rows):
+        start, end = row[2], row[3]
+        while ongoing and ongoing[0][0] <= start:
+            heapq.heappop(ongoing)
+        for _, j in ongoing:
+            conflicted[j].append(i)
+        heapq.heappush(ongoing, (end, i))
+    return [(j, sorted(conflicted[j])) for j in sorted(conflicted)]
+
+
+def _build(first_day: date, last_day: date) -> Report:
+    rows = Term.objects.filter(
+        day__gte=first_day, day__lte=last_day, room__isnull=False).order_by(
+            'day', 'room_id', 'start', 'end', 'pk').values_list(
+                'day', 'room_id', 'start', 'end', 'pk', 'event_id', 'event__group_id',
+                'event__title', 'event__author__username', 'room__number', 'room__slug')
+    report: Report = collections.OrderedDict()
+    buckets = collections.OrderedDict()
+    for row in rows:
+        buckets.setdefault((row[0], row[1]), []).append(row)
+    for (day, room_id), bucket in buckets.items():
+        conflicts = _sweep(bucket)
+        if not conflicts:
+            continue
+        number, slug = bucket[0][9], bucket[0][10]
+        room = ReportRoom(room_id, number, _room_url(slug))
+        report.setdefault(day, collections.OrderedDict())[room] = [
+            Conflict(_report_term(bucket[head]), [_report_term(bucket[i]) for i in later])
+            for head, later in conflicts
+        ]
+    return report
+
+
+def conflict_report(first_day: date, last_day: date) -> Report:
+    """Lists the overlapping terms in the range of days (inclusive) by day and room.
+
+    Terms without a room are left out.
+    """
+    monday = first_day - timedelta(days=first_day.weekday())
+    tags = []
+    while monday <= last_day:
+        tags.append(week_feed_tag(monday))
+        monday += timedelta(weeks=1)
+    return tagged_cache.get_or_build('conflicts', f'{first_day}:{last_day}', tags,
+                                     lambda: _build(first_day, last_day), CONFLICTS_CACHE_TIMEOUT)
@@ -1,16 +1,26 @@
 import datetime
 import json
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from django import http
 from django.db.models import Q
 from django.http import Http404
 from django.views.generic.list import BaseListView
 
+from apps.common import tagged_cache
+from apps.common.reverse import url_template
+
 
 class FullCalendarAdapter(object):
+    # Fields of the term and its event fetched for `row_as_json`.
+    row_fields = ('event_id', 'day', 'start', 'end', 'event__title', 'event__description',
+                  'event__group_id')
+
     def __init__(self, queryset, request):
         self.queryset = queryset
         self.request = request
+        self._group_url = url_template('group-view')
+        self._event_url = url_template('events:show')
 
     def collection_as_json(self):
         result = []
@@ -160,16 +170,56 @@ class FullCalendarAdapter(object):
         """Sets an event's text color just like the calendar-wide eventTextColor option."""
         return None
 
+    def row_as_json(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        """Serializes a term like `item_as_json`, but from a `values()` row.
+
+        The row holds the `row_fields`. Adapters overriding the getters should
+        override `get_row_*` methods in the same way.
+        """
+        result = {
+            'id': row['event_id'],
+            'title': self.get_row_title(row),
+            'allDay': False,
+            'start': datetime.datetime.combine(row['day'], row['start']).isoformat(),
+            'end': datetime.datetime.combine(row['day'], row['end']).isoformat(),
+            'description': row['event__description'],
+            'url': self.get_row_url(row),
+            'editable': False,
+            'backgroundColor': self.get_row_backgroundColor(row),
+            'borderColor': self.get_row_borderColor(row),
+        }
+        return {key: value for key, value in result.items() if value is not None}
+
+    def get_row_title(self, row):
+        return row['event__title']
+
+    def get_row_url(self, row):
+        if row['event__group_id']:
+            return self._group_url(row['event__group_id'])
+        return self._event_url(row['event_id'])
+
+    def get_row_backgroundColor(self, row):
+        return None
+
+    def get_row_borderColor(self, row):
+        return None
+
 
 class FullCalendarView(BaseListView):
 
     adapter = FullCalendarAdapter
 
-    def get_queryset(self):
-        if 'start' not in self.request.GET or 'end' not in self.request.GET:
+    def get_range(self) -> Tuple[datetime.date, datetime.date]:
+        """Returns the first and the last day requested by the calendar."""
+        try:
+            start = datetime.datetime.strptime(self.request.GET['start'], '%Y-%m-%dT%H:%M:%S.%fZ')
+            end = datetime.datetime.strptime(self.request.GET['end'], '%Y-%m-%dT%H:%M:%S.%fZ')
+        except (KeyError, ValueError):
             raise Http404
-        start = datetime.datetime.strptime(self.request.GET.get('start'), '%Y-%m-%dT%H:%M:%S.%fZ')
-        end = datetime.datetime.strptime(self.request.GET.get('end'), '%Y-%m-%dT%H:%M:%S.%fZ')
+        return start.date(), end.date()
+
+    def get_queryset(self):
+        start, end = self.get_range()
 
         if not self.queryset:
             self.queryset = super(FullCalendarView, self).get_queryset()
@@ -186,3 +236,54 @@ class FullCalendarView(BaseListView):
 
     def convert_to_json(self, queryset):
         return self.adapter(queryset, self.request).collection_as_json()
+
+
+class WeeklyCachedFullCalendarView(FullCalendarView):
+    """Serves the terms from `values()` rows, cached by weeks and streamed.
+
+    The terms of every week (starting on Monday) of the requested range are
+    serialized once with `adapter.row_as_json` and cached with the tags given
+    by `get_week_tags`. Whoever changes the terms must invalidate the tags. The
+    cache is separate for users who may manage events, as they see more.
+    """
+    cache_name: Optional[str] = None
+    cache_timeout = 60 * 60
+
+    def get_base_queryset(self):
+        """Returns the terms of the feed, not limited to any range."""
+        raise NotImplementedError
+
+    def get_week_tags(self, monday: datetime.date) -> List[str]:
+        raise NotImplementedError
+
+    def get_week_key(self, monday: datetime.date) -> str:
+        return f'{monday}:{int(self.can_manage)}'
+
+    def serialize_week(self, monday: datetime.date) -> List[Tuple[datetime.date, str]]:
+        """Returns the days and JSON-encoded terms of the week, in order."""
+        adapter = self.adapter(None, self.request)
+        rows = self.get_base_queryset().filter(
+            day__gte=monday, day__lte=monday + datetime.timedelta(days=6)).order_by(
+                'day', 'start', 'end').values(*adapter.row_fields)
+        return [(row['day'], json.dumps(adapter.row_as_json(row))) for row in rows]
+
+    def stream(self, first: datetime.date, last: datetime.date) -> Iterator[str]:
+        yield '['
+        separator = ''
+        monday = first - datetime.timedelta(days=first.weekday())
+        while monday <= last:
+            week = tagged_cache.get_or_build(
+                self.cache_name, self.get_week_key(monday), self.get_week_tags(monday),
+                lambda: self.serialize_week(monday), self.cache_timeout)
+            for day, item in week:
+                if first <= day <= last:
+                    yield separator + item
+                    separator = ', '
+            monday += datetime.timedelta(days=7)
+        yield ']'
+
+    def get(self, request, *args, **kwargs):
+        first, last = self.get_range()
+        self.can_manage = request.user.has_perm('schedule.manage_events')
+        return http.StreamingHttpResponse(self.stream(first, last),
+                                          content_type='application/json')
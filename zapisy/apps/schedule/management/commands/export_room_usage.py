@@ -0,0 +1,43 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.enrollment.courses.models.classroom import Classroom
+from apps.enrollment.courses.models.semester import Semester
+from apps.schedule.room_usage import usage_report
+
+
+class Command(BaseCommand):
+    help = ("Exports the weekly usage of all the reservable rooms in the semester (course terms "
+            "and special reservations) as CSV, one row per room and term. The snapshots of the "
+            "rooms are left in the cache for the door charts.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--semester", type=int, default=0,
+                            help="id of the semester, the upcoming one if not provided")
+        parser.add_argument("--output", help="file to write to, the standard output by default")
+
+    def handle(self, *args, **kwargs):
+        if kwargs["semester"]:
+            semester = Semester.objects.filter(pk=kwargs["semester"]).first()
+        else:
+            semester = Semester.get_upcoming_semester()
+        if semester is None:
+            raise CommandError("No such semester.")
+        report = usage_report(
+            Classroom.objects.filter(can_reserve=True).values_list('pk', flat=True), semester)
+        if kwargs["output"]:
+            with open(kwargs["output"], "w", newline="") as output:
+                self.write_report(output, report)
+        else:
+            self.write_report(self.stdout, report)
+
+    @staticmethod
+    def write_report(output, report):
+        writer = csv.writer(output)
+        writer.writerow(["room", "weekday", "begin", "end", "title", "type", "author"])
+        for number, entries in report:
+            for entry in entries:
+                writer.writerow([number, entry.weekday, entry.begin.strftime("%H:%M"),
+                                 entry.end.strftime("%H:%M"), entry.title, entry.type,
+                                 entry.author])
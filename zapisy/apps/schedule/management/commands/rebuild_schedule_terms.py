@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from apps.enrollment.courses.models.semester import Semester
+from apps.schedule import class_terms
+
+
+class Command(BaseCommand):
+    help = ("Brings the terms of class events in the schedule in line with the course terms of "
+            "all the groups in the semester. Missing terms are created and terms no longer "
+            "matching any course term are deleted.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--semester", type=int, default=0,
+                            help="id of the semester, the upcoming one if not provided")
+
+    @transaction.atomic
+    def handle(self, *args, **kwargs):
+        if kwargs["semester"]:
+            semester = Semester.objects.filter(pk=kwargs["semester"]).first()
+        else:
+            semester = Semester.get_upcoming_semester()
+        if semester is None:
+            raise CommandError("No such semester.")
+        result = class_terms.rebuild(semester)
+        self.stdout.write(f"{semester}: created {result.created} terms, "
+                          f"deleted {result.deleted} terms.")
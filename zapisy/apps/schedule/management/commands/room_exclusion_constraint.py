@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection, transaction
+
+CONSTRAINT_NAME = 'schedule_term_room_no_overlap'
+
+INSTALL_SQL = f"""
+ALTER TABLE schedule_term ADD CONSTRAINT {CONSTRAINT_NAME} EXCLUDE USING gist (
+    int4range(room_id, room_id, '[]') WITH &&,
+    tsrange(day + start, day + "end") WITH &&
+) WHERE (room_id IS NOT NULL AND NOT ignore_conflicts)
+"""
+
+DROP_SQL = f"ALTER TABLE schedule_term DROP CONSTRAINT IF EXISTS {CONSTRAINT_NAME}"
+
+
+class Command(BaseCommand):
+    help = ("Installs (or drops) a Postgres exclusion constraint forbidding overlapping terms in "
+            "a room, as a backstop for the conflict checks in the application. Terms marked to "
+            "ignore conflicts are exempt. The constraint applies to terms of all events, also "
+            "those pending moderation, so it only suits setups where no room conflicts are "
+            "tolerated. It cannot be installed while conflicting terms exist.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["install", "drop"])
+
+    def handle(self, *args, **kwargs):
+        if connection.vendor != 'postgresql':
+            raise CommandError("The constraint requires Postgres.")
+        with connection.cursor() as cursor:
+            if kwargs["action"] == "drop":
+                cursor.execute(DROP_SQL)
+                self.stdout.write(f"Dropped {CONSTRAINT_NAME}.")
+                return
+            try:
+                with transaction.atomic():
+                    cursor.execute(DROP_SQL)
+                    cursor.execute(INSTALL_SQL)
+            except IntegrityError as e:
+                raise CommandError(f"Some terms overlap, resolve the conflicts first.\n{e}")
+        self.stdout.write(f"Installed {CONSTRAINT_NAME}.")
@@ -130,10 +130,9 @@ class Event(models.Model):
 
     def get_conflicted(self) -> List['Event']:
         """Returns all conflicting events."""
-        terms = self.term_set.all()
+        from apps.schedule.room_occupancy import conflicting_terms
         event_conflicts = set()
-        for term in terms:
-            term_conflicts = term.get_conflicted()
+        for term_conflicts in conflicting_terms(self.term_set.all()).values():
             for conflict in term_conflicts:
                 event_conflicts.add(conflict.event)
         return list(event_conflicts)
@@ -2,8 +2,9 @@ from datetime import date, datetime
 
 from django.core.validators import ValidationError
 from django.db import models
+from django.dispatch import receiver
 
-from apps.common import days_of_week
+from apps.common import days_of_week, tagged_cache
 from apps.enrollment.courses.models.classroom import Classroom
 from apps.enrollment.courses.models.semester import Semester
 from apps.enrollment.courses.models.term import Term as CourseTerm
@@ -103,37 +104,42 @@ class SpecialReservation(models.Model):
         return query
 
     def validate_against_all_terms(self):
+        """Checks the reservation against classes and events in the classroom.
 
-        course_terms = CourseTerm.get_terms_for_semester(semester=self.semester,
-                                                         day=self.dayOfWeek,
-                                                         classrooms=[self.classroom],
-                                                         start_time=self.start_time,
-                                                         end_time=self.end_time)
-
-        from .term import Term
-        candidate_days = self.semester.get_all_days_of_week(
-            self.dayOfWeek, start_date=max(
-                datetime.now().date(), self.semester.lectures_beginning))
-
-        terms = Term.get_terms_for_dates(dates=candidate_days,
-                                         classroom=self.classroom,
-                                         start_time=self.start_time,
-                                         end_time=self.end_time)
+        Classes are checked on every lecture day the reservation falls on, while
+        events only from today on (earlier days are not reserved).
+        """
+        from apps.schedule.room_occupancy import (COURSE_TERM, EVENT_TERM, RoomOccupancy,
+                                                  lecture_days)
+        semester = self.semester
+        days = lecture_days(semester.lectures_beginning, semester.lectures_ending).get(
+            semester, {}).get(self.dayOfWeek, [])
+        occupancy = RoomOccupancy.build(semester.lectures_beginning, semester.lectures_ending,
+                                        rooms=[self.classroom_id],
+                                        kinds={COURSE_TERM, EVENT_TERM})
+        today = datetime.now().date()
+        course_terms = {}
+        terms = []
+        for day in days:
+            for occupation in occupancy.overlapping(self.classroom_id, day, self.start_time,
+                                                    self.end_time):
+                if occupation.kind == COURSE_TERM:
+                    course_terms.setdefault(occupation.source.pk, occupation.source)
+                elif (day >= today and occupation.booking != ('reservation', self.pk) and
+                      occupation.source.event.type != Event.TYPE_CLASS):
+                    terms.append(occupation.source)
         msg_list = []
 
-        if course_terms:
-            for t in course_terms:
-                msg_list.append(
-                    'W tym samym czasie w tej sali odbywają się zajęcia: ' +
-                    t.group.course.name +
-                    ' ' +
-                    str(t))
+        for t in course_terms.values():
+            msg_list.append(
+                'W tym samym czasie w tej sali odbywają się zajęcia: ' +
+                t.group.course.name +
+                ' ' +
+                str(t))
 
-        if terms:
-            for t in terms:
-                if t.event.reservation != self and t.event.type != Event.TYPE_CLASS:
-                    msg_list.append(
-                        'W tym samym czasie ta sala jest zarezerwowana (wydarzenie): ' + str(t.event) + ' ' + str(t))
+        for t in terms:
+            msg_list.append(
+                'W tym samym czasie ta sala jest zarezerwowana (wydarzenie): ' + str(t.event) + ' ' + str(t))
 
         if len(msg_list) > 0:
             raise ValidationError(message={'__all__': msg_list}, code='overlap')
@@ -208,3 +214,23 @@ class SpecialReservation(models.Model):
     def __str__(self):
         return '%s: %s - %s %s - %s' % (self.semester, self.title, self.get_dayOfWeek_display(),
                                         self.start_time, self.end_time)
+
+
+def cache_tag(room_id: int) -> str:
+    """Tag of cached values depending on the special reservations in the room."""
+    return tagged_cache.tag('reservations', 'room', room_id)
+
+
+@receiver(models.signals.pre_save, sender=SpecialReservation)
+def reservation_moving(sender, instance: SpecialReservation, **kwargs):
+    """Remembers the classroom of the reservation before it is saved."""
+    if instance.pk:
+        instance._previous_classroom_id = SpecialReservation.objects.filter(
+            pk=instance.pk).values_list('classroom_id', flat=True).first()
+
+
+@receiver(models.signals.post_save, sender=SpecialReservation)
+@receiver(models.signals.post_delete, sender=SpecialReservation)
+def reservation_changed(sender, instance: SpecialReservation, **kwargs):
+    room_ids = {instance.classroom_id, getattr(instance, '_previous_classroom_id', None)}
+    tagged_cache.invalidate(*(cache_tag(room_id) for room_id in room_ids if room_id is not None))
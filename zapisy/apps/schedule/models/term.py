@@ -1,13 +1,12 @@
-import collections
 import datetime
+from typing import Iterable, List, Optional, Tuple
 
 from django.core.exceptions import ValidationError
 from django.db import models
-from django.db.models import Q
 from django.dispatch import receiver
 
+from apps.common import tagged_cache
 from apps.enrollment.courses.models.classroom import Classroom
-from apps.enrollment.courses.models.semester import Semester
 from apps.enrollment.courses.models.term import Term as CourseTerm
 
 from .event import Event
@@ -31,44 +30,72 @@ class Term(models.Model):
     place = models.CharField(max_length=255, null=True, blank=True, verbose_name='Miejsce')
     ignore_conflicts = models.BooleanField(default=False)
 
-    def validate_against_event_terms(self):
-        assert self.room is not None
-        terms = Term.get_terms_for_dates(dates=[self.day],
-                                         classroom=self.room,
-                                         start_time=self.start,
-                                         end_time=self.end)
+    def _room_occupancy(self):
+        from apps.schedule.room_occupancy import RoomOccupancy
+        return RoomOccupancy.build(self.day, self.day, rooms=[self.room_id])
+
+    def _own_occupations(self):
+        """Keys of the term and of its booking, if it is a group or a reservation.
 
-        if self.pk:
-            terms = terms.exclude(pk=self.pk)
+        The occupations of its own booking, like the course term behind a class
+        term, do not conflict with the term. Terms of an ordinary event still
+        must not overlap one another.
+        """
+        from apps.schedule.room_occupancy import EVENT_TERM, Occupation
+        own = {(EVENT_TERM, self.pk)}
+        if self.event.group_id is not None or self.event.reservation_id is not None:
+            own.add(Occupation.from_term(self).booking)
+        return own
 
-        if terms:
+    def validate_against_event_terms(self, occupancy=None):
+        """Checks the term against other events and special reservations.
+
+        :param occupancy: apps.schedule.room_occupancy.RoomOccupancy of the
+            room on the day, built if not given
+        """
+        from apps.schedule.room_occupancy import EVENT_TERM, RESERVATION
+        assert self.room is not None
+        if occupancy is None:
+            occupancy = self._room_occupancy()
+        overlapping = occupancy.overlapping(self.room_id, self.day, self.start, self.end,
+                                            kinds={EVENT_TERM, RESERVATION},
+                                            exclude=self._own_occupations())
+        if overlapping:
+            source = overlapping[0].source
+            if overlapping[0].kind == EVENT_TERM:
+                description = str(source.event) + ' (wydarzenie)'
+            else:
+                description = source.title + ' (rezerwacja stała)'
             raise ValidationError(
                 message={'__all__': ['W tym samym czasie ta sala jest zarezerwowana: ' +
-                                     str(terms[0].event) + ' (wydarzenie)']},
+                                     description]},
                 code='overlap')
 
-    def validate_against_course_terms(self):
+    def validate_against_course_terms(self, occupancy=None):
+        """Checks the term against the classes held in the room.
+
+        :param occupancy: apps.schedule.room_occupancy.RoomOccupancy of the
+            room on the day, built if not given
+        """
+        from apps.schedule.room_occupancy import COURSE_TERM
         assert self.room is not None
-        semester = Semester.get_semester(self.day)
-        if not semester:
-            return
-        if semester.lectures_beginning <= self.day and self.day <= semester.lectures_ending:
-
-            course_terms = CourseTerm.get_terms_for_semester(semester=semester,
-                                                             day=self.day,
-                                                             classrooms=[self.room],
-                                                             start_time=self.start,
-                                                             end_time=self.end)
-            if course_terms:
-                raise ValidationError(
-                    message={
-                        '__all__': [
-                            'W tym samym czasie w tej sali odbywają się zajęcia: ' +
-                            course_terms[0].group.course.name +
-                            ' ' +
-                            str(
-                                course_terms[0])]},
-                    code='overlap')
+        if occupancy is None:
+            occupancy = self._room_occupancy()
+        course_terms = [
+            o.source for o in occupancy.overlapping(
+                self.room_id, self.day, self.start, self.end, kinds={COURSE_TERM},
+                exclude=self._own_occupations())
+        ]
+        if course_terms:
+            raise ValidationError(
+                message={
+                    '__all__': [
+                        'W tym samym czasie w tej sali odbywają się zajęcia: ' +
+                        course_terms[0].group.course.name +
+                        ' ' +
+                        str(
+                            course_terms[0])]},
+                code='overlap')
 
     def clean(self):
         """Overloaded method from models.Model."""
@@ -92,8 +119,9 @@ class Term(models.Model):
                 )
 
             if self.day and self.start and self.end and not self.ignore_conflicts:
-                self.validate_against_event_terms()
-                self.validate_against_course_terms()
+                occupancy = self._room_occupancy()
+                self.validate_against_event_terms(occupancy)
+                self.validate_against_course_terms(occupancy)
 
         super(Term, self).clean()
 
@@ -105,20 +133,9 @@ class Term(models.Model):
         verbose_name_plural = 'terminy'
 
     def get_conflicted(self):
-        if not self.room:
-            return Term.objects.none()
-
-        # X < B AND A < Y
-
-        terms = Term.objects.filter(Q(room=self.room),
-                                    Q(day=self.day),
-                                    Q(event__status=Event.STATUS_ACCEPTED),
-                                    Q(start__lt=self.end),
-                                    Q(end__gt=self.start)) .select_related('event')
-
-        if self.pk:
-            terms = terms.exclude(pk=self.pk)
-        return terms
+        """Returns the terms of accepted events overlapping this one."""
+        from apps.schedule.room_occupancy import conflicting_terms
+        return conflicting_terms([self])[self.pk]
 
     def pretty_print(self):
         """Verbose html info about term.
@@ -169,100 +186,102 @@ class Term(models.Model):
 
     @classmethod
     def prepare_conflict_dict(cls, start_time, end_time):
-        """Returns a report of conflicting events.
+        """Returns a report of overlapping terms in the range of days.
 
-        Head is top term for which next terms (if conflicted in terms of time)
-        will be considered as conflicts. current_result stores conflicts for
-        given current head
-
-        @return OrderedDict[day][room][head|conflicted]
+        @return OrderedDict[day][room] -> list of conflicts (head, conflicted)
         """
-        candidates = Term.objects.filter(
-            day__gte=start_time,
-            day__lte=end_time).order_by(
-            'day',
-            'room',
-            'start',
-            'end').select_related(
-            'room',
-            'event')
-        conflicts = collections.OrderedDict()
-        current_result = dict()
-        head = None
-        for term in candidates:
-            if (head is not None and (term.day != head.day or term.room != head.room)) or head is None:
-                if current_result and current_result['conflicted']:
-                    if head.day not in conflicts:
-                        conflicts[head.day] = dict()
-                    if head.room not in conflicts[head.day]:
-                        conflicts[head.day][head.room] = dict()
-                        conflicts[head.day][head.room][head.pk] = dict()
-                    conflicts[head.day][head.room][head.pk] = current_result
-                head = term
-                current_result = {}
-                current_result['head'] = head
-                current_result['conflicted'] = list()
-            elif head.end >= term.end and term.start >= head.start:  # conflict
-                current_result['conflicted'].append(term)
-        return conflicts
+        from apps.schedule.conflicts import conflict_report
+        return conflict_report(start_time, end_time)
 
     def __str__(self):
         return '{0:s}: {1:s} - {2:s}'.format(self.day, self.start, self.end)
 
 
-@receiver(models.signals.pre_delete, sender=CourseTerm)
 @receiver(models.signals.pre_save, sender=CourseTerm)
-@receiver(models.signals.m2m_changed, sender=CourseTerm.classrooms.through)
-def delete_course_terms(**kwargs):
-    """Deletes the Term when a corresponding CourseTerm is deleted or modified.
+def course_term_moving(sender, instance: CourseTerm, **kwargs):
+    """Remembers the previous group of a course term moved to another group."""
+    if instance.pk:
+        instance._previous_group_id = CourseTerm.objects.filter(pk=instance.pk).values_list(
+            'group_id', flat=True).first()
+
+
+@receiver(models.signals.post_save, sender=CourseTerm)
+@receiver(models.signals.post_delete, sender=CourseTerm)
+def course_term_changed(sender, instance: CourseTerm, **kwargs):
+    """Syncs the terms of the class event with the course terms of the group.
 
-    This will be triggered before the modifications are saved, and the function
-    below will be triggered on the modified instance.
+    See `apps.schedule.class_terms`.
     """
-    instance: CourseTerm = kwargs['instance']
-    if not kwargs.get('action', 'pre_save').startswith('pre_'):
-        # We are in a post_save action of m2m_changed signal receiver.
-        # The function below is handling that.
-        return
-    if not instance.pk:
-        return
-    instance = CourseTerm.objects.get(pk=instance.pk)
-    dates = instance.group.course.semester.get_all_days_of_week(instance.dayOfWeek)
-    matching_terms = Term.objects.filter(event__group=instance.group,
-                                         day__in=dates,
-                                         start=instance.start_time,
-                                         end=instance.end_time)
-    matching_terms.delete()
+    from apps.schedule import class_terms
+    previous_group_id = getattr(instance, '_previous_group_id', None)
+    if previous_group_id is not None and previous_group_id != instance.group_id:
+        class_terms.group_changed(previous_group_id)
+    class_terms.group_changed(instance.group_id)
 
 
-@receiver(models.signals.post_save, sender=CourseTerm)
 @receiver(models.signals.m2m_changed, sender=CourseTerm.classrooms.through)
-def create_course_terms(**kwargs):
-    """Creates matching Terms when a new CourseTerm is created."""
-    if not kwargs.get('action', 'post_save').startswith('post_'):
-        # We are in a post_save action of m2m_changed signal receiver.
-        # The function above is handling that.
+def course_term_classrooms_changed(sender, instance, action: str, reverse: bool, pk_set,
+                                   **kwargs):
+    from apps.schedule import class_terms
+    if action == 'pre_clear' and reverse:
+        # The cleared terms of the classroom are only known beforehand.
+        instance._cleared_group_ids = set(CourseTerm.objects.filter(
+            classrooms=instance).values_list('group_id', flat=True))
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        group_ids = {instance.group_id}
+    elif action == 'post_clear':
+        group_ids = getattr(instance, '_cleared_group_ids', set())
+    else:
+        group_ids = set(CourseTerm.objects.filter(pk__in=pk_set).values_list('group_id', flat=True))
+    for group_id in group_ids:
+        class_terms.group_changed(group_id)
+
+
+def week_feed_tag(monday: datetime.date) -> str:
+    """Tag of the cached calendar feeds of the week."""
+    return tagged_cache.tag('schedule', 'week', monday)
+
+
+def room_feed_tag(room_id: int, monday: datetime.date) -> str:
+    """Tag of the cached calendar feed of the room in the week."""
+    return tagged_cache.tag('schedule', 'room', monday, room_id)
+
+
+def feed_tags(room_id: Optional[int], day: datetime.date) -> List[str]:
+    """Tags of the cached calendar feeds showing a term in the room on the day."""
+    monday = day - datetime.timedelta(days=day.weekday())
+    tags = [week_feed_tag(monday)]
+    if room_id is not None:
+        tags.append(room_feed_tag(room_id, monday))
+    return tags
+
+
+def invalidate_feeds(places: Iterable[Tuple[Optional[int], datetime.date]]):
+    """Invalidates the calendar feeds showing terms in the (room, day) places."""
+    tagged_cache.invalidate(*(t for room_id, day in set(places) for t in feed_tags(room_id, day)))
+
+
+@receiver(models.signals.pre_save, sender=Term)
+def term_moving(sender, instance: Term, **kwargs):
+    """Remembers where the term was before it is saved."""
+    if instance.pk:
+        instance._previous_place = Term.objects.filter(pk=instance.pk).values_list(
+            'room_id', 'day').first()
+
+
+@receiver(models.signals.post_save, sender=Term)
+@receiver(models.signals.post_delete, sender=Term)
+def term_changed(sender, instance: Term, **kwargs):
+    places = [(instance.room_id, instance.day)]
+    if getattr(instance, '_previous_place', None):
+        places.append(instance._previous_place)
+    invalidate_feeds(places)
+
+
+@receiver(models.signals.post_save, sender=Event)
+def event_changed(sender, instance: Event, created: bool, **kwargs):
+    if created:
         return
-    instance: CourseTerm = kwargs['instance']
-    dates = instance.group.course.semester.get_all_days_of_week(instance.dayOfWeek)
-    event, _ = Event.objects.get_or_create(group=instance.group,
-                                           course=instance.group.course,
-                                           title=instance.group.course.get_short_name(),
-                                           type=Event.TYPE_CLASS,
-                                           visible=True,
-                                           status=Event.STATUS_ACCEPTED,
-                                           author=instance.group.teacher.user)
-    for day in dates:
-        rooms = instance.classrooms.all()
-        for room in rooms:
-            Term.objects.create(event=event,
-                                day=day,
-                                start=instance.start_time,
-                                end=instance.end_time,
-                                room=room)
-        if not rooms:
-            Term.objects.create(event=event,
-                                day=day,
-                                start=instance.start_time,
-                                end=instance.end_time,
-                                room=None)
+    invalidate_feeds(instance.term_set.values_list('room_id', 'day'))
@@ -0,0 +1,339 @@
+"""Occupancy of rooms, indexed by room and day.
+
+A room is occupied by:
+
+  * terms of accepted events,
+  * terms of course groups, on every lecture day of the semester with their day
+    of week (free days are skipped and changed days follow the day of week
+    they are changed to),
+  * special reservations, on the same days as course terms.
+
+Terms of class events and of reservation events mirror the two latter. Every
+occupation therefore carries a `booking`: occupations with the same booking
+(a group, a reservation or an event) never conflict with each other.
+
+`RoomOccupancy.build` loads the occupations of a range of days with a constant
+number of queries. `busy_periods` serves the merged occupied periods of all
+the rooms, cached per day. The occupations of a room on a day are kept sorted by their
+start together with the running maximum of their ends, so checking whether the
+room is free takes a bisection and listing the overlapping occupations only
+visits the ones that may overlap. The index may be updated in place with `add`
+and `discard`.
+"""
+import bisect
+import collections
+from datetime import date, time, timedelta
+from typing import (Any, Collection, DefaultDict, Dict, Iterable, Iterator, List, NamedTuple,
+                    Optional, Set, Tuple)
+
+from apps.common import tagged_cache
+from apps.enrollment.courses.models.semester import CALENDAR_TAG, Semester
+from apps.enrollment.courses.models.term import Term as CourseTerm
+from apps.enrollment.courses.models.term import cache_tag as course_terms_tag
+from apps.schedule.models.event import Event
+from apps.schedule.models.specialreservation import SpecialReservation
+from apps.schedule.models.term import Term, week_feed_tag
+
+EVENT_TERM = 'term'
+COURSE_TERM = 'course_term'
+RESERVATION = 'reservation'
+ALL_KINDS = frozenset({EVENT_TERM, COURSE_TERM, RESERVATION})
+
+BUSY_PERIODS_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Identifies a source (kind, pk) or a booking (kind, pk) of occupations.
+Key = Tuple[str, int]
+Period = Tuple[time, time]
+
+
+class Occupation(NamedTuple):
+    """A room being occupied on a day from `start` to `end`."""
+    room_id: int
+    day: date
+    start: time
+    end: time
+    kind: str
+    # The Term, CourseTerm or SpecialReservation occupying the room.
+    source: Any
+    booking: Key
+
+    @property
+    def key(self) -> Key:
+        return self.kind, self.source.pk
+
+    def overlaps(self, other: 'Occupation') -> bool:
+        return self.start < other.end and other.start < self.end
+
+    @classmethod
+    def from_term(cls, term: Term) -> 'Occupation':
+        """The term must have a room. Its event should be fetched along."""
+        event = term.event
+        if event.group_id is not None:
+            booking = ('group', event.group_id)
+        elif event.reservation_id is not None:
+            booking = (RESERVATION, event.reservation_id)
+        else:
+            booking = ('event', event.pk)
+        return cls(term.room_id, term.day, term.start, term.end, EVENT_TERM, term, booking)
+
+
+class _DayIndex:
+    """Occupations of a room on a single day.
+
+    They are sorted by start and `max_ends[i]` is the latest end among the
+    first i + 1 occupations.
+    """
+
+    def __init__(self):
+        self.occupations: List[Occupation] = []
+        self.starts: List[time] = []
+        self.max_ends: List[time] = []
+
+    def _update_max_ends(self, i: int):
+        del self.max_ends[i:]
+        for occupation in self.occupations[i:]:
+            self.max_ends.append(max(self.max_ends[-1], occupation.end) if self.max_ends
+                                 else occupation.end)
+
+    def add(self, occupation: Occupation):
+        i = bisect.bisect_right(self.starts, occupation.start)
+        self.occupations.insert(i, occupation)
+        self.starts.insert(i, occupation.start)
+        self._update_max_ends(i)
+
+    def discard(self, key: Key):
+        i = 0
+        while i < len(self.occupations):
+            if self.occupations[i].key == key:
+                del self.occupations[i]
+                del self.starts[i]
+                self._update_max_ends(i)
+            else:
+                i += 1
+
+    def is_free(self, start: time, end: time) -> bool:
+        i = bisect.bisect_left(self.starts, end)
+        return i == 0 or self.max_ends[i - 1] <= start
+
+    def overlapping(self, start: time, end: time) -> List[Occupation]:
+        # Only the occupations starting before `end` may overlap. Going back
+        # from the last of them, we may stop once no earlier one ends after
+        # `start`.
+        i = bisect.bisect_left(self.starts, end) - 1
+        ret = []
+        while i >= 0 and self.max_ends[i] > start:
+            if self.occupations[i].end > start:
+                ret.append(self.occupations[i])
+            i -= 1
+        ret.reverse()
+        return ret
+
+
+class RoomOccupancy:
+    """Index of room occupations."""
+
+    def __init__(self):
+        self._days: Dict[Tuple[int, date], _DayIndex] = {}
+        self._places: DefaultDict[Key, Set[Tuple[int, date]]] = collections.defaultdict(set)
+
+    def add(self, occupation: Occupation):
+        place = (occupation.room_id, occupation.day)
+        if place not in self._days:
+            self._days[place] = _DayIndex()
+        self._days[place].add(occupation)
+        self._places[occupation.key].add(place)
+
+    def discard(self, kind: str, pk: int):
+        """Removes all the occupations of the source (i.e. a course term)."""
+        for place in self._places.pop((kind, pk), ()):
+            self._days[place].discard((kind, pk))
+
+    def is_free(self, room_id: int, day: date, start: time, end: time,
+                exclude: Collection[Key] = ()) -> bool:
+        """Checks that no occupation of the room overlaps the given time.
+
+        Occupations with sources or bookings in `exclude` are ignored.
+        """
+        if exclude:
+            return not self.overlapping(room_id, day, start, end, exclude=exclude)
+        index = self._days.get((room_id, day))
+        return index is None or index.is_free(start, end)
+
+    def overlapping(self, room_id: int, day: date, start: time, end: time,
+                    kinds: Collection[str] = ALL_KINDS,
+                    exclude: Collection[Key] = ()) -> List[Occupation]:
+        """Lists the occupations of the room overlapping the given time.
+
+        Only occupations of the given kinds are listed, and those with sources
+        or bookings in `exclude` are skipped. They are sorted by start.
+        """
+        index = self._days.get((room_id, day))
+        if index is None:
+            return []
+        return [
+            o for o in index.overlapping(start, end)
+            if o.kind in kinds and o.key not in exclude and o.booking not in exclude
+        ]
+
+    def busy(self, room_id: int, day: date) -> List[Period]:
+        """Returns the periods when the room is occupied on the day.
+
+        Overlapping and adjacent occupations are merged.
+        """
+        index = self._days.get((room_id, day))
+        merged: List[List[time]] = []
+        for occupation in index.occupations if index is not None else []:
+            if merged and occupation.start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], occupation.end)
+            else:
+                merged.append([occupation.start, occupation.end])
+        return [(start, end) for start, end in merged]
+
+    def places(self) -> List[Tuple[int, date]]:
+        """Lists the (room id, day) pairs that may have occupations."""
+        return list(self._days)
+
+    def conflicts(self) -> Iterator[Tuple[Occupation, Occupation]]:
+        """Yields the pairs of overlapping occupations of different bookings.
+
+        The pairs are ordered by room and day, and then by their starts.
+        """
+        for place in sorted(self._days):
+            # Occupations are sorted by start, so a sweep over them only needs
+            # to remember the ones still going on.
+            ongoing: List[Occupation] = []
+            for occupation in self._days[place].occupations:
+                ongoing = [o for o in ongoing if o.end > occupation.start]
+                for other in ongoing:
+                    if other.booking != occupation.booking:
+                        yield other, occupation
+                ongoing.append(occupation)
+
+    @classmethod
+    def build(cls, first_day: date, last_day: date, rooms: Optional[Iterable[Any]] = None,
+              kinds: Collection[str] = ALL_KINDS) -> 'RoomOccupancy':
+        """Loads the occupations of the rooms in the range of days (inclusive).
+
+        Args:
+            rooms: Classrooms or their ids. All the rooms if None.
+            kinds: Kinds of occupations to load.
+        """
+        occupancy = cls()
+        room_ids = None if rooms is None else {getattr(room, 'pk', room) for room in rooms}
+        if EVENT_TERM in kinds:
+            terms = Term.objects.filter(
+                day__gte=first_day, day__lte=last_day, room__isnull=False,
+                event__status=Event.STATUS_ACCEPTED).select_related('event')
+            if room_ids is not None:
+                terms = terms.filter(room_id__in=room_ids)
+            for term in terms:
+                occupancy.add(Occupation.from_term(term))
+        if COURSE_TERM in kinds or RESERVATION in kinds:
+            for semester, days in lecture_days(first_day, last_day).items():
+                occupancy._add_weekly(semester, days, room_ids, kinds)
+        return occupancy
+
+    def _add_weekly(self, semester: Semester, days: Dict[str, List[date]],
+                    room_ids: Optional[Set[int]], kinds: Collection[str]):
+        """Adds course terms and reservations of the semester on the days.
+
+        Args:
+            days: Maps days of week to the lecture days that follow them.
+        """
+        if COURSE_TERM in kinds:
+            course_terms = CourseTerm.objects.filter(
+                group__course__semester=semester, dayOfWeek__in=days.keys()).select_related(
+                    'group__course').prefetch_related('classrooms')
+            if room_ids is not None:
+                course_terms = course_terms.filter(classrooms__in=room_ids).distinct()
+            for course_term in course_terms:
+                for room in course_term.classrooms.all():
+                    if room_ids is not None and room.pk not in room_ids:
+                        continue
+                    for day in days[course_term.dayOfWeek]:
+                        self.add(Occupation(room.pk, day, course_term.start_time,
+                                            course_term.end_time, COURSE_TERM, course_term,
+                                            ('group', course_term.group_id)))
+        if RESERVATION in kinds:
+            reservations = SpecialReservation.objects.filter(
+                semester=semester, dayOfWeek__in=days.keys())
+            if room_ids is not None:
+                reservations = reservations.filter(classroom_id__in=room_ids)
+            for reservation in reservations:
+                for day in days[reservation.dayOfWeek]:
+                    self.add(Occupation(reservation.classroom_id, day, reservation.start_time,
+                                        reservation.end_time, RESERVATION, reservation,
+                                        (RESERVATION, reservation.pk)))
+
+
+def lecture_days(first_day: date, last_day: date) -> Dict[Semester, Dict[str, List[date]]]:
+    """Finds the lecture days in the range and the days of week they follow.
+
+    Free days are skipped. Changed days follow the day of week they are changed
+    to. The result maps semesters to dicts from days of week to lists of days.
+    """
+    ret: Dict[Semester, Dict[str, List[date]]] = {}
+    semesters = Semester.objects.filter(lectures_beginning__lte=last_day,
+                                        lectures_ending__gte=first_day)
+    for semester in semesters:
+        days: DefaultDict[str, List[date]] = collections.defaultdict(list)
+        for day, day_of_week in semester.get_lecture_days().items():
+            if first_day <= day <= last_day:
+                days[day_of_week].append(day)
+        ret[semester] = days
+    return ret
+
+
+def busy_periods(first_day: date, last_day: date) -> Dict[date, Dict[int, List[Period]]]:
+    """Returns the merged occupied periods of the rooms on every day of the range.
+
+    The result maps days to dicts from room ids to periods (see
+    `RoomOccupancy.busy`). Free rooms are left out. Every day is cached
+    until the terms of its week, the course terms of its semester or the
+    calendar change. The days missing from the cache are loaded together.
+    """
+    semesters = Semester.objects.filter(
+        lectures_beginning__lte=last_day, lectures_ending__gte=first_day).values_list(
+            'pk', 'lectures_beginning', 'lectures_ending')
+    tags = {}
+    day = first_day
+    while day <= last_day:
+        tags[str(day)] = [
+            week_feed_tag(day - timedelta(days=day.weekday())), CALENDAR_TAG,
+            *(course_terms_tag('semester', pk) for pk, beginning, ending in semesters
+              if beginning <= day <= ending),
+        ]
+        day += timedelta(days=1)
+
+    def build(keys: List[str]) -> Dict[str, Dict[int, List[Period]]]:
+        days = [date.fromisoformat(key) for key in keys]
+        occupancy = RoomOccupancy.build(min(days), max(days))
+        ret: Dict[str, Dict[int, List[Period]]] = {key: {} for key in keys}
+        for room_id, day in occupancy.places():
+            if str(day) in ret:
+                ret[str(day)][room_id] = occupancy.busy(room_id, day)
+        return ret
+
+    cached = tagged_cache.get_many_or_build('busy_periods', tags, build, BUSY_PERIODS_CACHE_TIMEOUT)
+    return {date.fromisoformat(key): periods for key, periods in cached.items()}
+
+
+def conflicting_terms(terms: Iterable[Term]) -> Dict[int, List[Term]]:
+    """For each of the terms lists the terms of accepted events overlapping it.
+
+    All the terms are checked with a single index. Terms without a room never
+    conflict. The result is indexed by term ids.
+    """
+    terms = list(terms)
+    ret: Dict[int, List[Term]] = {term.pk: [] for term in terms}
+    with_room = [term for term in terms if term.room_id is not None]
+    if not with_room:
+        return ret
+    occupancy = RoomOccupancy.build(min(t.day for t in with_room), max(t.day for t in with_room),
+                                    rooms={t.room_id for t in with_room}, kinds={EVENT_TERM})
+    for term in with_room:
+        ret[term.pk] = [
+            o.source for o in occupancy.overlapping(
+                term.room_id, term.day, term.start, term.end, exclude={(EVENT_TERM, term.pk)})
+        ]
+    return ret
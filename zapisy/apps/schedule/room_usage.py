@@ -0,0 +1,131 @@
+"""Usage of rooms, for the table reports and the door charts.
+
+The weekly usage of a room in a semester (its course terms and special
+reservations) is kept in the cache for every room separately, so a report of
+any subset of rooms is assembled from the snapshots and only the rooms whose
+course terms or reservations changed are ever loaded again. All the missing
+rooms are loaded together with two queries. Names of courses and teachers are
+not tracked and may lag behind until the snapshot expires.
+
+Terms of events on particular days are not cached, they are loaded for the
+requested range of days with a single query.
+"""
+import collections
+import re
+from datetime import date, time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from apps.common import tagged_cache
+from apps.enrollment.courses.models.classroom import Classroom
+from apps.enrollment.courses.models.group import GroupType
+from apps.enrollment.courses.models.semester import Semester
+from apps.enrollment.courses.models.term import Term as CourseTerm
+from apps.enrollment.courses.models.term import cache_tag as course_terms_tag
+from apps.schedule.models.event import Event
+from apps.schedule.models.specialreservation import SpecialReservation
+from apps.schedule.models.specialreservation import cache_tag as reservations_tag
+from apps.schedule.models.term import Term
+
+ROOM_USAGE_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+class UsageEntry(NamedTuple):
+    """A room being used, on a date or every week."""
+    date: Optional[date]
+    # Monday is 1, Sunday is 7 like in
+    # https://docs.python.org/3/library/datetime.html#datetime.date.isoweekday.
+    weekday: int
+    begin: time
+    end: time
+    title: str
+    type: str
+    author: str
+
+
+def _full_name(first_name: Optional[str], last_name: Optional[str]) -> str:
+    # Like `User.get_full_name`.
+    return f'{first_name or ""} {last_name or ""}'.strip()
+
+
+def _load_semester_usage(semester_id: int, room_ids: List[int]) -> Dict[int, List[UsageEntry]]:
+    usage: Dict[int, List[UsageEntry]] = {room_id: [] for room_id in room_ids}
+    group_types = dict(GroupType.choices)
+    for room_id, day_of_week, start, end, name, group_type, first_name, last_name in (
+            CourseTerm.objects.filter(
+                group__course__semester_id=semester_id, classrooms__in=room_ids).values_list(
+                    'classrooms', 'dayOfWeek', 'start_time', 'end_time', 'group__course__name',
+                    'group__type', 'group__teacher__user__first_name',
+                    'group__teacher__user__last_name')):
+        usage[room_id].append(
+            UsageEntry(None, int(day_of_week), start, end, name, group_types[group_type],
+                       _full_name(first_name, last_name)))
+    for room_id, day_of_week, start, end, title in SpecialReservation.objects.filter(
+            semester_id=semester_id, classroom__in=room_ids).values_list(
+                'classroom_id', 'dayOfWeek', 'start_time', 'end_time', 'title'):
+        usage[room_id].append(UsageEntry(None, int(day_of_week), start, end, title, '', ''))
+    for entries in usage.values():
+        entries.sort(key=lambda entry: (entry.weekday, entry.begin, entry.end, entry.title))
+    return usage
+
+
+def semester_usage(semester: Semester, room_ids: Iterable[int]) -> Dict[int, List[UsageEntry]]:
+    """Returns the weekly usage of the rooms in the semester, sorted by weekday and time."""
+    tags = {
+        f'{semester.pk}:{room_id}': [course_terms_tag('room', room_id), reservations_tag(room_id)]
+        for room_id in room_ids
+    }
+
+    def build(keys: List[str]) -> Dict[str, List[UsageEntry]]:
+        usage = _load_semester_usage(semester.pk, [int(key.split(':')[1]) for key in keys])
+        return {f'{semester.pk}:{room_id}': entries for room_id, entries in usage.items()}
+
+    cached = tagged_cache.get_many_or_build('room_usage', tags, build, ROOM_USAGE_CACHE_TIMEOUT)
+    return {int(key.split(':')[1]): entries for key, entries in cached.items()}
+
+
+def dated_usage(first_day: date, last_day: date,
+                room_ids: Iterable[int]) -> Dict[int, List[UsageEntry]]:
+    """Returns the terms of accepted events in the rooms, sorted by date and time."""
+    room_ids = list(room_ids)
+    usage: Dict[int, List[UsageEntry]] = {room_id: [] for room_id in room_ids}
+    group_types = dict(GroupType.choices)
+    event_types = dict(Event.TYPES)
+    for room_id, day, start, end, title, course, group_type, event_type, first_name, last_name in (
+            Term.objects.filter(
+                day__gte=first_day, day__lte=last_day, room__in=room_ids,
+                event__status=Event.STATUS_ACCEPTED).order_by(
+                    'day', 'start', 'end').values_list(
+                        'room_id', 'day', 'start', 'end', 'event__title', 'event__course__name',
+                        'event__group__type', 'event__type', 'event__author__first_name',
+                        'event__author__last_name')):
+        usage[room_id].append(
+            UsageEntry(day, day.isoweekday(), start, end, title or course or '',
+                       group_types[group_type] if group_type else event_types[event_type],
+                       _full_name(first_name, last_name)))
+    return usage
+
+
+def _room_sort_key(number: str) -> Tuple[bool, int, str]:
+    # Numbered rooms go first, in numerical order.
+    digits = re.match(r'\d+', number)
+    return (digits is None, int(digits.group()) if digits else 0, number)
+
+
+def usage_report(room_ids: Iterable[int], semester: Optional[Semester] = None,
+                 first_day: Optional[date] = None,
+                 last_day: Optional[date] = None) -> List[Tuple[str, List[UsageEntry]]]:
+    """Lists the usage of every room, ordered by room numbers.
+
+    Weekly entries of the semester (if given) go first, followed by the terms
+    of events between the days (if both are given).
+    """
+    numbers = dict(Classroom.objects.filter(pk__in=list(room_ids)).values_list('pk', 'number'))
+    usage: Dict[int, List[UsageEntry]] = collections.defaultdict(list)
+    if semester is not None:
+        for room_id, entries in semester_usage(semester, numbers).items():
+            usage[room_id].extend(entries)
+    if first_day is not None and last_day is not None:
+        for room_id, entries in dated_usage(first_day, last_day, numbers).items():
+            usage[room_id].extend(entries)
+    return sorted(((numbers[room_id], usage[room_id]) for room_id in numbers),
+                  key=lambda item: _room_sort_key(item[0]))
@@ -0,0 +1,80 @@
+"""Tests for the report of overlapping terms."""
+from datetime import date, time, timedelta
+from unittest import mock
+
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.core.cache.backends.base import memcache_key_warnings
+from django.test import TestCase
+from django.urls import reverse
+
+from apps.common import tagged_cache
+from apps.enrollment.courses.tests.factories import ClassroomFactory
+from apps.schedule.conflicts import conflict_report
+from apps.schedule.models.event import Event
+from apps.users.tests.factories import UserFactory
+
+from . import factories
+
+DAY = date(2031, 3, 5)
+
+
+class ConflictReportTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.room = ClassroomFactory(number='105')
+        cls.other_room = ClassroomFactory(number='7')
+
+        def term(start, end, room=cls.room, day=DAY, event_factory=factories.EventFactory):
+            return factories.TermFactory(event=event_factory(type=Event.TYPE_GENERIC), room=room,
+                                         day=day, start=time(*start), end=time(*end))
+
+        cls.long = term((8,), (12,))
+        # Partially overlaps the long term.
+        cls.partial = term((11,), (13,))
+        # Contained in the long term.
+        cls.contained = term((9,), (10,))
+        # Adjacent to the partial term, but overlapping a pending one.
+        cls.adjacent = term((13,), (14,))
+        cls.pending = term((13, 30), (15,), event_factory=factories.PendingEventFactory)
+        term((9,), (10,), room=cls.other_room)
+        term((9,), (10,), day=date(2031, 3, 6))
+
+    def test_all_overlapping_pairs(self):
+        report = conflict_report(DAY, date(2031, 3, 6))
+        self.assertListEqual(list(report), [DAY])
+        [(room, conflicts)] = report[DAY].items()
+        self.assertEqual(room.pk, self.room.pk)
+        self.assertEqual(room.url, self.room.get_absolute_url())
+        pairs = {(c.head.pk, t.pk) for c in conflicts for t in c.conflicted}
+        self.assertSetEqual(pairs, {
+            (self.long.pk, self.contained.pk),
+            (self.long.pk, self.partial.pk),
+            (self.adjacent.pk, self.pending.pk),
+        })
+        self.assertListEqual([t.pk for t in conflicts[0].conflicted],
+                             [self.contained.pk, self.partial.pk])
+        self.assertEqual(conflicts[0].head.title, self.long.event.title)
+        self.assertEqual(conflicts[0].head.url, self.long.event.get_absolute_url())
+
+    def test_constant_queries(self):
+        with self.assertNumQueries(1):
+            conflict_report(date(2031, 3, 1), date(2031, 3, 31))
+
+    def test_semester_key_is_valid_for_memcached(self):
+        with mock.patch.object(tagged_cache.cache, 'get', wraps=cache.get) as get:
+            conflict_report(DAY, DAY + timedelta(weeks=20))
+        [key] = [c.args[0] for c in get.call_args_list if c.args[0].startswith('conflicts:')]
+        self.assertListEqual(list(memcache_key_warnings(cache.make_key(key))), [])
+
+    def test_view(self):
+        manager = UserFactory()
+        manager.user_permissions.add(Permission.objects.get(codename='manage_events'))
+        self.client.force_login(manager)
+        response = self.client.get(reverse('events:conflicts'),
+                                   {'beg_date': str(DAY), 'end_date': str(DAY)})
+        self.assertContains(response, f'Sala {self.room.number}')
+        self.assertContains(response, self.partial.event.title)
+        self.assertContains(response, '13:30:00 - 15:00:00')
+        self.assertNotContains(response, self.other_room.get_absolute_url())
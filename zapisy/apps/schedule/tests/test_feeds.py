@@ -0,0 +1,113 @@
+"""Tests for the calendar feeds of classrooms and events."""
+import json
+from datetime import date, time
+
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+
+from apps.enrollment.courses.tests.factories import (ClassroomFactory, CourseInstanceFactory,
+                                                     GroupFactory)
+from apps.schedule.models.event import Event
+from apps.schedule.models.term import Term
+from apps.schedule.utils import EventAdapter
+from apps.users.tests.factories import UserFactory
+
+from . import factories
+
+# A Wednesday.
+DAY = date(2031, 3, 5)
+
+
+def feed_params(first: date, last: date):
+    return {'start': f'{first}T00:00:00.000Z', 'end': f'{last}T00:00:00.000Z'}
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'schedule-feed-tests',
+    }
+})
+class CalendarFeedTest(TransactionTestCase):
+    """Tags are invalidated on commit, hence the TransactionTestCase."""
+
+    def setUp(self):
+        cache.clear()
+        self.room = ClassroomFactory(number='105')
+        self.url = reverse('events:classroom_ajax', args=(self.room.slug,))
+        course = CourseInstanceFactory()
+        self.terms = [
+            factories.TermFactory(event=factories.EventFactory(type=Event.TYPE_EXAM, course=course),
+                                  room=self.room, day=DAY, start=time(10), end=time(12)),
+            factories.TermFactory(event=factories.EventInvisibleFactory(type=Event.TYPE_GENERIC),
+                                  room=self.room, day=DAY, start=time(12), end=time(14)),
+            factories.TermFactory(event=factories.EventFactory(type=Event.TYPE_CLASS,
+                                                               group=GroupFactory()),
+                                  room=self.room, day=date(2031, 3, 10), start=time(8),
+                                  end=time(10)),
+            factories.TermFactory(event=factories.EventFactory(type=Event.TYPE_GENERIC),
+                                  room=ClassroomFactory(number='7'), day=DAY, start=time(8),
+                                  end=time(10)),
+        ]
+        self.user = UserFactory()
+        self.manager = UserFactory()
+        self.manager.user_permissions.add(Permission.objects.get(codename='manage_events'))
+
+    def fetch(self, user, url, first=date(2031, 3, 1), last=date(2031, 3, 31)):
+        self.client.force_login(user)
+        response = self.client.get(url, feed_params(first, last))
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return b''.join(response.streaming_content).decode()
+
+    def legacy_feed(self, user, queryset):
+        request = type('Request', (), {'user': user})
+        return EventAdapter(queryset.select_related('event'), request).collection_as_json()
+
+    def test_same_as_the_adapter(self):
+        terms = Term.objects.filter(room=self.room).order_by('day', 'start', 'end')
+        for user in (self.user, self.manager):
+            user = type(user).objects.get(pk=user.pk)
+            self.assertEqual(self.fetch(user, self.url), self.legacy_feed(user, terms))
+        events = Term.objects.filter(event__type='2', event__visible=True)
+        self.assertEqual(self.fetch(self.user, reverse('events:events_ajax')),
+                         self.legacy_feed(self.user, events))
+
+    def test_range_is_honoured(self):
+        feed = json.loads(self.fetch(self.user, self.url, first=DAY, last=DAY))
+        self.assertListEqual([item['start'] for item in feed],
+                             ['2031-03-05T10:00:00', '2031-03-05T12:00:00'])
+        self.assertEqual(feed[1]['title'], 'Sala zajęta')
+        self.assertNotIn('url', feed[1])
+
+    def test_cached_until_terms_change(self):
+        superuser = UserFactory(is_superuser=True)
+        self.fetch(superuser, self.url)
+        self.client.force_login(superuser)
+        response = self.client.get(self.url, feed_params(date(2031, 3, 1), date(2031, 3, 31)))
+        with self.assertNumQueries(0):
+            first = b''.join(response.streaming_content).decode()
+
+        # A term in another room does not matter.
+        self.terms[3].start = time(7)
+        self.terms[3].save()
+        response = self.client.get(self.url, feed_params(date(2031, 3, 1), date(2031, 3, 31)))
+        with self.assertNumQueries(0):
+            b''.join(response.streaming_content)
+
+        self.terms[0].start = time(9)
+        self.terms[0].save()
+        second = self.fetch(superuser, self.url)
+        self.assertNotEqual(second, first)
+        self.assertIn('2031-03-05T09:00:00', second)
+
+        event = self.terms[1].event
+        event.title = 'Nowy termin'
+        event.save()
+        self.assertIn('Nowy termin', self.fetch(superuser, self.url))
+
+        # Moving the term out of the room invalidates the feed of the room.
+        self.terms[2].room = self.terms[3].room
+        self.terms[2].save()
+        self.assertNotIn('2031-03-10', self.fetch(superuser, self.url))
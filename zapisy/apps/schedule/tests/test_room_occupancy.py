@@ -0,0 +1,229 @@
+"""Tests for the room occupancy index."""
+import json
+from datetime import date, time, timedelta
+from io import StringIO
+from types import SimpleNamespace
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from apps.common import days_of_week
+from apps.enrollment.courses.models.semester import ChangedDay, Freeday
+from apps.enrollment.courses.models.term import Term as CourseTerm
+from apps.enrollment.courses.tests.factories import ClassroomFactory, GroupFactory, SemesterFactory
+from apps.schedule.models.event import Event
+from apps.schedule.models.term import Term
+from apps.schedule.room_occupancy import (COURSE_TERM, EVENT_TERM, RESERVATION, Occupation,
+                                          RoomOccupancy, busy_periods)
+from apps.users.tests.factories import UserFactory
+
+from . import factories
+
+# Lectures of the semester in tests start on this Monday.
+MONDAY = date(2031, 3, 3)
+
+
+def occupation(pk: int, start: int, end: int, booking: str) -> Occupation:
+    return Occupation(1, MONDAY, time(start), time(end), EVENT_TERM, SimpleNamespace(pk=pk),
+                      ('event', booking))
+
+
+class RoomOccupancyIndexTest(TestCase):
+
+    def test_queries(self):
+        occupancy = RoomOccupancy()
+        first = occupation(1, 8, 10, 'x')
+        second = occupation(2, 9, 11, 'y')
+        third = occupation(3, 12, 13, 'z')
+        fourth = occupation(4, 9, 10, 'x')
+        for o in (third, first, second, fourth):
+            occupancy.add(o)
+
+        self.assertFalse(occupancy.is_free(1, MONDAY, time(10), time(12)))
+        self.assertTrue(occupancy.is_free(1, MONDAY, time(11), time(12)))
+        self.assertTrue(occupancy.is_free(1, MONDAY, time(13), time(14)))
+        self.assertTrue(occupancy.is_free(2, MONDAY, time(8), time(14)))
+        self.assertTrue(occupancy.is_free(1, MONDAY, time(10), time(12),
+                                          exclude={('event', 'y')}))
+        self.assertListEqual(occupancy.overlapping(1, MONDAY, time(9, 30), time(9, 45)),
+                             [first, second, fourth])
+        self.assertListEqual(
+            occupancy.overlapping(1, MONDAY, time(9, 30), time(9, 45), exclude={('event', 'x')}),
+            [second])
+        self.assertListEqual(occupancy.busy(1, MONDAY), [(time(8), time(11)), (time(12), time(13))])
+        self.assertListEqual(list(occupancy.conflicts()), [(first, second), (second, fourth)])
+
+        occupancy.discard(EVENT_TERM, 2)
+        self.assertTrue(occupancy.is_free(1, MONDAY, time(10), time(12)))
+        self.assertListEqual(list(occupancy.conflicts()), [])
+
+
+class RoomOccupancyBuildTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.semester = SemesterFactory(
+            lectures_beginning=MONDAY, lectures_ending=MONDAY + timedelta(weeks=10),
+            semester_beginning=MONDAY, semester_ending=MONDAY + timedelta(weeks=12))
+        cls.room = ClassroomFactory()
+        Freeday.objects.create(day=MONDAY + timedelta(weeks=1))
+        ChangedDay.objects.create(day=MONDAY + timedelta(days=9), weekday=days_of_week.MONDAY)
+        group = GroupFactory(course__semester=cls.semester)
+        cls.course_term = CourseTerm.objects.create(
+            group=group, dayOfWeek=days_of_week.MONDAY, start_time=time(10), end_time=time(12))
+        # This creates the class event with its terms.
+        cls.course_term.classrooms.add(cls.room)
+        cls.reservation = factories.SpecialReservationFactory.build(
+            semester=cls.semester, classroom=cls.room, dayOfWeek=days_of_week.MONDAY,
+            start_time=time(16), end_time=time(18))
+        cls.reservation.save(author_id=UserFactory().pk)
+
+    def test_calendar_is_honoured(self):
+        occupancy = RoomOccupancy.build(MONDAY, MONDAY + timedelta(weeks=2), rooms=[self.room],
+                                        kinds={COURSE_TERM, RESERVATION})
+        class_days = [
+            day for day in (MONDAY + timedelta(days=n) for n in range(15))
+            if not occupancy.is_free(self.room.pk, day, time(11), time(11, 30))
+        ]
+        self.assertListEqual(class_days, [
+            MONDAY, MONDAY + timedelta(days=9), MONDAY + timedelta(weeks=2)])
+        reserved = occupancy.overlapping(self.room.pk, MONDAY, time(17), time(19))
+        self.assertListEqual([o.source for o in reserved], [self.reservation])
+
+    def test_conflicts_between_bookings(self):
+        event = factories.EventFactory(type=Event.TYPE_GENERIC)
+        event_term = factories.TermFactory(event=event, room=self.room, day=MONDAY,
+                                           start=time(11), end=time(13))
+        pending_term = factories.TermFactory(event=factories.PendingEventFactory(),
+                                             room=self.room, day=MONDAY, start=time(8),
+                                             end=time(18))
+
+        occupancy = RoomOccupancy.build(MONDAY, MONDAY, rooms=[self.room])
+        conflicts = {(a.key, b.key) for a, b in occupancy.conflicts()}
+        class_term = next(o for o in occupancy.overlapping(self.room.pk, MONDAY, time(10), time(11))
+                          if o.kind == EVENT_TERM)
+        # The class term and the course term are the same booking.
+        self.assertSetEqual(conflicts, {
+            (class_term.key, (EVENT_TERM, event_term.pk)),
+            ((COURSE_TERM, self.course_term.pk), (EVENT_TERM, event_term.pk)),
+        })
+        self.assertNotIn((EVENT_TERM, pending_term.pk), {o.key for o in occupancy.overlapping(
+            self.room.pk, MONDAY, time(8), time(18))})
+        # The pending event overlaps the class, the reservation and the event.
+        self.assertSetEqual({e.pk for e in pending_term.event.get_conflicted()}, set(
+            Event.objects.filter(term__day=MONDAY, status=Event.STATUS_ACCEPTED).values_list(
+                'pk', flat=True)))
+        self.assertEqual(Event.objects.filter(term__day=MONDAY).distinct().count(), 4)
+
+    def test_term_validation(self):
+        term = factories.TermFactory.build(event=factories.EventFactory(), room=self.room,
+                                           day=MONDAY, start=time(17), end=time(19))
+        with self.assertRaisesMessage(ValidationError, 'ta sala jest zarezerwowana'):
+            term.full_clean()
+        term.start, term.end = time(11), time(13)
+        with self.assertRaisesMessage(ValidationError, 'odbywają się zajęcia'):
+            term.validate_against_course_terms()
+        term.day = MONDAY + timedelta(weeks=1)
+        term.full_clean()
+
+    def test_terms_do_not_conflict_with_their_bookings(self):
+        class_term = Term.objects.get(day=MONDAY, event__group__isnull=False)
+        reservation_term = Term.objects.get(day=MONDAY, event__reservation=self.reservation)
+        for term in [class_term, reservation_term]:
+            with self.subTest(term=term):
+                term.validate_against_event_terms()
+                term.validate_against_course_terms()
+
+    def test_day_availability(self):
+        self.client.force_login(UserFactory())
+        response = self.client.get(reverse('events:get_terms', args=(MONDAY.year, MONDAY.month, MONDAY.day)))
+        occupied = json.loads(response.content)[self.room.number]['occupied']
+        self.assertListEqual(occupied, [{'begin': '10:00', 'end': '12:00'},
+                                        {'begin': '16:00', 'end': '18:00'}])
+
+    def test_availability_range(self):
+        self.client.force_login(UserFactory())
+        response = self.client.get(reverse('events:availability'), {
+            'from': str(MONDAY), 'to': str(MONDAY + timedelta(days=13))})
+        data = json.loads(response.content)
+        self.assertEqual(data['rooms'][self.room.number]['id'], self.room.pk)
+        self.assertEqual(len(data['days']), 14)
+        monday = data['days'][str(MONDAY)][self.room.number]
+        self.assertListEqual(monday['occupied'], [{'begin': '10:00', 'end': '12:00'},
+                                                  {'begin': '16:00', 'end': '18:00'}])
+        self.assertListEqual(monday['free'], [{'begin': '08:00', 'end': '10:00'},
+                                              {'begin': '12:00', 'end': '16:00'},
+                                              {'begin': '18:00', 'end': '22:00'}])
+        # The free day and the Wednesday following Monday's schedule.
+        self.assertListEqual(
+            data['days'][str(MONDAY + timedelta(weeks=1))][self.room.number]['occupied'], [])
+        self.assertEqual(
+            len(data['days'][str(MONDAY + timedelta(days=9))][self.room.number]['occupied']), 2)
+
+        for params in ({'from': str(MONDAY)}, {'from': str(MONDAY), 'to': 'x'},
+                       {'from': str(MONDAY), 'to': str(MONDAY - timedelta(days=1))},
+                       {'from': str(MONDAY), 'to': str(MONDAY + timedelta(days=100))}):
+            self.assertEqual(self.client.get(reverse('events:availability'), params).status_code,
+                             400)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'busy-periods-tests',
+    }
+})
+class BusyPeriodsCacheTest(TransactionTestCase):
+    """Tags are invalidated on commit, hence the TransactionTestCase."""
+
+    def setUp(self):
+        cache.clear()
+        self.semester = SemesterFactory(
+            lectures_beginning=MONDAY, lectures_ending=MONDAY + timedelta(weeks=10),
+            semester_beginning=MONDAY, semester_ending=MONDAY + timedelta(weeks=12))
+        self.room = ClassroomFactory()
+        self.course_term = CourseTerm.objects.create(
+            group=GroupFactory(course__semester=self.semester), dayOfWeek=days_of_week.MONDAY,
+            start_time=time(10), end_time=time(12))
+
+    def test_days_are_cached_until_they_change(self):
+        last = MONDAY + timedelta(weeks=2)
+        self.assertDictEqual(busy_periods(MONDAY, last)[MONDAY], {})
+        # Only the semesters are queried.
+        with self.assertNumQueries(1):
+            busy_periods(MONDAY, last)
+
+        self.course_term.classrooms.add(self.room)
+        self.assertListEqual(busy_periods(MONDAY, last)[MONDAY + timedelta(weeks=1)][self.room.pk],
+                             [(time(10), time(12))])
+
+        factories.TermFactory(event=factories.EventFactory(type=Event.TYPE_GENERIC),
+                              room=self.room, day=MONDAY, start=time(12), end=time(13))
+        self.assertListEqual(busy_periods(MONDAY, last)[MONDAY][self.room.pk],
+                             [(time(10), time(13))])
+
+        tuesday = MONDAY + timedelta(days=1)
+        self.assertNotIn(self.room.pk, busy_periods(MONDAY, last)[tuesday])
+        ChangedDay.objects.create(day=tuesday, weekday=days_of_week.MONDAY)
+        self.assertListEqual(busy_periods(MONDAY, last)[tuesday][self.room.pk],
+                             [(time(10), time(12))])
+
+
+class RoomExclusionConstraintTest(TransactionTestCase):
+    """Tables with pending deferred checks cannot be altered, hence the TransactionTestCase."""
+
+    def test_overlapping_terms_are_rejected(self):
+        room = ClassroomFactory()
+        factories.TermFactory(room=room, day=MONDAY, start=time(10), end=time(12))
+        call_command('room_exclusion_constraint', 'install', stdout=StringIO())
+        self.addCleanup(call_command, 'room_exclusion_constraint', 'drop', stdout=StringIO())
+
+        factories.TermFactory(room=room, day=MONDAY, start=time(12), end=time(13))
+        factories.TermFactory(room=room, day=MONDAY, start=time(11), end=time(13),
+                              ignore_conflicts=True)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            factories.TermFactory(room=room, day=MONDAY, start=time(11), end=time(13))
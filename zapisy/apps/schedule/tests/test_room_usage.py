@@ -0,0 +1,110 @@
+"""Tests for the room usage reports and door charts."""
+from datetime import date, time, timedelta
+from io import StringIO
+
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+from freezegun import freeze_time
+
+from apps.common import days_of_week
+from apps.enrollment.courses.models.group import GroupType
+from apps.enrollment.courses.models.term import Term as CourseTerm
+from apps.enrollment.courses.tests.factories import ClassroomFactory, GroupFactory, SemesterFactory
+from apps.schedule.models.event import Event
+from apps.schedule.room_usage import semester_usage, usage_report
+from apps.users.tests.factories import UserFactory
+
+from . import factories
+
+MONDAY = date(2031, 3, 3)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'room-usage-tests',
+    }
+})
+class RoomUsageTest(TransactionTestCase):
+    """Tags are invalidated on commit, hence the TransactionTestCase."""
+
+    def setUp(self):
+        cache.clear()
+        self.semester = SemesterFactory(
+            lectures_beginning=MONDAY, lectures_ending=MONDAY + timedelta(weeks=10),
+            semester_beginning=MONDAY, semester_ending=MONDAY + timedelta(weeks=12))
+        self.room = ClassroomFactory(number='105')
+        self.other_room = ClassroomFactory(number='7')
+        group = GroupFactory(course__semester=self.semester, type=GroupType.LAB)
+        self.course_term = CourseTerm.objects.create(
+            group=group, dayOfWeek=days_of_week.TUESDAY, start_time=time(12), end_time=time(14))
+        self.course_term.classrooms.add(self.room, self.other_room)
+        self.reservation = factories.SpecialReservationFactory.build(
+            semester=self.semester, classroom=self.room, dayOfWeek=days_of_week.MONDAY,
+            start_time=time(16), end_time=time(18), title='Seminarium')
+        self.reservation.save(author_id=UserFactory().pk)
+
+    def test_semester_report(self):
+        report = usage_report([self.room.pk, self.other_room.pk], self.semester)
+        self.assertListEqual([number for number, _ in report], ['7', '105'])
+        entries = report[1][1]
+        self.assertListEqual([(e.weekday, e.begin, e.title) for e in entries], [
+            (1, time(16), 'Seminarium'),
+            (2, time(12), self.course_term.group.course.name),
+        ])
+        self.assertEqual(entries[1].type, 'pracownia')
+        self.assertEqual(entries[1].author, self.course_term.group.teacher.get_full_name())
+
+    def test_only_changed_rooms_are_loaded(self):
+        room_ids = [self.room.pk, self.other_room.pk]
+        semester_usage(self.semester, room_ids)
+        with self.assertNumQueries(0):
+            semester_usage(self.semester, room_ids)
+
+        self.course_term.classrooms.remove(self.other_room)
+        # The course terms and the reservations of a single room.
+        with self.assertNumQueries(2):
+            usage = semester_usage(self.semester, room_ids)
+        self.assertListEqual(usage[self.other_room.pk], [])
+
+        factories.SpecialReservationFactory.build(
+            semester=self.semester, classroom=self.other_room, dayOfWeek=days_of_week.FRIDAY,
+            start_time=time(8), end_time=time(10)).save(author_id=UserFactory().pk)
+        with self.assertNumQueries(2):
+            usage = semester_usage(self.semester, room_ids)
+        self.assertListEqual([e.weekday for e in usage[self.other_room.pk]], [5])
+
+    def test_views_and_export(self):
+        factories.TermFactory(event=factories.EventFactory(type=Event.TYPE_EXAM, title='Egzamin'),
+                              room=self.other_room, day=MONDAY + timedelta(days=2),
+                              start=time(9), end=time(11))
+        manager = UserFactory()
+        manager.user_permissions.add(Permission.objects.get(codename='manage_events'))
+        with freeze_time(MONDAY):
+            self.client.force_login(manager)
+            response = self.client.post(reverse('events:events_report'), {
+                'report-type': 'doors', 'rooms': [self.room.pk, self.other_room.pk],
+                'week': 'currsem'})
+        self.assertEqual(response.context['semester'], self.semester)
+        self.assertContains(response, 'SEMINARIUM')
+        response = self.client.post(reverse('events:events_report'), {
+            'report-type': 'table', 'rooms': [self.other_room.pk],
+            'beg_date': str(MONDAY), 'end_date': str(MONDAY + timedelta(days=6))})
+        [(number, entries)] = response.context['events']
+        self.assertEqual(number, '7')
+        # The class on Tuesday comes from the class event of the group.
+        self.assertListEqual([(e.date, e.title, e.type) for e in entries], [
+            (MONDAY + timedelta(days=1), self.course_term.group.course.get_short_name(),
+             'pracownia'),
+            (MONDAY + timedelta(days=2), 'Egzamin', 'Egzamin'),
+        ])
+
+        out = StringIO()
+        call_command('export_room_usage', semester=self.semester.pk, stdout=out)
+        rows = out.getvalue().splitlines()
+        self.assertEqual(rows[0], 'room,weekday,begin,end,title,type,author')
+        self.assertIn('105,1,16:00,18:00,Seminarium,,', rows)
+        self.assertEqual(len(rows), 4)
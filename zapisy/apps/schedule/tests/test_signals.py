@@ -1,12 +1,16 @@
 from datetime import date, time
+from io import StringIO
 
 from django import test
+from django.core.management import call_command
 
 from apps.common import days_of_week
 from apps.enrollment.courses.models.semester import ChangedDay, Freeday
 from apps.enrollment.courses.models.term import Term as CourseTerm
 from apps.enrollment.courses.tests.factories import (ClassroomFactory, CourseInstanceFactory,
                                                      GroupFactory, SemesterFactory)
+from apps.schedule import class_terms
+from apps.schedule.models.event import Event
 from apps.schedule.models.term import Term
 
 
@@ -150,3 +154,58 @@ class TermModificationsOnSignalTest(test.TestCase):
             (date(2019, 5, 24), self.classrooms[1].pk),
             (date(2019, 5, 31), self.classrooms[1].pk),
         ])
+
+
+class ClassTermsSyncTest(test.TestCase):
+    """Tests bulk syncing of the class terms with the course terms."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.semester = SemesterFactory(lectures_beginning=date(2019, 5, 1),
+                                       lectures_ending=date(2019, 5, 31))
+        Freeday.objects.create(day=date(2019, 5, 9))
+        cls.classrooms = [ClassroomFactory(), ClassroomFactory()]
+        cls.groups = [GroupFactory(course__semester=cls.semester) for _ in range(3)]
+
+    def test_deferred_sync(self):
+        with class_terms.deferred():
+            for group in self.groups:
+                t = CourseTerm.objects.create(group=group, dayOfWeek=days_of_week.THURSDAY,
+                                              start_time=time(12), end_time=time(14))
+                t.classrooms.set(self.classrooms)
+            self.assertFalse(Term.objects.exists())
+        for group in self.groups:
+            self.assertCountEqual(
+                Term.objects.filter(event__group=group).values_list('day', 'room_id'), [
+                    (day, classroom.pk)
+                    for day in [date(2019, 5, 2), date(2019, 5, 16), date(2019, 5, 23),
+                                date(2019, 5, 30)]
+                    for classroom in self.classrooms
+                ])
+        self.assertEqual(Event.objects.filter(type=Event.TYPE_CLASS).count(), 3)
+
+        # Groups, course terms, the calendar, events, terms and the insert.
+        Term.objects.all().delete()
+        with self.assertNumQueries(6):
+            result = class_terms.sync_groups(group.pk for group in self.groups)
+        self.assertEqual(result, class_terms.SyncResult(created=24, deleted=0))
+
+    def test_rebuild(self):
+        t = CourseTerm.objects.create(group=self.groups[0], dayOfWeek=days_of_week.THURSDAY,
+                                      start_time=time(12), end_time=time(14))
+        t.classrooms.add(self.classrooms[0])
+        terms = Term.objects.filter(event__group=self.groups[0])
+        expected = list(terms.values_list('day', 'start', 'end', 'room_id'))
+        # The calendar changes, a term gets lost and another one duplicated.
+        Freeday.objects.create(day=date(2019, 5, 16))
+        terms.filter(day=date(2019, 5, 2)).delete()
+        duplicate = terms.get(day=date(2019, 5, 23))
+        duplicate.pk = None
+        duplicate.save()
+
+        out = StringIO()
+        call_command('rebuild_schedule_terms', semester=self.semester.pk, stdout=out)
+        self.assertIn("created 1 terms, deleted 2 terms", out.getvalue())
+        self.assertCountEqual(terms.values_list('day', 'start', 'end', 'room_id'),
+                              [term for term in expected if term[0] != date(2019, 5, 16)])
+        self.assertEqual(class_terms.rebuild(self.semester), class_terms.SyncResult(0, 0))
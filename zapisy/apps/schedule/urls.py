@@ -7,6 +7,7 @@ urlpatterns = [
     re_path(r'^classrooms/get_terms/(?P<year>[0-9]{4})-(?P<month>[0-9]{1,2})-(?P<day>[0-9]{1,2})/$',
             views.get_terms,
             name='get_terms'),
+    path('classrooms/availability/', views.availability, name='availability'),
     path('classrooms/reservation/', views.new_reservation, name='reservation'),
     path('classrooms/reservations/', views.reservations, name='reservations'),
     path('classrooms/conflicts/', views.conflicts, name='conflicts'),
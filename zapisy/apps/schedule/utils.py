@@ -1,6 +1,9 @@
 from datetime import timedelta
 
+from apps.enrollment.courses.models.semester import Semester
+
 from .fullcalendar import FullCalendarAdapter
+from .models.event import Event
 
 
 def get_week_range_by_date(date):
@@ -11,6 +14,9 @@ def get_week_range_by_date(date):
 
 
 class EventAdapter(FullCalendarAdapter):
+    row_fields = FullCalendarAdapter.row_fields + (
+        'event__visible', 'event__type', 'event__course_id', 'event__course__name',
+        'event__course__semester__year', 'event__course__semester__type')
 
     def get_backgroundColor(self, item):
 
@@ -54,6 +60,39 @@ class EventAdapter(FullCalendarAdapter):
 
         return super(EventAdapter, self).get_url(item)
 
+    def _hidden(self, row):
+        if not hasattr(self, '_can_manage'):
+            self._can_manage = self.request.user.has_perm('schedule.manage_events')
+        return not row['event__visible'] and not self._can_manage
+
+    def get_row_backgroundColor(self, row):
+        if not row['event__visible']:
+            return "#D06B64"
+        return {'0': "#7BD148", '1': "#7BD148", '2': "#B3DC6C"}.get(row['event__type'])
+
+    def get_row_borderColor(self, row):
+        if not row['event__visible']:
+            return "#924420"
+        return {'0': "#7BD148", '1': "#7BD148", '2': "#93C00B"}.get(row['event__type'])
+
+    def get_row_title(self, row):
+        if self._hidden(row):
+            return "Sala zajęta"
+        if row['event__type'] in ['0', '1']:
+            if row['event__course_id'] is None:
+                course = str(None)
+            else:
+                semester = Semester(year=row['event__course__semester__year'],
+                                    type=row['event__course__semester__type'])
+                course = f"{row['event__course__name']} ({semester})"
+            return course + " " + dict(Event.TYPES)[row['event__type']]
+        return super().get_row_title(row)
+
+    def get_row_url(self, row):
+        if self._hidden(row):
+            return None
+        return super().get_row_url(row)
+
 
 class ScheduleAdapter(EventAdapter):
     def get_url(self, item):
@@ -1,14 +1,11 @@
 import datetime
-import operator
 import json
-from itertools import groupby
-from typing import List, NamedTuple, Optional
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, permission_required
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.paginator import Paginator
-from django.http import Http404, HttpResponse
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
 from django.shortcuts import redirect, render
 from django.template.response import TemplateResponse
 from django.urls import reverse
@@ -16,19 +13,19 @@ from django.views.decorators.http import require_POST
 
 from apps.enrollment.courses.models.classroom import Classroom
 from apps.enrollment.courses.models.semester import Semester
-from apps.enrollment.courses.models.term import Term as CourseTerm
 from apps.schedule.filters import EventFilter, ExamFilter
 from apps.schedule.forms import (ConflictsForm, DecisionForm, EventForm, EventMessageForm,
                                  EventModerationMessageForm, EditTermFormSet, NewTermFormSet,
                                  ExtraTermsNumber)
 from apps.schedule.models.event import Event
-from apps.schedule.models.specialreservation import SpecialReservation
-from apps.schedule.models.term import Term
+from apps.schedule.models.term import Term, room_feed_tag, week_feed_tag
+from apps.schedule.room_occupancy import busy_periods
+from apps.schedule.room_usage import usage_report
 from apps.schedule.utils import EventAdapter, get_week_range_by_date
 from apps.notifications.custom_signals import event_decision
 
 from .forms import DoorChartForm, TableReportForm
-from .fullcalendar import FullCalendarView
+from .fullcalendar import WeeklyCachedFullCalendarView
 from .models.message import EventModerationMessage
 
 
@@ -140,8 +137,7 @@ def reservations(request):
 def conflicts(request):
     """Finds conflicts in given daterange and pass into template.
 
-    Implemented as 3D dictionary (ordered by day,classroom,hour).
-    Works better than naive regroup in template (O(nlog(n)) vs O(n^2)).
+    See `apps.schedule.conflicts` for the structure of the report.
     """
     form = ConflictsForm(request.GET)
     if form.is_valid():
@@ -262,6 +258,40 @@ def change_interested(request, event_id):
     return redirect(event)
 
 
+# Reservations are made between these hours.
+RESERVATION_DAY = (datetime.time(8), datetime.time(22))
+# Availability may be asked for at most this many days at once.
+AVAILABILITY_MAX_DAYS = 62
+
+
+def _period_dict(start: datetime.time, end: datetime.time):
+    return {'begin': start.strftime('%H:%M'), 'end': end.strftime('%H:%M')}
+
+
+def _free_periods(busy, day_start: datetime.time, day_end: datetime.time):
+    """Returns the periods between `day_start` and `day_end` not in `busy`."""
+    free = []
+    for start, end in busy:
+        if start > day_start:
+            free.append((day_start, min(start, day_end)))
+        day_start = max(day_start, end)
+        if day_start >= day_end:
+            break
+    if day_start < day_end:
+        free.append((day_start, day_end))
+    return [(start, end) for start, end in free if start < end]
+
+
+def _room_dict(room: Classroom):
+    return {
+        'id': room.id,
+        'number': room.number,
+        'capacity': room.capacity,
+        'type': room.get_type_display(),
+        'title': room.number,
+    }
+
+
 @login_required
 def get_terms(request, year, month, day):
     try:
@@ -269,73 +299,86 @@ def get_terms(request, year, month, day):
     except ValueError:
         raise Http404("URL contains invalid date.")
 
-    def make_dict(start_time, end_time):
-        return {
-            'begin': ':'.join(str(start_time).split(':')[:2]),
-            'end': ':'.join(str(end_time).split(':')[:2])
-        }
-
-    result = {}
-
     rooms = Classroom.get_in_institute(reservation=True)
-
+    busy = busy_periods(date, date)[date]
+    result = {}
     for room in rooms:
         if room.number not in result:
-            result[room.number] = {
-                'id': room.id,
-                'number': room.number,
-                'capacity': room.capacity,
-                'type': room.get_type_display(),
-                'title': room.number,
-                'occupied': []
-            }
-
-    terms = Term.objects.filter(day=date, room__in=rooms,
-                                event__status='1').select_related('room', 'event')
-    for term in terms:
-        result[term.room.number]['occupied'].append(make_dict(term.start, term.end))
-
-    # Some of the course terms fail to be represented by Event Terms which leads
-    # to conflicts. Once this mess is fixed we can remove this lines below.
-    semester = Semester.get_semester(date)
-    if semester and semester.lectures_beginning <= date <= semester.lectures_ending:
-        course_terms = CourseTerm.get_terms_for_semester(
-            semester=semester, day=date, classrooms=rooms
-        )
-        for ct in course_terms:
-            for room in ct.classrooms.all():
-                result[room.number]['occupied'].append(make_dict(ct.start_time, ct.end_time))
-
-    for key in result:
-        array = sorted(result[key]['occupied'], key=lambda k: k['begin'])
-        out = []
-        for t in array:
-            if out and out[-1]['begin'] <= t['begin'] <= out[-1]['end']:
-                out[-1]['end'] = max(out[-1]['end'], t['end'])
-            else:
-                out.append(t)
-        result[key]['occupied'] = out
+            result[room.number] = _room_dict(room)
+            result[room.number]['occupied'] = [
+                _period_dict(start, end) for start, end in busy.get(room.pk, [])
+            ]
 
     return HttpResponse(json.dumps(result), content_type="application/json")
 
 
-class ClassroomTermsAjaxView(FullCalendarView):
+@login_required
+def availability(request):
+    """Returns the occupied and free periods of reservable rooms in a range of days.
+
+    The range is given by `from` and `to` (inclusive) GET parameters in the
+    YYYY-MM-DD format. The response holds the `rooms` and, for every day in
+    `days`, the `occupied` and `free` periods (between 8:00 and 22:00) of
+    every room, keyed by the room number.
+    """
+    try:
+        first = datetime.date.fromisoformat(request.GET['from'])
+        last = datetime.date.fromisoformat(request.GET['to'])
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest("Parameters from and to must be dates (YYYY-MM-DD).")
+    if not 0 <= (last - first).days < AVAILABILITY_MAX_DAYS:
+        return HttpResponseBadRequest(
+            f"The range must be nonempty and at most {AVAILABILITY_MAX_DAYS} days long.")
+
+    rooms = {}
+    for room in Classroom.get_in_institute(reservation=True):
+        rooms.setdefault(room.number, room)
+    days = {}
+    for day, busy in sorted(busy_periods(first, last).items()):
+        days[str(day)] = {
+            number: {
+                'occupied': [_period_dict(*p) for p in busy.get(room.pk, [])],
+                'free': [_period_dict(*p) for p in _free_periods(busy.get(room.pk, []),
+                                                                 *RESERVATION_DAY)],
+            } for number, room in rooms.items()
+        }
+    return JsonResponse({
+        'rooms': {number: _room_dict(room) for number, room in rooms.items()},
+        'days': days,
+    })
+
+
+class ClassroomTermsAjaxView(WeeklyCachedFullCalendarView):
     model = Term
     adapter = EventAdapter
+    cache_name = 'classroom_feed'
+
+    def get_base_queryset(self):
+        return Term.objects.filter(room=self.room)
+
+    def get_week_tags(self, monday):
+        return [room_feed_tag(self.room.pk, monday)]
+
+    def get_week_key(self, monday):
+        return f'{self.room.pk}:{super().get_week_key(monday)}'
 
-    def get_queryset(self):
-        queryset = super(ClassroomTermsAjaxView, self).get_queryset()
-        return queryset.filter(room__slug=self.kwargs['slug'])
+    def get(self, request, *args, **kwargs):
+        self.room = Classroom.objects.filter(slug=self.kwargs['slug']).first()
+        if self.room is None:
+            return self.get_json_response('[]')
+        return super().get(request, *args, **kwargs)
 
 
-class EventsTermsAjaxView(FullCalendarView):
+class EventsTermsAjaxView(WeeklyCachedFullCalendarView):
     model = Term
     adapter = EventAdapter
+    cache_name = 'events_feed'
 
-    def get_queryset(self):
-        queryset = super(EventsTermsAjaxView, self).get_queryset()
-        queryset = queryset.filter(event__type='2', event__visible=True)
-        return queryset
+    def get_base_queryset(self):
+        return Term.objects.filter(event__type='2', event__visible=True)
+
+    def get_week_tags(self, monday):
+        return [week_feed_tag(monday)]
 
 
 @login_required
@@ -366,20 +409,6 @@ def events_report(request):
 @login_required
 @permission_required('schedule.manage_events')
 def display_report(request, form, report_type: 'Literal["table", "doors"]'):  # noqa: F821
-    class ListEvent(NamedTuple):
-        date: Optional[datetime.datetime]
-        weekday: int  # Monday is 1, Sunday is 7 like in
-        # https://docs.python.org/3/library/datetime.html#datetime.date.isoweekday.
-        begin: datetime.time
-        end: datetime.time
-        room: Classroom
-        title: str
-        type: str
-        author: str
-
-    rooms = set(Classroom.objects.filter(id__in=form.cleaned_data['rooms']))
-    events: List[ListEvent] = []
-    # Every event will regardless of its origin be translated into a ListEvent.
     beg_date = form.cleaned_data.get('beg_date', None)
     end_date = form.cleaned_data.get('end_date', None)
     semester = None
@@ -387,60 +416,10 @@ def display_report(request, form, report_type: 'Literal["table", "doors"]'):  #
         semester = Semester.get_current_semester()
     elif form.cleaned_data.get('week', None) == 'nextsem':
         semester = Semester.get_upcoming_semester()
-    if semester:
-        terms = CourseTerm.objects.filter(
-            group__course__semester=semester, classrooms__in=rooms).distinct().select_related(
-                'group__course', 'group__teacher',
-                'group__teacher__user').prefetch_related('classrooms')
-        for term in terms:
-            for r in set(term.classrooms.all()) & rooms:
-                events.append(
-                    ListEvent(date=None,
-                              weekday=int(term.dayOfWeek),
-                              begin=term.start_time,
-                              end=term.end_time,
-                              room=r,
-                              title=term.group.course.name,
-                              type=term.group.get_type_display(),
-                              author=term.group.teacher.get_full_name()))
-        terms = SpecialReservation.objects.filter(semester=semester, classroom__in=rooms).select_related('classroom')
-        for term in terms:
-            events.append(
-                ListEvent(date=None,
-                          weekday=int(term.dayOfWeek),
-                          begin=term.start_time,
-                          end=term.end_time,
-                          room=term.classroom,
-                          title=term.title,
-                          type="",
-                          author=""))
     elif 'week' in form.cleaned_data:
-        beg_date = datetime.datetime.strptime(form.cleaned_data['week'], "%Y-%m-%d")
+        beg_date = datetime.datetime.strptime(form.cleaned_data['week'], "%Y-%m-%d").date()
         end_date = beg_date + datetime.timedelta(days=6)
-    if beg_date and end_date:
-        terms = Term.objects.filter(day__gte=beg_date,
-                                    day__lte=end_date,
-                                    room__in=rooms,
-                                    event__status=Event.STATUS_ACCEPTED).select_related(
-                                        'room', 'event', 'event__group', 'event__author')
-        for term in terms:
-            events.append(
-                ListEvent(date=term.day,
-                          weekday=term.day.isoweekday(),
-                          begin=term.start,
-                          end=term.end,
-                          room=term.room,
-                          title=term.event.title or str(term.event.course) or "",
-                          type=term.event.group.get_type_display()
-                          if term.event.group else term.event.get_type_display(),
-                          author=term.event.author.get_full_name()))
-
-    if report_type == 'table':
-        events = sorted(events, key=operator.attrgetter('room.id', 'date', 'begin'))
-    else:
-        events = sorted(events, key=operator.attrgetter('room.id', 'weekday', 'begin'))
-    terms_by_room = groupby(events, operator.attrgetter('room.number'))
-    terms_by_room = sorted([(int(k), list(g)) for k, g in terms_by_room])
+    terms_by_room = usage_report(form.cleaned_data['rooms'], semester, beg_date, end_date)
 
     return render(request, f'schedule/reports/report_{report_type}.html', {
         'events': terms_by_room,
@@ -56,6 +56,7 @@ from apps.enrollment.courses.models import CourseInstance
 from apps.enrollment.courses.models.group import Group, GroupType
 from apps.enrollment.courses.models.semester import Semester
 from apps.enrollment.courses.models.term import Term
+from apps.schedule import class_terms
 from apps.schedulersync.models import TermSyncData
 from apps.schedulersync.scheduler_data import SchedulerData
 from apps.schedulersync.scheduler_mapper import SchedulerMapper, SZTerm
@@ -197,14 +198,16 @@ class Command(BaseCommand):
         rollbar.report_exc_info(level='error')
 
     def update_terms(self, mapped_terms: List[SZTerm], dont_delete_terms_flag):
-        for i, term in enumerate(mapped_terms):
-            self.stdout.write(f"Updating terms and groups -- {i}/{len(mapped_terms)}", ending='\r')
-            self.stdout.flush()
-            if term.course is not None:
-                self.create_or_update_group_and_term(term)
+        # The schedule terms of all the changed groups are synced in bulk at the end.
+        with class_terms.deferred():
+            for i, term in enumerate(mapped_terms):
+                self.stdout.write(f"Updating terms and groups -- {i}/{len(mapped_terms)}", ending='\r')
+                self.stdout.flush()
+                if term.course is not None:
+                    self.create_or_update_group_and_term(term)
 
-        if not dont_delete_terms_flag:
-            self.remove_unused_terms_groups()
+            if not dont_delete_terms_flag:
+                self.remove_unused_terms_groups()
 
     def import_from_api(self, dont_delete_terms_flag, write_to_slack_flag, interactive_flag):
         secrets_env = self.get_secrets_env()
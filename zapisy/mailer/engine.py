@@ -1,123 +1,280 @@
 import time
+import select
 import smtplib
 import logging
-from .lockfile import FileLock, AlreadyLocked, LockTimeout
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from socket import error as socket_error
 
-from mailer.models import Message, DontSendEntry, MessageLog
+from mailer.models import Message, DontSendEntry, MessageLog, QUEUE_CHANNEL
 
 from django.conf import settings
 from django.core.mail import send_mail as core_send_mail
 from django.core.mail import EmailMultiAlternatives
 from django.core import mail
+from django.db import connection as db_connection
+from django.db import transaction
 
 logger = logging.getLogger('mailer.engine')
 
 # when queue is empty, how long to wait (in seconds) before checking again
 EMPTY_QUEUE_SLEEP = getattr(settings, "MAILER_EMPTY_QUEUE_SLEEP", 30)
 
-# lock timeout value. how long to wait for the lock to become available.
-# default behavior is to never wait for the lock to be available.
-LOCK_WAIT_TIMEOUT = getattr(settings, "MAILER_LOCK_WAIT_TIMEOUT", -1)
+# how many messages a sender claims at once. other senders skip the claimed
+# messages while they are being sent.
+BATCH_SIZE = getattr(settings, "MAILER_BATCH_SIZE", 50)
+
+# after how many seconds the messages claimed by a sender which died before
+# sending them are claimed by others.
+CLAIM_TIMEOUT = getattr(settings, "MAILER_CLAIM_TIMEOUT", 600)
+
+# how many threads send_pool uses, each with its own SMTP connection.
+WORKERS = getattr(settings, "MAILER_WORKERS", 1)
+
+# at most how many messages per second are sent to the given domains, e.g.
+# {"gmail.com": 2}. other domains get DEFAULT_DOMAIN_RATE_LIMIT (0 is no limit).
+DOMAIN_RATE_LIMITS = getattr(settings, "MAILER_DOMAIN_RATE_LIMITS", {})
+DEFAULT_DOMAIN_RATE_LIMIT = getattr(settings, "MAILER_DEFAULT_DOMAIN_RATE_LIMIT", 0)
 
 EMAIL_SUBJECT_TEMPLATE = getattr(settings, "EMAIL_SUBJECT_TEMPLATE", "[ZAPISY] %s")
 
 
-def prioritize():
+def domain(address):
+    return address.rpartition('@')[2].lower()
+
+
+class DomainRateLimiter:
     """
-    Yield the messages in the queue in the order they should be sent.
+    Spaces out the messages sent to every domain, so that at most the given
+    number of messages per second go to it. Shared by the sending threads.
     """
 
-    while True:
-        while Message.objects.high_priority().count() or Message.objects.medium_priority().count():
-            while Message.objects.high_priority().count():
-                for message in Message.objects.high_priority().order_by('when_added'):
-                    yield message
-            while Message.objects.high_priority().count() == 0 and Message.objects.medium_priority().count():
-                yield Message.objects.medium_priority().order_by('when_added')[0]
-        while Message.objects.high_priority().count() == 0 and Message.objects.medium_priority(
-        ).count() == 0 and Message.objects.low_priority().count():
-            yield Message.objects.low_priority().order_by('when_added')[0]
-        if Message.objects.non_deferred().count() == 0:
-            break
+    def __init__(self, rates=None, default_rate=None):
+        self.rates = DOMAIN_RATE_LIMITS if rates is None else rates
+        self.default_rate = DEFAULT_DOMAIN_RATE_LIMIT if default_rate is None else default_rate
+        self.next_send = {}
+        self.lock = threading.Lock()
+
+    def take(self, address):
+        """
+        Reserve sending a message to the address now. Returns 0 on success,
+        or how many seconds to wait otherwise.
+        """
 
+        name = domain(address)
+        rate = self.rates.get(name, self.default_rate)
+        if not rate:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            next_send = self.next_send.get(name, now)
+            if next_send > now:
+                return next_send - now
+            self.next_send[name] = now + 1 / rate
+            return 0
 
-def send_all():
+    def throttled(self):
+        """
+        The domains no message can be sent to now, and how many seconds until
+        the first of them can be sent to again.
+        """
+
+        with self.lock:
+            now = time.monotonic()
+            waits = {name: t - now for name, t in self.next_send.items() if t > now}
+        return list(waits), min(waits.values(), default=0)
+
+
+def claim_batch(batch_size=BATCH_SIZE, exclude_domains=()):
     """
-    Send all eligible messages in the queue.
+    Claim and return the next messages to be sent, in the order they should
+    be sent. The messages are locked only for the short transaction marking
+    them as claimed, other senders skip the locked and the claimed ones, so
+    that several senders can work on the queue at once. Messages claimed
+    over CLAIM_TIMEOUT seconds ago are claimed again.
+    """
+
+    now = datetime.now()
+    with transaction.atomic():
+        messages = Message.objects.claimable(now - timedelta(seconds=CLAIM_TIMEOUT))
+        for name in exclude_domains:
+            messages = messages.exclude(to_address__iendswith='@' + name)
+        batch = list(messages.select_for_update(skip_locked=True).order_by(
+            'priority', 'when_added', 'pk')[:batch_size])
+        Message.objects.filter(pk__in=[message.pk for message in batch]).update(claimed_at=now)
+    return batch
+
+
+def send_message(message, connection, dont_send):
+    """
+    Send a claimed message, unless its address is among the dont_send ones.
+    Returns the result code and the message to be logged, the queue is
+    updated by the caller.
     """
 
-    lock = FileLock("send_mail")
+    subject = EMAIL_SUBJECT_TEMPLATE % message.subject
+    if message.to_address in dont_send:
+        logger.info("skipping email to %s as on don't send list " % message.to_address)
+        return 2, ''  # @@@ avoid using literal result code
+    try:
+        logger.info("sending message '%s' to %s" % (subject, message.to_address))
+        if not message.message_body_html:
+            core_send_mail(
+                subject, message.message_body, message.from_address, [
+                    message.to_address], connection=connection)
+        else:
+            email = EmailMultiAlternatives(
+                subject, message.message_body, message.from_address, [
+                    message.to_address], connection=connection)
+            email.attach_alternative(message.message_body_html, "text/html")
+            email.send()
+    except (socket_error, smtplib.SMTPSenderRefused, smtplib.SMTPRecipientsRefused,
+            smtplib.SMTPAuthenticationError) as err:
+        logger.info("message deferred due to failure: %s" % err)
+        return 3, str(err)  # @@@ avoid using literal result code
+    return 1, ''  # @@@ avoid using literal result code
+
+
+def send_batch(batch, connection, dont_send, counts, limiter):
+    """
+    Send the claimed messages. Every message is logged and removed from the
+    queue (or deferred, if it failed) as soon as it is sent, so a sender dying
+    midway only sends the message in flight again. Messages to domains over
+    their rate limit are given back to the queue.
+    """
 
-    logger.debug("acquiring lock...")
+    skipped = []
     try:
-        lock.acquire(LOCK_WAIT_TIMEOUT)
-    except AlreadyLocked:
-        logger.debug("lock already in place. quitting.")
-        return
-    except LockTimeout:
-        logger.debug("waiting for the lock timed out. quitting.")
-        return
-    logger.debug("acquired.")
+        for message in batch:
+            if message.to_address not in dont_send and limiter.take(message.to_address):
+                skipped.append(message.pk)
+                continue
+            result, log_message = send_message(message, connection, dont_send)
+            counts[result] += 1
+            if result == 3:
+                message.priority = '4'
+            with transaction.atomic():
+                MessageLog.objects.log(message, result, log_message)
+                if result == 3:
+                    Message.objects.filter(pk=message.pk).update(priority='4', claimed_at=None)
+                else:
+                    Message.objects.filter(pk=message.pk).delete()
+    finally:
+        if skipped:
+            Message.objects.filter(pk__in=skipped).update(claimed_at=None)
 
-    start_time = time.time()
 
-    dont_send = 0
-    deferred = 0
-    sent = 0
+def drain(dont_send, limiter, batch_size=BATCH_SIZE):
+    """
+    Send messages through a new SMTP connection until the queue is empty.
+    Returns the counts of messages by result code.
+    """
 
+    counts = {1: 0, 2: 0, 3: 0}
+    connection = mail.get_connection()
+    connection.open()
     try:
-        connection = mail.get_connection()
-        connection.open()
-        for message in prioritize():
-            subject = EMAIL_SUBJECT_TEMPLATE % message.subject
-            if DontSendEntry.objects.has_address(message.to_address):
-                logger.info("skipping email to %s as on don't send list " % message.to_address)
-                MessageLog.objects.log(message, 2)  # @@@ avoid using literal result code
-                message.delete()
-                dont_send += 1
-            else:
-                try:
-                    logger.info("sending message '%s' to %s" % (subject, message.to_address))
-                    if not message.message_body_html:
-                        core_send_mail(
-                            subject, message.message_body, message.from_address, [
-                                message.to_address], connection=connection)
-                    else:
-                        email = EmailMultiAlternatives(
-                            subject, message.message_body, message.from_address, [
-                                message.to_address], connection=connection)
-                        email.attach_alternative(message.message_body_html, "text/html")
-                        email.send()
-                    MessageLog.objects.log(message, 1)  # @@@ avoid using literal result code
-                    message.delete()
-                    sent += 1
-                except (socket_error, smtplib.SMTPSenderRefused, smtplib.SMTPRecipientsRefused,
-                        smtplib.SMTPAuthenticationError) as err:
-                    message.defer()
-                    logger.info("message deferred due to failure: %s" % err)
-                    # @@@ avoid using literal result code
-                    MessageLog.objects.log(message, 3, log_message=str(err))
-                    deferred += 1
-        connection.close()
+        while True:
+            throttled, wait = limiter.throttled()
+            batch = claim_batch(batch_size, throttled)
+            if batch:
+                send_batch(batch, connection, dont_send, counts, limiter)
+            if not batch:
+                if not throttled:
+                    return counts
+                # only messages to the throttled domains might be left.
+                time.sleep(wait)
     finally:
-        logger.debug("releasing lock...")
-        lock.release()
-        logger.debug("released.")
+        connection.close()
 
+
+def log_counts(counts, start_time):
+    elapsed = time.time() - start_time
+    total = sum(counts.values())
     logger.info("")
-    logger.info("%s sent; %s deferred; %s don't send" % (sent, deferred, dont_send))
-    logger.info("done in %.2f seconds" % (time.time() - start_time))
+    logger.info("%s sent; %s deferred; %s don't send" % (counts[1], counts[3], counts[2]))
+    logger.info("done in %.2f seconds (%.1f messages/s)" % (
+        elapsed, total / elapsed if elapsed else 0))
+    return counts[1], counts[3], counts[2]
+
+
+def send_all(batch_size=BATCH_SIZE, limiter=None):
+    """
+    Send all eligible messages in the queue.
+
+    Messages are claimed in batches, so messages of higher priority added in
+    the meantime go first in the next batch. Several senders may run at the
+    same time. The don't send list is read once per run.
+    """
+
+    start_time = time.time()
+    counts = drain(DontSendEntry.objects.addresses(), limiter or DomainRateLimiter(), batch_size)
+    return log_counts(counts, start_time)
+
+
+def send_pool(workers=WORKERS, batch_size=BATCH_SIZE, limiter=None):
+    """
+    Send all eligible messages in the queue with several threads, each with
+    its own SMTP and database connection. Works like send_all otherwise.
+    """
+
+    start_time = time.time()
+    dont_send = DontSendEntry.objects.addresses()
+    limiter = limiter or DomainRateLimiter()
+
+    def worker(_):
+        try:
+            return drain(dont_send, limiter, batch_size)
+        finally:
+            db_connection.close()
+
+    counts = {1: 0, 2: 0, 3: 0}
+    with ThreadPoolExecutor(workers) as executor:
+        for worker_counts in executor.map(worker, range(workers)):
+            for result, count in worker_counts.items():
+                counts[result] += count
+    return log_counts(counts, start_time)
+
+
+def listen():
+    """
+    Subscribe the database connection to the notifications of new messages.
+    """
 
+    with db_connection.cursor() as cursor:
+        cursor.execute("LISTEN %s" % QUEUE_CHANNEL)
 
-def send_loop():
+
+def wait_for_messages(timeout=EMPTY_QUEUE_SLEEP):
     """
-    Loop indefinitely, checking queue at intervals of EMPTY_QUEUE_SLEEP and
-    sending messages if any are on queue.
+    Wait until a message is queued, or for at most timeout seconds. listen()
+    must have been called first. Returns whether a message was queued.
     """
 
+    raw = db_connection.connection
+    raw.poll()
+    if not raw.notifies:
+        select.select([raw], [], [], timeout)
+        raw.poll()
+    notified = bool(raw.notifies)
+    raw.notifies.clear()
+    return notified
+
+
+def send_loop(workers=WORKERS):
+    """
+    Loop indefinitely, sending the queued messages whenever new ones come,
+    or at least every EMPTY_QUEUE_SLEEP seconds.
+    """
+
+    listen()
     while True:
-        while not Message.objects.all():
-            logger.debug("sleeping for %s seconds before checking queue again" % EMPTY_QUEUE_SLEEP)
-            time.sleep(EMPTY_QUEUE_SLEEP)
-        send_all()
+        if Message.objects.non_deferred().exists():
+            if workers > 1:
+                send_pool(workers)
+            else:
+                send_all()
+        # messages queued in the meantime wake the loop up right away.
+        logger.debug("waiting for at most %s seconds for new messages" % EMPTY_QUEUE_SLEEP)
+        wait_for_messages(EMPTY_QUEUE_SLEEP)
@@ -0,0 +1,35 @@
+import logging
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mailer.models import MessageLog
+
+logger = logging.getLogger('mailer.purge_mail_log')
+
+# how long the log of sent mail is kept.
+LOG_RETENTION_DAYS = getattr(settings, "MAILER_LOG_RETENTION_DAYS", 365)
+
+# how many log entries are deleted in a single query.
+DELETE_BATCH_SIZE = 10000
+
+
+class Command(BaseCommand):
+    help = ("Remove the log entries of mail sent more than the given number of days ago. "
+            "Entries are deleted in batches, so that the table is not locked for long.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=LOG_RETENTION_DAYS)
+
+    def handle(self, *args, **options):
+        until = datetime.now() - timedelta(days=options["days"])
+        removed = 0
+        while True:
+            batch = list(MessageLog.objects.older_than(until).order_by().values_list(
+                'pk', flat=True)[:DELETE_BATCH_SIZE])
+            if not batch:
+                break
+            removed += MessageLog.objects.filter(pk__in=batch).delete()[0]
+        logger.info("%s log entries removed" % removed)
+        self.stdout.write(f"Removed {removed} log entries of mail sent before {until:%Y-%m-%d %H:%M}.")
@@ -3,7 +3,7 @@ import logging
 from django.conf import settings
 from django.core.management.base import BaseCommand
 
-from mailer.engine import send_all
+from mailer.engine import WORKERS, send_all, send_loop, send_pool
 
 logger = logging.getLogger('mailer.send_mail')
 
@@ -12,12 +12,22 @@ PAUSE_SEND = getattr(settings, "MAILER_PAUSE_SEND", False)
 
 
 class Command(BaseCommand):
-    help = 'Do one pass through the mail queue, attempting to send all mail.'
+    help = ('Do one pass through the mail queue, attempting to send all mail. With --loop, '
+            'keep sending the mail as it is queued.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=WORKERS,
+                            help='number of threads sending mail, each with its own connection')
+        parser.add_argument('--loop', action='store_true')
 
     def handle(self, *args, **options):
         logger.info("-" * 72)
         # if PAUSE_SEND is turned on don't do anything.
-        if not PAUSE_SEND:
-            send_all()
-        else:
+        if PAUSE_SEND:
             logger.info("sending is paused, quitting.")
+        elif options['loop']:
+            send_loop(options['workers'])
+        elif options['workers'] > 1:
+            send_pool(options['workers'])
+        else:
+            send_all()
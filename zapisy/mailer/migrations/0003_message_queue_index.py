@@ -0,0 +1,17 @@
+# Generated by Django 3.1.5 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailer', '0002_auto_20180525_0559'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['priority', 'when_added'], name='mailer_message_queue_idx'),
+        ),
+    ]
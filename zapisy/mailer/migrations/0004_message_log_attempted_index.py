@@ -0,0 +1,17 @@
+# Generated by Django 3.1.5 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailer', '0003_message_queue_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='messagelog',
+            index=models.Index(fields=['when_attempted'], name='mailer_log_attempted_idx'),
+        ),
+    ]
@@ -1,7 +1,12 @@
 from datetime import datetime
 
-from django.db import models
+from django.db import connection, models
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 
+# the channel the senders listen on for new messages.
+QUEUE_CHANNEL = 'mailer_queue'
 
 PRIORITIES = (
     ('1', 'wysoki'),
@@ -41,6 +46,15 @@ class MessageManager(models.Manager):
 
         return self.filter(priority__lt='4')
 
+    def claimable(self, claimed_before):
+        """
+        the messages in the queue not deferred and not being sent, or claimed
+        by a sender before the given time (which must have died since)
+        """
+
+        return self.non_deferred().filter(
+            Q(claimed_at__isnull=True) | Q(claimed_at__lt=claimed_before))
+
     def deferred(self):
         """
         the deferred messages in the queue
@@ -71,12 +85,17 @@ class Message(models.Model):
         choices=PRIORITIES,
         default='2',
         verbose_name='priorytet')
+    # when a sender claimed the message to send it, see engine.claim_batch
+    claimed_at = models.DateTimeField(null=True, blank=True, editable=False,
+                                      verbose_name='wysyłana od')
     # @@@ campaign?
     # @@@ content_type?
 
     class Meta:
         verbose_name = 'wiadomość'
         verbose_name_plural = 'wiadomości'
+        # the order in which the queue is sent
+        indexes = [models.Index(fields=['priority', 'when_added'], name='mailer_message_queue_idx')]
 
     def defer(self):
         self.priority = '4'
@@ -98,10 +117,14 @@ class DontSendEntryManager(models.Manager):
         is the given address on the don't send list?
         """
 
-        if self.filter(to_address=address).count() > 0:  # @@@ is there a better way?
-            return True
-        else:
-            return False
+        return self.filter(to_address=address).exists()
+
+    def addresses(self):
+        """
+        all the addresses on the don't send list
+        """
+
+        return set(self.values_list('to_address', flat=True))
 
 
 class DontSendEntry(models.Model):
@@ -134,7 +157,16 @@ class MessageLogManager(models.Manager):
         record the given result and (optionally) a log message
         """
 
-        message_log = self.create(
+        message_log = self.entry(message, result_code, log_message)
+        message_log.save()
+        return message_log
+
+    def entry(self, message, result_code, log_message=''):
+        """
+        an unsaved log entry for an attempt to send the given message
+        """
+
+        return self.model(
             to_address=message.to_address,
             from_address=message.from_address,
             subject=message.subject,
@@ -146,7 +178,13 @@ class MessageLogManager(models.Manager):
             result=result_code,
             log_message=log_message,
         )
-        message_log.save()
+
+    def older_than(self, when):
+        """
+        the log entries of attempts made before the given time
+        """
+
+        return self.filter(when_attempted__lt=when)
 
 
 class MessageLog(models.Model):
@@ -171,3 +209,17 @@ class MessageLog(models.Model):
     class Meta:
         verbose_name = 'log'
         verbose_name_plural = 'logi'
+        # old entries are removed by the purge_mail_log command
+        indexes = [models.Index(fields=['when_attempted'], name='mailer_log_attempted_idx')]
+
+
+@receiver(post_save, sender=Message)
+def notify_senders(sender, instance, **kwargs):
+    """
+    wake up the waiting senders (see engine.send_loop) when a message is
+    queued. the notification is delivered once the transaction commits.
+    """
+
+    if instance.priority != '4' and connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("NOTIFY %s" % QUEUE_CHANNEL)
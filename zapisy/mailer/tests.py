@@ -0,0 +1,177 @@
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from freezegun import freeze_time
+
+from mailer.engine import CLAIM_TIMEOUT, DomainRateLimiter, claim_batch, listen, send_all, send_pool, wait_for_messages
+from mailer.models import DontSendEntry, Message, MessageLog
+
+WHEN = datetime(2026, 10, 1, 12, 0)
+
+
+def queue(subject, priority='2', minutes=0, to_address='student@example.com'):
+    return Message.objects.create(to_address=to_address, from_address='zapisy@example.com',
+                                  subject=subject, message_body=subject, priority=priority,
+                                  when_added=WHEN + timedelta(minutes=minutes))
+
+
+class SendAllTestCase(TestCase):
+    def test_sends_by_priority_and_age(self):
+        queue('niski', priority='3')
+        queue('średni 2', minutes=2)
+        queue('średni 1', minutes=1)
+        queue('wysoki', priority='1', minutes=3)
+        queue('odroczony', priority='4')
+        queue('zablokowany', priority='1', to_address='blocked@example.com')
+        DontSendEntry.objects.create(to_address='blocked@example.com', when_added=WHEN)
+        mail.outbox = []
+
+        with self.assertLogs('mailer.engine', 'INFO') as logs:
+            self.assertEqual(send_all(batch_size=2), (4, 0, 1))
+        self.assertListEqual([m.subject for m in mail.outbox], [
+            '[ZAPISY] wysoki', '[ZAPISY] średni 1', '[ZAPISY] średni 2', '[ZAPISY] niski'])
+        self.assertIn('messages/s', logs.output[-1])
+        self.assertQuerysetEqual(Message.objects.all(), ['odroczony'], lambda m: m.subject)
+        self.assertEqual(MessageLog.objects.filter(result='1').count(), 4)
+        self.assertEqual(MessageLog.objects.filter(result='2').count(), 1)
+
+    def test_queries_per_message(self):
+        for i in range(20):
+            queue(f'wiadomość {i}', minutes=i)
+        DontSendEntry.objects.create(to_address='blocked@example.com', when_added=WHEN)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(send_all(batch_size=20), (20, 0, 0))
+        # a log insert and a delete in a transaction (a savepoint here) per
+        # message, the don't send list, the claim and the empty claim
+        self.assertLessEqual(len(queries), 4 * 20 + 1 + 4 + 3)
+        self.assertEqual(MessageLog.objects.count(), 20)
+
+    def test_sender_dying_midway_sends_nothing_twice(self):
+        for i in range(5):
+            queue(f'wiadomość {i}', minutes=i)
+        mail.outbox = []
+
+        def send_mail(subject, body, from_address, to, connection):
+            if subject == '[ZAPISY] wiadomość 2':
+                raise SystemExit
+            mail.EmailMessage(subject, body, from_address, to, connection=connection).send()
+
+        with mock.patch('mailer.engine.core_send_mail', side_effect=send_mail):
+            with self.assertRaises(SystemExit):
+                send_all()
+        self.assertQuerysetEqual(MessageLog.objects.order_by('pk'), ['wiadomość 0', 'wiadomość 1'],
+                                 lambda m: m.subject)
+        # the rest stays claimed by the dead sender until the claim times out.
+        self.assertEqual(send_all(), (0, 0, 0))
+        with freeze_time(datetime.now() + timedelta(seconds=CLAIM_TIMEOUT + 1)):
+            self.assertEqual(send_all(), (3, 0, 0))
+        self.assertListEqual([m.subject for m in mail.outbox], [
+            f'[ZAPISY] wiadomość {i}' for i in [0, 1, 2, 3, 4]])
+        self.assertFalse(Message.objects.exists())
+
+    def test_failed_messages_are_deferred(self):
+        queue('do odroczenia', to_address='wrong@example.com')
+        queue('poprawna', minutes=1)
+        refused = smtplib.SMTPRecipientsRefused({'wrong@example.com': (550, b'no')})
+
+        def send_mail(subject, body, from_address, to, connection):
+            if to == ['wrong@example.com']:
+                raise refused
+
+        with mock.patch('mailer.engine.core_send_mail', side_effect=send_mail):
+            self.assertEqual(send_all(), (1, 1, 0))
+        self.assertQuerysetEqual(Message.objects.deferred(), ['do odroczenia'], lambda m: m.subject)
+        log = MessageLog.objects.get(result='3')
+        self.assertEqual(log.priority, '4')
+        self.assertEqual(log.log_message, str(refused))
+
+    def test_purge_mail_log(self):
+        old, new = queue('stara'), queue('nowa')
+        MessageLog.objects.entry(old, 1).save()
+        MessageLog.objects.filter(subject='stara').update(when_attempted=datetime.now() - timedelta(days=400))
+        MessageLog.objects.entry(new, 1).save()
+        out = StringIO()
+        call_command('purge_mail_log', days=365, stdout=out)
+        self.assertIn('Removed 1 log entries', out.getvalue())
+        self.assertQuerysetEqual(MessageLog.objects.all(), ['nowa'], lambda m: m.subject)
+
+    def test_domain_rate_limit(self):
+        for i in range(3):
+            queue(f'wolna {i}', minutes=i, to_address=f'user{i}@Slow.example.org')
+        for i in range(3):
+            queue(f'szybka {i}', minutes=10 + i)
+        mail.outbox = []
+        start = time.monotonic()
+        send_all(limiter=DomainRateLimiter({'slow.example.org': 20}))
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        subjects = [m.subject for m in mail.outbox]
+        self.assertEqual(len(subjects), 6)
+        self.assertLess(subjects.index('[ZAPISY] szybka 2'), subjects.index('[ZAPISY] wolna 2'))
+
+
+class ConcurrentSendersTestCase(TransactionTestCase):
+    def test_claimed_messages_are_skipped(self):
+        queue('pierwszy', priority='1')
+        for i in range(3):
+            queue(f'kolejny {i}', minutes=i)
+        mail.outbox = []
+        claimed = threading.Event()
+        release = threading.Event()
+
+        def other_sender():
+            try:
+                with transaction.atomic():
+                    claim_batch(1)
+                    claimed.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=other_sender)
+        thread.start()
+        try:
+            self.assertTrue(claimed.wait(10))
+            self.assertEqual(send_all(), (3, 0, 0))
+        finally:
+            release.set()
+            thread.join()
+        self.assertNotIn('[ZAPISY] pierwszy', [m.subject for m in mail.outbox])
+        self.assertQuerysetEqual(Message.objects.all(), ['pierwszy'], lambda m: m.subject)
+
+    def test_pool_sends_every_message_once(self):
+        for i in range(40):
+            queue(f'wiadomość {i}', minutes=i)
+        mail.outbox = []
+        self.assertEqual(send_pool(workers=4, batch_size=3), (40, 0, 0))
+        self.assertCountEqual([m.subject for m in mail.outbox],
+                              [f'[ZAPISY] wiadomość {i}' for i in range(40)])
+        self.assertEqual(MessageLog.objects.count(), 40)
+
+    def test_new_messages_wake_senders(self):
+        listen()
+        self.assertFalse(wait_for_messages(0.1))
+
+        def add_message():
+            try:
+                time.sleep(0.2)
+                queue('nowa')
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=add_message)
+        thread.start()
+        start = time.monotonic()
+        try:
+            self.assertTrue(wait_for_messages(10))
+        finally:
+            thread.join()
+        self.assertLess(time.monotonic() - start, 5)
@@ -29,7 +29,12 @@ EMAIL_HOST_USER = env.str('EMAIL_HOST_USER', default='')
 EMAIL_HOST_PASSWORD = env.str('EMAIL_HOST_PASSWORD', default='')
 EMAIL_PORT = env.int('EMAIL_PORT', default=25)
 SERVER_EMAIL = env.str('SERVER_EMAIL', default='root@localhost')
-EMAIL_THROTTLE_SECONDS = env.int('EMAIL_THROTTLE_SECONDS', default=0)
+# Notifications are sent in digests of everything a user was notified of
+# within the window. E-mails are sent at most EMAIL_RATE_LIMIT per second (0
+# means no limit), with bursts of at most EMAIL_RATE_BURST e-mails.
+NOTIFICATIONS_DIGEST_WINDOW = env.int('NOTIFICATIONS_DIGEST_WINDOW', default=60)
+EMAIL_RATE_LIMIT = env.float('EMAIL_RATE_LIMIT', default=0)
+EMAIL_RATE_BURST = env.int('EMAIL_RATE_BURST', default=10)
 
 # django-environ doesn't support nested arrays, but decoding json objects works fine
 ARRAY_VALS = env.json('ARRAY_VALS', {})
@@ -289,6 +294,9 @@ ECTS_BONUS = 2
 # Then, after abolition time, students can enroll into some additional courses.
 ECTS_INITIAL_LIMIT = 35
 ECTS_FINAL_LIMIT = 45
+# Maximal number of students pulled from a group's queue in a single
+# transaction. Setting it to 0 makes every pull a separate transaction.
+ENROLLMENT_DRAIN_BATCH_SIZE = env.int('ENROLLMENT_DRAIN_BATCH_SIZE', default=20)
 
 VOTE_LIMIT = 60
 